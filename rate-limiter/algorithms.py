@@ -0,0 +1,219 @@
+# Fulfills: REQ-RL-001 (allow decisions under alternative limiting algorithms)
+# Fulfills: REQ-RL-002 (deny decisions with retry_after under alternative limiting algorithms)
+# Fulfills: REQ-RL-005 (algorithm chosen per tier)
+"""Limiting algorithms behind one interface: create(config, now) and consume(state, now, cost).
+
+All of them read capacity and refill_rate from BucketConfig and return
+(allowed, remaining, retry_after) like try_consume:
+
+- token_bucket: the reference algorithm in token_bucket.py.
+- gcra: the same decisions as a token bucket, kept as one theoretical arrival
+  time per user. The two round differently, so a request within rounding error
+  of the refill boundary may go either way. Requests arriving out of order are
+  measured from their own time.
+- sliding_log: at most capacity cost in any window of capacity / refill_rate
+  seconds, exactly; stores one entry per admitted request in the window.
+- sliding_window: the sliding_log limit estimated from two fixed-window
+  counters (the previous window weighted by its overlap); constant state.
+
+is_idle(state, now) is True when the state decides every later request exactly
+like a freshly created one, so idle eviction stays exact for every algorithm.
+refund(state, granted_at, cost) gives back a grant its caller never used.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from token_bucket import BucketConfig, TokenBucket, check_cost, create_bucket, try_consume
+
+
+@dataclass
+class GcraState:
+    config: BucketConfig
+    tat: float                         # theoretical arrival time: when the equivalent bucket is full again
+    generation: int = 0
+
+
+@dataclass
+class SlidingLogState:
+    config: BucketConfig
+    entries: deque = field(default_factory=deque)     # (time, cost) of admitted requests, oldest first
+    used: float = 0.0                                 # total cost of entries
+    generation: int = 0
+
+
+@dataclass
+class SlidingWindowState:
+    config: BucketConfig
+    window: int                        # index of the current fixed window: floor(time / window length)
+    current: float = 0.0               # cost admitted in the current window
+    previous: float = 0.0              # cost admitted in the window before it
+    generation: int = 0
+
+
+@dataclass(frozen=True)
+class Algorithm:
+    create: Callable[[BucketConfig, float], object]
+    consume: Callable[[object, float, float], tuple[bool, float, float | None]]
+    is_idle: Callable[[object, float], bool]
+    refund: Callable[[object, float, float], None]
+
+
+def bucket_is_full(bucket: TokenBucket, now: float) -> bool:
+    """True if a refill at now would reach capacity."""
+    return bucket.tokens + (now - bucket.last_refill) * bucket.config.refill_rate >= bucket.config.capacity
+
+
+def bucket_refund(bucket: TokenBucket, granted_at: float, cost: float) -> None:
+    """Put cost tokens back, up to capacity."""
+    bucket.tokens = min(bucket.config.capacity, bucket.tokens + cost)
+
+
+def create_gcra(config: BucketConfig, now: float) -> GcraState:
+    """A GCRA state with a full burst available."""
+    return GcraState(config=config, tat=now)
+
+
+def gcra_consume(state: GcraState, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Allow if the arrival time pushed forward by cost stays within capacity / refill_rate of now."""
+    config = state.config
+    if cost != 1.0:
+        check_cost(cost, config)
+    tat = state.tat if state.tat > now else now
+    new_tat = tat + cost / config.refill_rate
+    limit = now + config.capacity / config.refill_rate
+    if new_tat <= limit:
+        state.tat = new_tat
+        return (True, (limit - new_tat) * config.refill_rate, None)
+    return (False, (limit - tat) * config.refill_rate, new_tat - limit)
+
+
+def gcra_is_idle(state: GcraState, now: float) -> bool:
+    return state.tat <= now
+
+
+def gcra_refund(state: GcraState, granted_at: float, cost: float) -> None:
+    state.tat -= cost / state.config.refill_rate
+
+
+def create_sliding_log(config: BucketConfig, now: float) -> SlidingLogState:
+    """An empty request log."""
+    return SlidingLogState(config=config)
+
+
+def sliding_log_consume(state: SlidingLogState, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Drop entries older than one window, then allow if the window's total plus cost fits capacity.
+
+    A request older than the newest entry is treated as arriving with it.
+    """
+    config = state.config
+    if cost != 1.0:
+        check_cost(cost, config)
+    window = config.capacity / config.refill_rate
+    entries = state.entries
+    if entries and now < entries[-1][0]:
+        now = entries[-1][0]
+    start = now - window
+    while entries and entries[0][0] <= start:
+        state.used -= entries.popleft()[1]
+    if not entries:
+        state.used = 0.0
+
+    if state.used + cost <= config.capacity:
+        entries.append((now, cost))
+        state.used += cost
+        return (True, config.capacity - state.used, None)
+
+    need = state.used + cost - config.capacity
+    freed = 0.0
+    for stamp, entry_cost in entries:
+        freed += entry_cost
+        if freed >= need:
+            return (False, config.capacity - state.used, stamp + window - now)
+    return (False, config.capacity - state.used, entries[-1][0] + window - now)
+
+
+def sliding_log_is_idle(state: SlidingLogState, now: float) -> bool:
+    entries = state.entries
+    return not entries or entries[-1][0] <= now - state.config.capacity / state.config.refill_rate
+
+
+def sliding_log_refund(state: SlidingLogState, granted_at: float, cost: float) -> None:
+    """Drop the grant's entry, unless it has already left the window."""
+    entries = state.entries
+    for i in range(len(entries) - 1, -1, -1):
+        if entries[i] == (granted_at, cost):
+            del entries[i]
+            state.used = state.used - cost if entries else 0.0
+            return
+
+
+def create_sliding_window(config: BucketConfig, now: float) -> SlidingWindowState:
+    """Empty counters, with windows aligned to multiples of capacity / refill_rate seconds."""
+    return SlidingWindowState(config=config, window=int(now // (config.capacity / config.refill_rate)))
+
+
+def sliding_window_consume(
+    state: SlidingWindowState, now: float, cost: float = 1.0
+) -> tuple[bool, float, float | None]:
+    """Allow if previous x (unelapsed share of the current window) + current + cost fits capacity.
+
+    A request from an earlier window is counted in the current one, at its start.
+    """
+    config = state.config
+    if cost != 1.0:
+        check_cost(cost, config)
+    capacity = config.capacity
+    length = capacity / config.refill_rate
+    position = now / length
+    index = int(position // 1)
+    if index > state.window:
+        state.previous = state.current if index == state.window + 1 else 0.0
+        state.current = 0.0
+        state.window = index
+    elapsed = position - state.window if index >= state.window else 0.0
+
+    estimate = state.previous * (1.0 - elapsed) + state.current
+    if estimate + cost <= capacity:
+        state.current += cost
+        return (True, capacity - estimate - cost, None)
+
+    current = state.current
+    if current + cost <= capacity and state.previous > 0:
+        ready = state.window + 1.0 - (capacity - current - cost) / state.previous
+    elif current > 0:
+        ready = state.window + 1.0 + max(0.0, 1.0 - (capacity - cost) / current)
+    else:
+        ready = state.window + 1.0
+    return (False, max(0.0, capacity - estimate), ready * length - now)
+
+
+def sliding_window_is_idle(state: SlidingWindowState, now: float) -> bool:
+    return int(now // (state.config.capacity / state.config.refill_rate)) >= state.window + 2 or (
+        state.current == 0.0 and state.previous == 0.0
+    )
+
+
+def sliding_window_refund(state: SlidingWindowState, granted_at: float, cost: float) -> None:
+    """Take cost off the counter of the grant's window, unless that window is older than the previous one."""
+    index = int(granted_at / (state.config.capacity / state.config.refill_rate) // 1)
+    if index == state.window:
+        state.current = max(0.0, state.current - cost)
+    elif index == state.window - 1:
+        state.previous = max(0.0, state.previous - cost)
+
+
+ALGORITHMS: dict[str, Algorithm] = {
+    "token_bucket": Algorithm(create=create_bucket, consume=try_consume, is_idle=bucket_is_full, refund=bucket_refund),
+    "gcra": Algorithm(create=create_gcra, consume=gcra_consume, is_idle=gcra_is_idle, refund=gcra_refund),
+    "sliding_log": Algorithm(
+        create=create_sliding_log, consume=sliding_log_consume, is_idle=sliding_log_is_idle, refund=sliding_log_refund,
+    ),
+    "sliding_window": Algorithm(
+        create=create_sliding_window, consume=sliding_window_consume, is_idle=sliding_window_is_idle,
+        refund=sliding_window_refund,
+    ),
+}
@@ -0,0 +1,124 @@
+# Fulfills: REQ-RL-002 (retry_after tells a waiting caller exactly when to come back)
+"""Awaitable limiter: `await acquire(limiter, user, cost)` waits for tokens instead of being denied.
+
+Waiters queue per user in FIFO order. Only the head of each queue is scheduled,
+on one heap of (deadline, user) entries driven by one event-loop timer, so
+pending waiters cost no CPU until the earliest deadline arrives. The tracker
+is checked with loop.time() as the clock.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+from collections import deque
+from dataclasses import dataclass, field
+
+from quota_tracker import QuotaTracker, check_request, check_user_cost, refund_request
+
+
+@dataclass
+class AsyncLimiter:
+    tracker: QuotaTracker
+    loop: asyncio.AbstractEventLoop
+    waiters: dict[str, deque] = field(default_factory=dict)      # user -> deque of (future, cost)
+    heap: list[tuple[float, str]] = field(default_factory=list)  # (deadline, user); may hold stale entries
+    deadlines: dict[str, float] = field(default_factory=dict)    # user -> deadline of their live heap entry
+    timer: asyncio.TimerHandle | None = None
+    timer_when: float = float("inf")
+
+
+def create_async_limiter(tracker: QuotaTracker) -> AsyncLimiter:
+    """Wrap tracker for the running event loop. Do not check the same tracker with another clock."""
+    return AsyncLimiter(tracker=tracker, loop=asyncio.get_running_loop())
+
+
+async def acquire(limiter: AsyncLimiter, user: str, cost: float = 1.0) -> float:
+    """Wait until cost tokens can be taken for user, take them, and return the tokens remaining.
+
+    A caller never overtakes an earlier waiter for the same user. Cancelling a
+    waiter removes it from the queue without charging it; if it was at the head,
+    the next waiter is reconsidered at once. A waiter cancelled after it was
+    granted, but before it resumed, gives its tokens back (refund_request) and
+    the next waiter is reconsidered too. Raises ValueError if cost is not
+    positive or exceeds a capacity, since such a request could never be granted;
+    unlike check_request, that includes the default cost of 1 on a capacity below 1.
+    """
+    check_user_cost(limiter.tracker.config, user, cost)
+    queue = limiter.waiters.get(user)
+    if queue is None:
+        now = limiter.loop.time()
+        allowed, remaining, retry_after = check_request(limiter.tracker, user, now, cost)
+        if allowed:
+            return remaining
+        queue = limiter.waiters[user] = deque()
+        _schedule(limiter, user, now + retry_after)
+
+    future = limiter.loop.create_future()                       # result: (remaining, time granted)
+    queue.append((future, cost))
+    try:
+        remaining, _ = await future
+        return remaining
+    except asyncio.CancelledError:
+        if future.done() and not future.cancelled():
+            refund_request(limiter.tracker, user, future.result()[1], cost)
+            _drain(limiter, user)
+        elif queue and queue[0][0] is future:
+            _drain(limiter, user)
+        raise
+
+
+def pending(limiter: AsyncLimiter) -> int:
+    """Number of queued waiters, including cancelled ones not yet dropped from their queue."""
+    return sum(len(queue) for queue in limiter.waiters.values())
+
+
+def _drain(limiter: AsyncLimiter, user: str) -> None:
+    """Grant the user's waiters in order while tokens last, then schedule the next head or drop the queue."""
+    queue = limiter.waiters.get(user)
+    if queue is None:
+        return
+    while queue:
+        future, cost = queue[0]
+        if future.done():                       # cancelled while waiting
+            queue.popleft()
+            continue
+        now = limiter.loop.time()
+        allowed, remaining, retry_after = check_request(limiter.tracker, user, now, cost)
+        if not allowed:
+            _schedule(limiter, user, now + retry_after)
+            return
+        queue.popleft()
+        future.set_result((remaining, now))
+    del limiter.waiters[user]
+    limiter.deadlines.pop(user, None)
+
+
+def _schedule(limiter: AsyncLimiter, user: str, deadline: float) -> None:
+    """Make deadline the user's next wake-up; any earlier heap entry for the user goes stale."""
+    limiter.deadlines[user] = deadline
+    heapq.heappush(limiter.heap, (deadline, user))
+    _arm(limiter)
+
+
+def _arm(limiter: AsyncLimiter) -> None:
+    """Point the single timer at the earliest heap entry if it is not already set earlier."""
+    if limiter.heap and limiter.heap[0][0] < limiter.timer_when:
+        if limiter.timer is not None:
+            limiter.timer.cancel()
+        limiter.timer_when = limiter.heap[0][0]
+        limiter.timer = limiter.loop.call_at(limiter.timer_when, _on_timer, limiter)
+
+
+def _on_timer(limiter: AsyncLimiter) -> None:
+    """Drain every user whose deadline has passed, skipping stale entries, then re-arm the timer."""
+    limiter.timer = None
+    limiter.timer_when = float("inf")
+    heap = limiter.heap
+    now = limiter.loop.time()
+    while heap and heap[0][0] <= now:
+        deadline, user = heapq.heappop(heap)
+        if limiter.deadlines.get(user) == deadline:
+            del limiter.deadlines[user]
+            _drain(limiter, user)
+    _arm(limiter)
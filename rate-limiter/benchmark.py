@@ -0,0 +1,1199 @@
+# Fulfills: Performance measurement (outside the behavioral spec)
+"""Benchmarks: measure memory and speed of the rate limiter, one JSON line per measurement."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from itertools import accumulate
+from pathlib import Path
+
+from token_bucket import BucketConfig
+from algorithms import ALGORITHMS
+from quota_tracker import QuotaConfig, create_tracker, check_request, check_requests
+from async_limiter import acquire, create_async_limiter
+from columnar_tracker import create_columnar_tracker, check_request as check_request_columnar
+from concurrent_tracker import create_concurrent_tracker, check_request as check_request_concurrent
+from shared_tracker import create_shared_tracker, close_shared_tracker, check_request as check_request_shared
+from storage_backend import MemoryBackend, create_backend_tracker
+from storage_backend import check_request as check_request_backend, check_requests as check_requests_backend
+from redis_backend import RespBackend
+from fake_redis import start_fake_redis, stop_fake_redis
+from metrics import create_metrics, check_request as check_request_metered, check_requests as check_requests_metered
+from lease_cache import create_lease_tracker, check_request as check_request_leased
+from deny_cache import create_deny_cache, check_request as check_request_deny_cached
+from snapshot import begin_snapshot, finish_snapshot, open_snapshot, snapshot_step
+from request_trace import write_trace
+from config_loader import dump_config, load_config_file
+from user_index import write_user_index
+from coarse_clock import create_coarse_clock, tick
+from server import answer_lines
+from rate_limiter import convert_scenario, run_scenario, stream_scenario, write_scenario
+from validate import SCENARIOS, compare_results
+
+
+DEFAULT_CONFIG = QuotaConfig(default=BucketConfig(capacity=5, refill_rate=1.0), users={})
+
+LAYOUTS = {
+    "dict": (create_tracker, check_request),
+    "columnar": (create_columnar_tracker, check_request_columnar),
+}
+
+
+def make_users(count: int) -> list[str]:
+    """Build distinct user IDs up front so their strings are not charged to any layout."""
+    return [f"user-{i}" for i in range(count)]
+
+
+def measure_registry_bytes(layout: str, users: list[str]) -> int:
+    """Fill a fresh tracker with one request per user and return the bytes it still holds."""
+    create, check = LAYOUTS[layout]
+    tracemalloc.start()
+    tracker = create(DEFAULT_CONFIG)
+    for user in users:
+        check(tracker, user, 0.0)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tracker
+    return size
+
+
+def bench_memory(user_counts: list[int]) -> list[dict]:
+    """Compare registry memory of every layout at each user count."""
+    results = []
+    for count in user_counts:
+        users = make_users(count)
+        for layout in LAYOUTS:
+            size = measure_registry_bytes(layout, users)
+            results.append({
+                "benchmark": "memory",
+                "layout": layout,
+                "users": count,
+                "bytes": size,
+                "bytes_per_user": round(size / count, 1),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def make_requests(count: int, user_count: int, seed: int = 1) -> tuple[list[str], list[float]]:
+    """Build a seeded stream of requests over user_count users with steadily advancing time."""
+    rng = random.Random(seed)
+    users = [f"user-{rng.randrange(user_count)}" for _ in range(count)]
+    times = [i * 0.001 for i in range(count)]
+    return (users, times)
+
+
+def bench_batch(count: int, user_count: int, batch_size: int) -> list[dict]:
+    """Compare decisions/sec of per-request check_request against check_requests micro-batches."""
+    users, times = make_requests(count, user_count)
+
+    tracker = create_tracker(DEFAULT_CONFIG)
+    start = time.perf_counter()
+    for user, now in zip(users, times):
+        check_request(tracker, user, now)
+    sequential = time.perf_counter() - start
+
+    tracker = create_tracker(DEFAULT_CONFIG)
+    start = time.perf_counter()
+    for i in range(0, count, batch_size):
+        check_requests(tracker, users[i:i + batch_size], times[i:i + batch_size])
+    batched = time.perf_counter() - start
+
+    results = [
+        {"benchmark": "batch", "mode": "sequential", "requests": count, "users": user_count,
+         "decisions_per_sec": round(count / sequential)},
+        {"benchmark": "batch", "mode": "batched", "requests": count, "users": user_count,
+         "batch_size": batch_size, "decisions_per_sec": round(count / batched)},
+    ]
+    for result in results:
+        print(json.dumps(result), flush=True)
+    return results
+
+
+def bench_algorithms(count: int, user_count: int, memory_users: int) -> list[dict]:
+    """Decisions/sec and registry bytes per user for each algorithm under DEFAULT_CONFIG's limits.
+
+    Memory is measured after every user has sent capacity requests at once, the
+    most state a sliding log can hold for them.
+    """
+    users, times = make_requests(count, user_count)
+    filled = make_users(memory_users)
+    capacity = int(DEFAULT_CONFIG.default.capacity)
+    results = []
+    for algorithm in ALGORITHMS:
+        default = BucketConfig(DEFAULT_CONFIG.default.capacity, DEFAULT_CONFIG.default.refill_rate, algorithm)
+        config = QuotaConfig(default=default, users={})
+
+        tracker = create_tracker(config)
+        allowed = 0
+        start = time.perf_counter()
+        for user, now in zip(users, times):
+            allowed += check_request(tracker, user, now)[0]
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        tracker = create_tracker(config)
+        for user in filled:
+            for _ in range(capacity):
+                check_request(tracker, user, 0.0)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del tracker
+
+        results.append({
+            "benchmark": "algorithms", "algorithm": algorithm, "requests": count, "users": user_count,
+            "allowed": allowed, "decisions_per_sec": round(count / elapsed),
+            "bytes_per_user": round(size / memory_users, 1),
+        })
+        print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_metrics(count: int, batch_size: int) -> list[dict]:
+    """Decisions/sec with metrics off and on, per request and batched, on the uniform and zipf workloads.
+
+    Each figure is the best of TIMED_PASSES runs, alternating off and on so drift hits both alike.
+    """
+    def single(users: list[str], times: list[float], metered: bool) -> float:
+        tracker = create_tracker(DEFAULT_CONFIG)
+        target, check = (create_metrics(tracker), check_request_metered) if metered else (tracker, check_request)
+        start = time.perf_counter()
+        for user, now in zip(users, times):
+            check(target, user, now)
+        return time.perf_counter() - start
+
+    def batched(users: list[str], times: list[float], metered: bool) -> float:
+        tracker = create_tracker(DEFAULT_CONFIG)
+        target, check = (create_metrics(tracker), check_requests_metered) if metered else (tracker, check_requests)
+        start = time.perf_counter()
+        for i in range(0, count, batch_size):
+            check(target, users[i:i + batch_size], times[i:i + batch_size])
+        return time.perf_counter() - start
+
+    results = []
+    for workload in ("uniform", "zipf"):
+        users, times = WORKLOADS[workload](count, random.Random(1))
+        for mode, run in (("single", single), ("batched", batched)):
+            best = {False: float("inf"), True: float("inf")}
+            for _ in range(TIMED_PASSES):
+                for metered in (False, True):
+                    best[metered] = min(best[metered], run(users, times, metered))
+            results.append({
+                "benchmark": "metrics", "workload": workload, "mode": mode, "requests": count,
+                "off_decisions_per_sec": round(count / best[False]),
+                "on_decisions_per_sec": round(count / best[True]),
+                "overhead_pct": round(100 * (best[True] / best[False] - 1), 1),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_replay(count: int, workload: str) -> list[dict]:
+    """Scenario replay per input format: in-process requests/sec, then the whole CLI run with printing.
+
+    The same requests are written as a JSON scenario, as NDJSON, and converted
+    to a binary trace; each figure is the best of TIMED_PASSES runs.
+    """
+    users, times = WORKLOADS[workload](count, random.Random(1))
+    config = dump_config(DEFAULT_CONFIG)
+    script = Path(__file__).parent / "rate_limiter.py"
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "scenario.json")
+        ndjson_path = os.path.join(tmp, "scenario.ndjson")
+        trace_path = os.path.join(tmp, "scenario.trace")
+        requests = [{"user": user, "time": now} for user, now in zip(users, times)]
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "requests": requests}, f)
+        with open(ndjson_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"config": config}) + "\n")
+            f.writelines(json.dumps(request) + "\n" for request in requests)
+        del requests
+        start = time.perf_counter()
+        convert_scenario(ndjson_path, trace_path)
+        convert_seconds = time.perf_counter() - start
+
+        formats = (
+            ("json", json_path, lambda: run_scenario(json_path), []),
+            ("ndjson", ndjson_path, lambda: list(stream_scenario(ndjson_path)), ["--stream"]),
+            ("trace", trace_path, lambda: run_scenario(trace_path), []),
+        )
+        for name, path, replay, flags in formats:
+            in_process = end_to_end = float("inf")
+            for _ in range(TIMED_PASSES):
+                start = time.perf_counter()
+                replay()
+                in_process = min(in_process, time.perf_counter() - start)
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, str(script), "scenario", "--file", path, *flags],
+                    stdout=subprocess.DEVNULL, check=True,
+                )
+                end_to_end = min(end_to_end, time.perf_counter() - start)
+            results.append({
+                "benchmark": "replay", "workload": workload, "format": name, "requests": count,
+                "file_bytes": os.path.getsize(path),
+                "in_process_requests_per_sec": round(count / in_process),
+                "cli_requests_per_sec": round(count / end_to_end),
+            })
+            if name == "trace":
+                results[-1]["convert_requests_per_sec"] = round(count / convert_seconds)
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_workers(count: int, max_workers: int) -> list[dict]:
+    """Requests/sec of write_scenario on a trace of the uniform workload, from 1 to max_workers processes.
+
+    Output goes to /dev/null; each figure is the best of TIMED_PASSES runs. CPU
+    seconds are split between this process, which reads and merges, and the
+    workers, so scaling can be judged even on a machine with fewer cores.
+    """
+    def cpu_seconds(who: int) -> float:
+        usage = resource.getrusage(who)
+        return usage.ru_utime + usage.ru_stime
+
+    users, times = WORKLOADS["uniform"](count, random.Random(1))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        trace_path = os.path.join(tmp, "scenario.trace")
+        write_trace(trace_path, DEFAULT_CONFIG, ({"user": user, "time": now} for user, now in zip(users, times)))
+        serial = None
+        for workers in range(1, max_workers + 1):
+            elapsed = float("inf")
+            for _ in range(TIMED_PASSES):
+                parent_before = cpu_seconds(resource.RUSAGE_SELF)
+                workers_before = cpu_seconds(resource.RUSAGE_CHILDREN)
+                start = time.perf_counter()
+                write_scenario(trace_path, devnull, workers=workers)
+                elapsed = min(elapsed, time.perf_counter() - start)
+                parent_cpu = cpu_seconds(resource.RUSAGE_SELF) - parent_before
+                workers_cpu = cpu_seconds(resource.RUSAGE_CHILDREN) - workers_before
+            serial = serial or elapsed
+            results.append({
+                "benchmark": "workers", "workers": workers, "requests": count, "cpus": os.cpu_count(),
+                "requests_per_sec": round(count / elapsed), "speedup": round(serial / elapsed, 2),
+                "parent_cpu_sec": round(parent_cpu, 3), "workers_cpu_sec": round(workers_cpu, 3),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def bench_eviction(count: int, requests_per_user: int) -> list[dict]:
+    """Rotating anonymous IDs: compare registry size and latency with and without eviction."""
+    modes = {
+        "none": {},
+        "evict_idle": {"evict_idle": True},
+        "max_entries": {"max_entries": 10_000},
+    }
+    users = [f"anon-{i // requests_per_user}" for i in range(count)]
+    results = []
+    for mode, options in modes.items():
+        tracker = create_tracker(DEFAULT_CONFIG, **options)
+        latencies = [0] * count
+        clock = time.perf_counter_ns
+        for i, user in enumerate(users):
+            start = clock()
+            check_request(tracker, user, i * 0.001)
+            latencies[i] = clock() - start
+        latencies.sort()
+        results.append({
+            "benchmark": "eviction",
+            "mode": mode,
+            "requests": count,
+            "final_buckets": len(tracker.buckets),
+            "p50_ns": percentile(latencies, 0.50),
+            "p99_ns": percentile(latencies, 0.99),
+            "p999_ns": percentile(latencies, 0.999),
+        })
+        print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def start_server(socket_path: str, extra_args: list[str] | None = None) -> subprocess.Popen:
+    """Launch rate_limiter.py serve on a Unix socket and wait until it accepts connections."""
+    script_dir = Path(__file__).parent
+    process = subprocess.Popen(
+        [sys.executable, str(script_dir / "rate_limiter.py"), "serve", "--socket", socket_path, *(extra_args or [])],
+        cwd=str(script_dir),
+    )
+    deadline = time.monotonic() + 10.0
+    while not os.path.exists(socket_path):
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.kill()
+            raise RuntimeError("serve did not start")
+        time.sleep(0.01)
+    return process
+
+
+def read_replies(sock: socket.socket, count: int) -> bytes:
+    """Read from sock until count reply lines have arrived."""
+    data = b""
+    while data.count(b"\n") < count:
+        chunk = sock.recv(1 << 16)
+        if not chunk:
+            raise RuntimeError("server closed the connection")
+        data += chunk
+    return data
+
+
+def bench_serve(round_trips: int, pipelined: int, pipeline_depth: int) -> list[dict]:
+    """Measure serve round-trip latency and pipelined decisions/sec over a Unix socket."""
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "limiter.sock")
+        process = start_server(socket_path)
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(socket_path)
+
+            latencies = [0] * round_trips
+            clock = time.perf_counter_ns
+            for i in range(round_trips):
+                line = f"user-{i % 1000} {i * 0.001}\n".encode()
+                start = clock()
+                sock.sendall(line)
+                read_replies(sock, 1)
+                latencies[i] = clock() - start
+            latencies.sort()
+
+            lines = [f"user-{i % 1000} {i * 0.001}\n".encode() for i in range(pipelined)]
+            start = time.perf_counter()
+            for i in range(0, pipelined, pipeline_depth):
+                chunk = lines[i:i + pipeline_depth]
+                sock.sendall(b"".join(chunk))
+                read_replies(sock, len(chunk))
+            elapsed = time.perf_counter() - start
+            sock.close()
+        finally:
+            process.terminate()
+            process.wait()
+
+    results = [
+        {"benchmark": "serve", "mode": "round_trip", "requests": round_trips,
+         "p50_us": round(percentile(latencies, 0.50) / 1000, 1),
+         "p99_us": round(percentile(latencies, 0.99) / 1000, 1)},
+        {"benchmark": "serve", "mode": "pipelined", "requests": pipelined, "depth": pipeline_depth,
+         "decisions_per_sec": round(pipelined / elapsed)},
+    ]
+    for result in results:
+        print(json.dumps(result), flush=True)
+    return results
+
+
+def run_threads(thread_count: int, target) -> float:
+    """Run target(index) on thread_count threads started together; return wall seconds."""
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker(index: int) -> None:
+        barrier.wait()
+        target(index)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def bench_contention(max_threads: int, per_thread: int) -> list[dict]:
+    """Throughput of striped vs single-lock trackers from 1 to max_threads, plus an over-admission count."""
+    gil_check = getattr(sys, "_is_gil_enabled", None)
+    gil_enabled = gil_check() if gil_check is not None else True
+    thread_counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= max_threads]
+    results = []
+
+    for stripes, mode in ((64, "striped"), (1, "single_lock")):
+        for thread_count in thread_counts:
+            tracker = create_concurrent_tracker(DEFAULT_CONFIG, stripe_count=stripes)
+
+            def hammer(index: int) -> None:
+                users = [f"user-{index}-{i}" for i in range(256)]
+                for i in range(per_thread):
+                    check_request_concurrent(tracker, users[i & 255], i * 0.001)
+
+            elapsed = run_threads(thread_count, hammer)
+            results.append({
+                "benchmark": "contention", "mode": mode, "threads": thread_count, "gil_enabled": gil_enabled,
+                "decisions_per_sec": round(thread_count * per_thread / elapsed),
+            })
+            print(json.dumps(results[-1]), flush=True)
+
+    config = QuotaConfig(default=BucketConfig(capacity=1000, refill_rate=1.0), users={})
+    for mode, create, check in (
+        ("unsynchronized", create_tracker, check_request),
+        ("striped", create_concurrent_tracker, check_request_concurrent),
+    ):
+        tracker = create(config)
+        allowed = [0] * max_threads
+
+        def shared(index: int) -> None:
+            for i in range(per_thread):
+                if check(tracker, f"shared-{i & 7}", 0.0)[0]:
+                    allowed[index] += 1
+
+        old_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            run_threads(max_threads, shared)
+        finally:
+            sys.setswitchinterval(old_interval)
+        results.append({
+            "benchmark": "contention", "mode": mode, "threads": max_threads, "gil_enabled": gil_enabled,
+            "over_admitted": sum(allowed) - 8 * 1000,
+        })
+        print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def hierarchy_config(mode: str, user_count: int) -> QuotaConfig:
+    """Config for bench_hierarchy: flat, users spread over 64 orgs, all in one hot org, or hot org plus global."""
+    default = BucketConfig(capacity=1000, refill_rate=1000.0)
+    if mode == "flat":
+        return QuotaConfig(default=default, users={})
+    org_count = 64 if mode == "spread_orgs" else 1
+    return QuotaConfig(
+        default=default, users={},
+        orgs={f"org-{i}": BucketConfig(capacity=1e6, refill_rate=1e6) for i in range(org_count)},
+        user_orgs={f"user-{i}": f"org-{i % org_count}" for i in range(user_count)},
+        global_limit=BucketConfig(capacity=1e9, refill_rate=1e9) if mode == "hot_org_global" else None,
+    )
+
+
+def bench_hierarchy(max_threads: int, per_thread: int) -> list[dict]:
+    """Cost of nested user/org/global checks, and thread scaling when every user shares one hot org."""
+    gil_check = getattr(sys, "_is_gil_enabled", None)
+    gil_enabled = gil_check() if gil_check is not None else True
+    thread_counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= max_threads]
+    users = [f"user-{i}" for i in range(10_000)]
+    results = []
+
+    for mode in ("flat", "spread_orgs", "hot_org", "hot_org_global"):
+        tracker = create_tracker(hierarchy_config(mode, len(users)))
+        start = time.perf_counter()
+        for i in range(per_thread):
+            check_request(tracker, users[i % 10_000], i * 0.001)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "benchmark": "hierarchy", "mode": mode, "tracker": "quota_tracker",
+            "decisions_per_sec": round(per_thread / elapsed),
+        })
+        print(json.dumps(results[-1]), flush=True)
+
+        for thread_count in thread_counts:
+            tracker = create_concurrent_tracker(hierarchy_config(mode, len(users)))
+
+            def hammer(index: int) -> None:
+                offset = index * 1000
+                for i in range(per_thread):
+                    check_request_concurrent(tracker, users[(offset + i) % 10_000], i * 0.001)
+
+            elapsed = run_threads(thread_count, hammer)
+            results.append({
+                "benchmark": "hierarchy", "mode": mode, "tracker": "concurrent", "threads": thread_count,
+                "gil_enabled": gil_enabled, "decisions_per_sec": round(thread_count * per_thread / elapsed),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_acquire(waiters: int, user_count: int) -> dict:
+    """Grant lateness and CPU time with waiters parked on acquire across user_count drained buckets."""
+    async def run() -> dict:
+        config = QuotaConfig(default=BucketConfig(capacity=1, refill_rate=1.0), users={})
+        limiter = create_async_limiter(create_tracker(config))
+        loop = limiter.loop
+        users = [f"user-{i}" for i in range(user_count)]
+        drained_at = []
+        for user in users:
+            await acquire(limiter, user)
+            drained_at.append(loop.time())
+        lateness = [0.0] * waiters
+
+        async def waiter(index: int) -> None:
+            await acquire(limiter, users[index % user_count])
+            ready = drained_at[index % user_count] + (index // user_count + 1)
+            lateness[index] = loop.time() - ready
+
+        tasks = [asyncio.create_task(waiter(i)) for i in range(waiters)]
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        await asyncio.gather(*tasks)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        lateness.sort()
+        return {
+            "benchmark": "acquire", "waiters": waiters, "users": user_count,
+            "wall_seconds": round(wall, 3), "cpu_seconds": round(cpu, 3),
+            "lateness_p50_ms": round(percentile(lateness, 0.50) * 1000, 3),
+            "lateness_p99_ms": round(percentile(lateness, 0.99) * 1000, 3),
+        }
+
+    result = asyncio.run(run())
+    print(json.dumps(result), flush=True)
+    return result
+
+
+def bench_backend(requests: int, batch_size: int, server: str | None) -> list[dict]:
+    """Per-check latency and decisions/sec: in-process tracker vs memory backend vs RESP script backend.
+
+    server is "host:port" of a Redis-compatible server; without it an in-process fake_redis is started.
+    """
+    fake = None
+    if server is None:
+        fake = start_fake_redis()
+        host, port = fake.host, fake.port
+    else:
+        host, port = server.rsplit(":", 1)
+    users = [f"user-{i % 1000}" for i in range(requests)]
+    times = [i * 0.001 for i in range(requests)]
+    results = []
+    resp = RespBackend(host=host, port=int(port))
+    try:
+        resp.execute("FLUSHALL")
+        modes = (
+            ("quota_tracker", create_tracker(DEFAULT_CONFIG), check_request, check_requests),
+            ("memory", create_backend_tracker(DEFAULT_CONFIG, MemoryBackend()), check_request_backend, None),
+            ("resp", create_backend_tracker(DEFAULT_CONFIG, resp), check_request_backend, check_requests_backend),
+        )
+        for mode, tracker, check, check_batch in modes:
+            latencies = []
+            clock = time.perf_counter_ns
+            for user, now in zip(users, times):
+                start_ns = clock()
+                check(tracker, user, now)
+                latencies.append(clock() - start_ns)
+            latencies.sort()
+            results.append({
+                "benchmark": "backend", "mode": mode, "requests": requests,
+                "decisions_per_sec": round(requests / (sum(latencies) / 1e9)),
+                "p50_us": round(percentile(latencies, 0.50) / 1000, 2),
+                "p99_us": round(percentile(latencies, 0.99) / 1000, 2),
+            })
+            print(json.dumps(results[-1]), flush=True)
+
+            if check_batch is not None:
+                later = [now + requests * 0.001 for now in times]
+                start = time.perf_counter()
+                for i in range(0, requests, batch_size):
+                    check_batch(tracker, users[i:i + batch_size], later[i:i + batch_size])
+                elapsed = time.perf_counter() - start
+                results.append({
+                    "benchmark": "backend", "mode": f"{mode}_batched", "requests": requests, "batch_size": batch_size,
+                    "decisions_per_sec": round(requests / elapsed),
+                })
+                print(json.dumps(results[-1]), flush=True)
+    finally:
+        resp.close()
+        if fake is not None:
+            stop_fake_redis(fake)
+    return results
+
+
+def bench_lease(requests: int, hot_users: int, fractions: list[float]) -> list[dict]:
+    """Remote calls per decision and decisions/sec for hot users, with and without leases, over fake_redis."""
+    config = QuotaConfig(default=BucketConfig(capacity=1000, refill_rate=10_000.0), users={})
+    users = [f"hot-{i % hot_users}" for i in range(requests)]
+    fake = start_fake_redis()
+    backend = RespBackend(host=fake.host, port=fake.port)
+    results = []
+    try:
+        for fraction in [None, *fractions]:
+            backend.execute("FLUSHALL")
+            tracker = create_backend_tracker(config, backend)
+            if fraction is None:
+                check, target = check_request_backend, tracker
+            else:
+                check, target = check_request_leased, create_lease_tracker(tracker, lease_fraction=fraction)
+            allowed = 0
+            start = time.perf_counter()
+            for i, user in enumerate(users):
+                allowed += check(target, user, i * 0.0001)[0]
+            elapsed = time.perf_counter() - start
+            remote_calls = requests if fraction is None else target.remote_calls
+            results.append({
+                "benchmark": "lease", "lease_fraction": fraction, "requests": requests, "hot_users": hot_users,
+                "allowed": allowed, "remote_calls_per_decision": round(remote_calls / requests, 4),
+                "decisions_per_sec": round(requests / elapsed),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    finally:
+        backend.close()
+        stop_fake_redis(fake)
+    return results
+
+
+def bench_deny_cache(requests: int, abusers: int, shares: list[float]) -> list[dict]:
+    """Decisions/sec with and without the deny cache as abusers take a growing share of 10,000 requests/sec.
+
+    The rest of the traffic comes from 10,000 well-behaved users. Each figure
+    is the best of TIMED_PASSES runs, alternating so drift hits both alike.
+    """
+    results = []
+    for share in shares:
+        rng = random.Random(1)
+        users = [
+            f"abuser-{rng.randrange(abusers)}" if rng.random() < share else f"user-{rng.randrange(10_000)}"
+            for _ in range(requests)
+        ]
+        times = [i * 1e-4 for i in range(requests)]
+        best = {False: float("inf"), True: float("inf")}
+        for _ in range(TIMED_PASSES):
+            for cached in (False, True):
+                target, check = create_tracker(DEFAULT_CONFIG), check_request
+                if cached:
+                    target, check = create_deny_cache(target), check_request_deny_cached
+                start = time.perf_counter()
+                denied = 0
+                for user, now in zip(users, times):
+                    denied += not check(target, user, now)[0]
+                best[cached] = min(best[cached], time.perf_counter() - start)
+        results.append({
+            "benchmark": "deny_cache", "abuser_share": share, "abusers": abusers, "requests": requests,
+            "denied_share": round(denied / requests, 3), "cache_hits_share": round(target.hits / requests, 3),
+            "uncached_decisions_per_sec": round(requests / best[False]),
+            "cached_decisions_per_sec": round(requests / best[True]),
+            "speedup": round(best[False] / best[True], 2),
+        })
+        print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_coarse_clock(requests: int, batch_size: int, resolution: float, rate: float) -> list[dict]:
+    """One hot user: decisions/sec reading the wall clock per check versus one coarse tick per batch.
+
+    Measured on direct check_request calls and on the server's answer_lines
+    path. Each figure is the best of TIMED_PASSES runs; admitted is from the last.
+    """
+    config = QuotaConfig(default=BucketConfig(capacity=rate / 10, refill_rate=rate), users={})
+    results = []
+    batches = range(0, requests, batch_size)
+    lines = [b"hot"] * batch_size
+
+    def direct(coarse: bool) -> int:
+        tracker, clock, admitted = create_tracker(config), create_coarse_clock(resolution), 0
+        for _ in batches:
+            if coarse:
+                now = tick(clock)
+                for _ in lines:
+                    admitted += check_request(tracker, "hot", now)[0]
+            else:
+                for _ in lines:
+                    admitted += check_request(tracker, "hot", time.time())[0]
+        return admitted
+
+    def served(coarse: bool) -> int:
+        tracker, clock = create_tracker(config), create_coarse_clock(resolution) if coarse else None
+        return sum(answer_lines(tracker, lines, clock=clock).count(b"ALLOW") for _ in batches)
+
+    for path, run in (("check_request", direct), ("answer_lines", served)):
+        best = {False: float("inf"), True: float("inf")}
+        admitted = {}
+        for _ in range(TIMED_PASSES):
+            for coarse in (False, True):
+                start = time.perf_counter()
+                admitted[coarse] = run(coarse)
+                best[coarse] = min(best[coarse], time.perf_counter() - start)
+        count = len(batches) * batch_size
+        results.append({
+            "benchmark": "coarse_clock", "path": path, "requests": count, "batch_size": batch_size,
+            "resolution": resolution, "refill_rate": rate,
+            "exact_decisions_per_sec": round(count / best[False]),
+            "coarse_decisions_per_sec": round(count / best[True]),
+            "speedup": round(best[False] / best[True], 2),
+            "exact_admitted": admitted[False], "coarse_admitted": admitted[True],
+        })
+        print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def _shared_worker(tracker, per_worker: int, start_barrier) -> None:
+    """Worker process body: run per_worker checks over 10,000 users.
+
+    tracker is the shared table, or None for a private per-process tracker.
+    """
+    if tracker is None:
+        tracker, check = create_tracker(DEFAULT_CONFIG), check_request
+    else:
+        check = check_request_shared
+    users = [f"user-{i}" for i in range(10_000)]
+    start_barrier.wait()
+    for i in range(per_worker):
+        check(tracker, users[i % 10_000], i * 0.001)
+
+
+def bench_shared(max_workers: int, per_worker: int) -> list[dict]:
+    """Decisions/sec of forked workers sharing one table vs. each keeping a private tracker."""
+    context = multiprocessing.get_context("fork")
+    worker_counts = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= max_workers]
+    results = []
+    for mode in ("shared", "private"):
+        for worker_count in worker_counts:
+            tracker = create_shared_tracker(DEFAULT_CONFIG, slot_count=1 << 16) if mode == "shared" else None
+            start_barrier = context.Barrier(worker_count + 1)
+            workers = [
+                context.Process(target=_shared_worker, args=(tracker, per_worker, start_barrier))
+                for _ in range(worker_count)
+            ]
+            for worker in workers:
+                worker.start()
+            start_barrier.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            if tracker is not None:
+                close_shared_tracker(tracker, unlink=True)
+            results.append({
+                "benchmark": "shared", "mode": mode, "workers": worker_count,
+                "decisions_per_sec": round(worker_count * per_worker / elapsed),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_snapshot(user_counts: list[int], budget: int) -> list[dict]:
+    """Per user count: longest pause while checkpointing, and time to reopen and restore one user.
+
+    finish_ms is the sync and rename, which a server runs off the event loop.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "buckets.snapshot")
+        for count in user_counts:
+            tracker = create_tracker(DEFAULT_CONFIG)
+            tracker.created = []
+            for user in make_users(count):
+                check_request(tracker, user, 0.0)
+
+            clock = time.perf_counter
+            start = clock()
+            writer = begin_snapshot(tracker.buckets, path, created=tracker.created)
+            begin_pause = clock() - start
+            longest_step = 0.0
+            done = False
+            while not done:
+                step_start = clock()
+                done = snapshot_step(writer, tracker.buckets, budget)
+                longest_step = max(longest_step, clock() - step_start)
+            finish_start = clock()
+            finish_snapshot(writer)
+            finish = clock() - finish_start
+            total = clock() - start
+
+            start = clock()
+            restarted = create_tracker(DEFAULT_CONFIG, snapshot=open_snapshot(path))
+            startup = clock() - start
+            start = clock()
+            check_request(restarted, f"user-{count // 2}", 1.0)
+            first_restore = clock() - start
+
+            results.append({
+                "benchmark": "snapshot", "users": count, "budget": budget,
+                "write_total_ms": round(total * 1000, 1),
+                "begin_pause_ms": round(begin_pause * 1000, 2),
+                "longest_step_ms": round(longest_step * 1000, 2),
+                "finish_ms": round(finish * 1000, 2),
+                "startup_ms": round(startup * 1000, 3),
+                "first_restore_us": round(first_restore * 1e6, 1),
+            })
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+def bench_user_index(user_counts: list[int], lookups: int) -> list[dict]:
+    """Per override count: config load time and memory with inline users and with a user index, then lookup cost."""
+    results = []
+    tiers = [BucketConfig(capacity=10 * (i + 1), refill_rate=2.5 * (i + 1)) for i in range(4)]
+    with tempfile.TemporaryDirectory() as tmp:
+        inline_path, indexed_path = os.path.join(tmp, "inline.json"), os.path.join(tmp, "indexed.json")
+        index_path = os.path.join(tmp, "users.index")
+        for count in user_counts:
+            users = {user: tiers[i % 4] for i, user in enumerate(make_users(count))}
+            config = QuotaConfig(default=DEFAULT_CONFIG.default, users=users, tiers=dict(zip("abcd", tiers)))
+            section = dump_config(config)
+            with open(inline_path, "w", encoding="utf-8") as f:
+                json.dump(section, f)
+            write_user_index(index_path, users)
+            del section["users"]
+            with open(indexed_path, "w", encoding="utf-8") as f:
+                json.dump({**section, "users_index": index_path}, f)
+            del users, config
+
+            row = {"benchmark": "user-index", "users": count, "index_bytes": os.path.getsize(index_path)}
+            for name, path in (("inline", inline_path), ("indexed", indexed_path)):
+                loaded = None                          # freeing the previous config is not charged to this load
+                start = time.perf_counter()
+                loaded = load_config_file(path)
+                row[f"{name}_load_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                loaded = None
+                tracemalloc.start()
+                loaded = load_config_file(path)
+                row[f"{name}_kib"] = round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+                tracemalloc.stop()
+
+            probes = [f"user-{random.randrange(count * 2)}" for _ in range(lookups)]     # half have no override
+            get = loaded.users.get
+            start = time.perf_counter()
+            for user in probes:
+                get(user)
+            row["cold_lookup_us"] = round((time.perf_counter() - start) / lookups * 1e6, 2)
+            start = time.perf_counter()
+            for user in probes:
+                get(user)
+            row["cached_lookup_us"] = round((time.perf_counter() - start) / lookups * 1e6, 2)
+            results.append(row)
+            print(json.dumps(row), flush=True)
+            del loaded, get
+    return results
+
+
+def workload_uniform(count: int, rng: random.Random) -> tuple[list[str], list[float]]:
+    """10,000 users picked uniformly, 10,000 requests per second."""
+    return ([f"user-{rng.randrange(10_000)}" for _ in range(count)], [i * 1e-4 for i in range(count)])
+
+
+def workload_zipf(count: int, rng: random.Random) -> tuple[list[str], list[float]]:
+    """100,000 users with Zipf(1.1) popularity, so a few hot keys take most requests."""
+    cum_weights = list(accumulate(1.0 / (rank ** 1.1) for rank in range(1, 100_001)))
+    ranks = rng.choices(range(100_000), cum_weights=cum_weights, k=count)
+    return ([f"user-{rank}" for rank in ranks], [i * 1e-4 for i in range(count)])
+
+
+def workload_bursty(count: int, rng: random.Random) -> tuple[list[str], list[float]]:
+    """Bursts of 200 simultaneous requests from 50 of 10,000 users, separated by idle gaps."""
+    users, times = [], []
+    now = 0.0
+    while len(users) < count:
+        now += rng.expovariate(1.0)
+        burst_users = [f"user-{rng.randrange(10_000)}" for _ in range(50)]
+        for i in range(min(200, count - len(users))):
+            users.append(burst_users[i % 50])
+            times.append(now)
+    return (users, times)
+
+
+def workload_distinct(count: int, rng: random.Random) -> tuple[list[str], list[float]]:
+    """Every request from a new user: registry growth dominates."""
+    return ([f"user-{i}" for i in range(count)], [i * 1e-4 for i in range(count)])
+
+
+WORKLOADS = {
+    "uniform": workload_uniform,
+    "zipf": workload_zipf,
+    "bursty": workload_bursty,
+    "distinct": workload_distinct,
+}
+
+
+TIMED_PASSES = 3                      # throughput is the best of this many replays, to damp machine noise
+
+
+def measure_workload(name: str, count: int, seed: int = 1) -> dict:
+    """Replay one synthetic workload through check_request: throughput, latency, peak RSS, retained memory.
+
+    Retained memory is net growth over a pass: blocks by sys.getallocatedblocks and
+    bytes by tracemalloc (on a separate, untimed pass). Allocations freed within
+    the pass are not counted, so neither is a count of allocations.
+    """
+    users, times = WORKLOADS[name](count, random.Random(seed))
+
+    elapsed = float("inf")
+    for _ in range(TIMED_PASSES):
+        tracker = create_tracker(DEFAULT_CONFIG)
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        for user, now in zip(users, times):
+            check_request(tracker, user, now)
+        elapsed = min(elapsed, time.perf_counter() - start)
+        retained_blocks = sys.getallocatedblocks() - blocks_before
+        del tracker
+
+    tracker = create_tracker(DEFAULT_CONFIG)
+    latencies = [0] * count
+    clock = time.perf_counter_ns
+    for i, (user, now) in enumerate(zip(users, times)):
+        start_ns = clock()
+        check_request(tracker, user, now)
+        latencies[i] = clock() - start_ns
+    latencies.sort()
+
+    tracker = create_tracker(DEFAULT_CONFIG)
+    tracemalloc.start()
+    for user, now in zip(users, times):
+        check_request(tracker, user, now)
+    retained_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "benchmark": "workload", "workload": name, "requests": count,
+        "decisions_per_sec": round(count / elapsed),
+        "p50_ns": percentile(latencies, 0.50),
+        "p99_ns": percentile(latencies, 0.99),
+        "p999_ns": percentile(latencies, 0.999),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "retained_blocks_per_decision": round(retained_blocks / count, 3),
+        "retained_bytes_per_decision": round(retained_bytes / count, 1),
+    }
+
+
+def measure_scenarios(repetitions: int) -> dict:
+    """Run the spec scenario files in-process through run_scenario, checking results and timing replays."""
+    script_dir = Path(__file__).parent
+    correct = True
+    for scenario in SCENARIOS:
+        actual = run_scenario(str(script_dir / scenario["file"]))
+        if not compare_results(actual, scenario["expected"], scenario["name"]):
+            correct = False
+
+    elapsed = float("inf")
+    for _ in range(TIMED_PASSES):
+        decisions = 0
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            for scenario in SCENARIOS:
+                decisions += len(run_scenario(str(script_dir / scenario["file"])))
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    return {
+        "benchmark": "workload", "workload": "scenarios", "requests": decisions, "correct": correct,
+        "decisions_per_sec": round(decisions / elapsed),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_isolated(function, *args) -> dict:
+    """Run function(*args) in a fresh forked process so peak RSS is measured per workload."""
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def run_suite(workloads: list[str], count: int) -> dict[str, dict]:
+    """Measure each named workload ("scenarios" included) in isolation; print and return results by name."""
+    results = {}
+    for name in workloads:
+        if name == "scenarios":
+            result = run_isolated(measure_scenarios, max(1, count // 1000))
+        else:
+            result = run_isolated(measure_workload, name, count)
+        print(json.dumps(result), flush=True)
+        results[name] = result
+    return results
+
+
+def save_baseline(file_path: str, count: int, results: dict[str, dict]) -> None:
+    """Write suite results as a JSON baseline for later compare runs."""
+    Path(file_path).write_text(json.dumps({"requests": count, "results": results}, indent=2) + "\n", encoding="utf-8")
+
+
+def compare_to_baseline(file_path: str, threshold: float) -> bool:
+    """Re-run the baseline's workloads and flag throughput drops or peak RSS growth beyond threshold.
+
+    Returns True if nothing regressed and every scenario still matches the spec.
+    """
+    baseline = json.loads(Path(file_path).read_text(encoding="utf-8"))
+    current = run_suite(list(baseline["results"]), baseline["requests"])
+    passed = True
+    for name, before in baseline["results"].items():
+        after = current[name]
+        if not after.get("correct", True):
+            passed = False
+        for metric, higher_is_better in (("decisions_per_sec", True), ("peak_rss_kb", False)):
+            change = (after[metric] - before[metric]) / before[metric]
+            regressed = change < -threshold if higher_is_better else change > threshold
+            passed = passed and not regressed
+            print(json.dumps({
+                "benchmark": "compare", "workload": name, "metric": metric,
+                "baseline": before[metric], "current": after[metric],
+                "change_pct": round(change * 100, 1), "regressed": regressed,
+            }), flush=True)
+    return passed
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse CLI arguments. Returns parsed namespace."""
+    parser = argparse.ArgumentParser(description="Rate limiter benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+
+    memory_parser = subparsers.add_parser("memory", help="Registry memory per layout")
+    memory_parser.add_argument(
+        "--users", type=int, nargs="+", default=[10**5, 10**6, 10**7],
+        help="Distinct user counts to measure",
+    )
+
+    batch_parser = subparsers.add_parser("batch", help="Per-request vs batched decisions/sec")
+    batch_parser.add_argument("--requests", type=int, default=1_000_000, help="Total requests")
+    batch_parser.add_argument("--users", type=int, default=1000, help="Distinct users")
+    batch_parser.add_argument("--batch-size", type=int, default=4096, help="Requests per batch")
+
+    algorithms_parser = subparsers.add_parser("algorithms", help="Decisions/sec and memory per limiting algorithm")
+    algorithms_parser.add_argument("--requests", type=int, default=500_000, help="Requests per algorithm")
+    algorithms_parser.add_argument("--users", type=int, default=1000, help="Distinct users")
+    algorithms_parser.add_argument(
+        "--memory-users", type=int, default=100_000, help="Users filled for the memory figure",
+    )
+
+    metrics_parser = subparsers.add_parser("metrics", help="Cost of recording decision metrics")
+    metrics_parser.add_argument("--requests", type=int, default=1_000_000, help="Requests per workload")
+    metrics_parser.add_argument("--batch-size", type=int, default=4096, help="Requests per batch")
+
+    replay_parser = subparsers.add_parser("replay", help="Scenario replay from JSON, NDJSON and binary traces")
+    replay_parser.add_argument("--requests", type=int, default=1_000_000, help="Requests in the scenario")
+    replay_parser.add_argument("--workload", choices=list(WORKLOADS), default="zipf", help="Synthetic workload")
+
+    workers_parser = subparsers.add_parser("workers", help="Sharded scenario replay across worker processes")
+    workers_parser.add_argument("--requests", type=int, default=1_000_000, help="Requests in the trace")
+    workers_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Maximum worker count")
+
+    eviction_parser = subparsers.add_parser("eviction", help="Registry growth and latency under rotating IDs")
+    eviction_parser.add_argument("--requests", type=int, default=1_000_000, help="Total requests")
+    eviction_parser.add_argument("--per-user", type=int, default=3, help="Requests per anonymous ID")
+
+    serve_parser = subparsers.add_parser("serve", help="Latency and throughput of rate_limiter.py serve")
+    serve_parser.add_argument("--round-trips", type=int, default=20_000, help="Sequential request/reply pairs")
+    serve_parser.add_argument("--pipelined", type=int, default=500_000, help="Pipelined requests")
+    serve_parser.add_argument("--depth", type=int, default=1000, help="Requests in flight per write")
+
+    backend_parser = subparsers.add_parser("backend", help="Storage backends: in-process vs RESP script round trips")
+    backend_parser.add_argument("--requests", type=int, default=20_000, help="Checks per mode")
+    backend_parser.add_argument("--batch-size", type=int, default=256, help="Checks per pipelined batch")
+    backend_parser.add_argument(
+        "--server", default=None, help="host:port of a Redis-compatible server (default: in-process fake)",
+    )
+
+    lease_parser = subparsers.add_parser("lease", help="Lease cache: remote calls per decision for hot users")
+    lease_parser.add_argument("--requests", type=int, default=50_000)
+    lease_parser.add_argument("--hot-users", type=int, default=10)
+    lease_parser.add_argument("--fractions", type=float, nargs="+", default=[0.01, 0.1, 0.25])
+
+    deny_parser = subparsers.add_parser("deny-cache", help="Deny fast path under hot abusers")
+    deny_parser.add_argument("--requests", type=int, default=500_000, help="Requests per abuser share")
+    deny_parser.add_argument("--abusers", type=int, default=10, help="Users hammering empty buckets")
+    deny_parser.add_argument("--shares", type=float, nargs="+", default=[0.0, 0.5, 0.9, 1.0])
+
+    index_parser = subparsers.add_parser("user-index", help="Config startup with inline overrides vs a user index")
+    index_parser.add_argument(
+        "--users", type=int, nargs="+", default=[10**4, 10**5, 10**6], help="Override counts to measure",
+    )
+    index_parser.add_argument("--lookups", type=int, default=50_000, help="Lookups timed per override count")
+
+    clock_parser = subparsers.add_parser("coarse-clock", help="One hot user with a per-batch coarse clock")
+    clock_parser.add_argument("--requests", type=int, default=1_000_000, help="Checks per measurement")
+    clock_parser.add_argument("--batch-size", type=int, default=256, help="Checks per clock tick")
+    clock_parser.add_argument("--resolution", type=float, default=0.001, help="Clock resolution in seconds")
+    clock_parser.add_argument("--rate", type=float, default=100_000.0, help="The hot user's refill_rate")
+
+    acquire_parser = subparsers.add_parser("acquire", help="Async acquire: grant lateness and idle CPU")
+    acquire_parser.add_argument("--waiters", type=int, default=50_000, help="Pending acquire calls")
+    acquire_parser.add_argument("--users", type=int, default=10_000, help="Users the waiters are spread over")
+
+    hierarchy_parser = subparsers.add_parser("hierarchy", help="Nested org/global quotas and hot-org contention")
+    hierarchy_parser.add_argument("--threads", type=int, default=8, help="Maximum thread count")
+    hierarchy_parser.add_argument("--per-thread", type=int, default=100_000, help="Checks per thread")
+
+    contention_parser = subparsers.add_parser("contention", help="Thread scaling and over-admission")
+    contention_parser.add_argument("--threads", type=int, default=8, help="Maximum thread count")
+    contention_parser.add_argument("--per-thread", type=int, default=200_000, help="Checks per thread")
+
+    shared_parser = subparsers.add_parser("shared", help="Worker-process scaling of the shared-memory table")
+    shared_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Maximum worker count")
+    shared_parser.add_argument("--per-worker", type=int, default=200_000, help="Checks per worker")
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Checkpoint pauses and warm-restart startup time")
+    snapshot_parser.add_argument(
+        "--users", type=int, nargs="+", default=[10**4, 10**5, 10**6], help="Distinct user counts to measure",
+    )
+    snapshot_parser.add_argument("--budget", type=int, default=256, help="Buckets written per step")
+
+    suite_choices = [*WORKLOADS, "scenarios"]
+    run_parser = subparsers.add_parser("run", help="Synthetic workload suite, optionally saved as a baseline")
+    run_parser.add_argument("--workloads", nargs="+", choices=suite_choices, default=suite_choices)
+    run_parser.add_argument("--requests", type=int, default=500_000, help="Requests per workload")
+    run_parser.add_argument("--save", default=None, dest="baseline_path", help="Write results to this baseline file")
+
+    compare_parser = subparsers.add_parser("compare", help="Re-run a saved baseline and fail on regressions")
+    compare_parser.add_argument("--baseline", required=True, dest="baseline_path", help="Baseline JSON file")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.10, help="Allowed fractional throughput drop or RSS growth",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_usage(sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def main() -> None:
+    """Entry point. Runs the selected benchmark and prints one JSON line per measurement."""
+    args = parse_args()
+
+    if args.command == "memory":
+        bench_memory(args.users)
+    elif args.command == "batch":
+        bench_batch(args.requests, args.users, args.batch_size)
+    elif args.command == "algorithms":
+        bench_algorithms(args.requests, args.users, args.memory_users)
+    elif args.command == "metrics":
+        bench_metrics(args.requests, args.batch_size)
+    elif args.command == "replay":
+        bench_replay(args.requests, args.workload)
+    elif args.command == "workers":
+        bench_workers(args.requests, args.workers)
+    elif args.command == "eviction":
+        bench_eviction(args.requests, args.per_user)
+    elif args.command == "serve":
+        bench_serve(args.round_trips, args.pipelined, args.depth)
+    elif args.command == "backend":
+        bench_backend(args.requests, args.batch_size, args.server)
+    elif args.command == "lease":
+        bench_lease(args.requests, args.hot_users, args.fractions)
+    elif args.command == "deny-cache":
+        bench_deny_cache(args.requests, args.abusers, args.shares)
+    elif args.command == "user-index":
+        bench_user_index(args.users, args.lookups)
+    elif args.command == "coarse-clock":
+        bench_coarse_clock(args.requests, args.batch_size, args.resolution, args.rate)
+    elif args.command == "acquire":
+        bench_acquire(args.waiters, args.users)
+    elif args.command == "hierarchy":
+        bench_hierarchy(args.threads, args.per_thread)
+    elif args.command == "contention":
+        bench_contention(args.threads, args.per_thread)
+    elif args.command == "shared":
+        bench_shared(args.workers, args.per_worker)
+    elif args.command == "snapshot":
+        bench_snapshot(args.users, args.budget)
+    elif args.command == "run":
+        results = run_suite(args.workloads, args.requests)
+        if args.baseline_path:
+            save_baseline(args.baseline_path, args.requests, results)
+    elif args.command == "compare":
+        if not compare_to_baseline(args.baseline_path, args.threshold):
+            print("Regression detected.", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Fulfills: REQ-RL-004 (independent per-user buckets in a flat, shareable layout)
+"""Fixed-size open-addressing table of bucket state laid out in a flat byte buffer.
+
+The buffer starts with a header (magic, slot count, used slots) followed by
+fixed-width slots of (key hash, tokens, last_refill, tier id). Keys are stable
+64-bit hashes of user IDs, so the layout works in shared memory and mapped files.
+The little-endian column helpers are shared by the other mapped file formats
+(request traces and user indexes).
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+import sys
+from array import array
+from hashlib import blake2b
+
+
+MAGIC = b"RLTABLE1"
+HEADER = struct.Struct("<8sQQ")       # magic, slot count, used slots (kept by single-writer tables)
+SLOT = struct.Struct("<QddI4x")       # key hash (0 = empty), tokens, last_refill, tier id
+
+
+def key_hash(user: str) -> int:
+    """Stable, process-independent 64-bit hash of a user ID; never 0, which marks an empty slot."""
+    return int.from_bytes(blake2b(user.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def table_bytes(slot_count: int) -> int:
+    """Size in bytes of a table with slot_count slots."""
+    return HEADER.size + slot_count * SLOT.size
+
+
+def init_table(buf, slot_count: int, used: int = 0) -> None:
+    """Write the header into a zero-filled buffer of table_bytes(slot_count) bytes."""
+    HEADER.pack_into(buf, 0, MAGIC, slot_count, used)
+
+
+def read_header(buf) -> tuple[int, int]:
+    """Return (slot count, used slots) of a table buffer. Raises ValueError if the magic does not match."""
+    magic, slot_count, used = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("not a bucket table")
+    return (slot_count, used)
+
+
+def slot_offset(index: int) -> int:
+    """Byte offset of slot index."""
+    return HEADER.size + index * SLOT.size
+
+
+def find_slot(buf, slot_count: int, h: int) -> tuple[int, bool]:
+    """Linear-probe for key hash h. Returns (index, found); if not found, index is the empty slot to claim.
+
+    Raises RuntimeError if the table is full. Not synchronized; callers sharing
+    the buffer must lock around it.
+    """
+    index = h % slot_count
+    for _ in range(slot_count):
+        key = SLOT.unpack_from(buf, slot_offset(index))[0]
+        if key == h:
+            return (index, True)
+        if key == 0:
+            return (index, False)
+        index = (index + 1) % slot_count
+    raise RuntimeError("bucket table is full")
+
+
+def column(mapping: mmap.mmap, offset: int, count: int, typecode: str) -> memoryview:
+    """A typed view of count little-endian items at offset; copied and byte-swapped on big-endian hosts."""
+    itemsize = array(typecode).itemsize
+    raw = memoryview(mapping)[offset:offset + count * itemsize]
+    if sys.byteorder == "little":
+        return raw.cast(typecode)
+    values = array(typecode, raw.tobytes())
+    raw.release()
+    values.byteswap()
+    return memoryview(values)
+
+
+def write_column(out, values: array) -> None:
+    """Append values to out in little-endian order."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(out)
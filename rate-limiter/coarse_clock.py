@@ -0,0 +1,50 @@
+# Fulfills: REQ-RL-003 (lazy refill, computed once per clock tick for hot users)
+"""Coarse clock: the wall clock read once per batch and rounded down to a fixed resolution.
+
+Checks stamped with tick(clock) share one time until the next quantum starts,
+so a hot user's bucket is refilled on the first check of a tick and every
+later check in that tick only compares and subtracts (the refill sees no
+elapsed time). Limits hold exactly in tick time; the error against the wall
+clock is bounded by one resolution:
+
+- Two ticks are less than one resolution further apart or closer together
+  than the wall times they stand for. So any wall-clock window admits at most
+  resolution * refill_rate tokens more than the exact limit, and a user
+  sending without pause has been admitted at most resolution * refill_rate
+  tokens fewer at any moment. The error does not accumulate, because each
+  tick carries the full elapsed time.
+- retry_after is measured from the tick, which may be up to one resolution
+  behind the wall clock. Callers report retry_after + resolution, which is
+  never too short and at most two resolutions longer than the exact wait.
+
+Ticks never go backwards, even if the wall clock does.
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+
+@dataclass
+class CoarseClock:
+    resolution: float                               # seconds per quantum
+    source: Callable[[], float] = time.time         # wall clock, in the same seconds as request times
+    now: float = float("-inf")                      # last tick
+
+
+def create_coarse_clock(resolution: float, source: Callable[[], float] = time.time) -> CoarseClock:
+    """Create a clock that rounds source() down to multiples of resolution. Raises ValueError unless resolution > 0."""
+    if not resolution > 0:
+        raise ValueError("clock resolution must be a positive number of seconds")
+    return CoarseClock(resolution=resolution, source=source)
+
+
+def tick(clock: CoarseClock) -> float:
+    """Read the source once and return the current quantum's start, never less than the previous tick."""
+    wall = clock.source()
+    now = wall - wall % clock.resolution
+    if now > clock.now:
+        clock.now = now
+    return clock.now
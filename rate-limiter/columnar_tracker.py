@@ -0,0 +1,66 @@
+# Fulfills: REQ-RL-004 (independent per-user buckets)
+# Fulfills: REQ-RL-005 (configurable per-user rate limits)
+# Fulfills: REQ-RL-006 (first-request bucket creation at full capacity)
+"""Columnar bucket registry: per-user state in contiguous arrays instead of one dataclass per user."""
+
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass, field
+
+from token_bucket import BucketConfig, check_cost
+from quota_tracker import QuotaConfig, intern_tiers, require_token_buckets
+
+
+@dataclass
+class ColumnarTracker:
+    config: QuotaConfig
+    tiers: list[BucketConfig]                  # tier id -> config; tier 0 is the default
+    user_tiers: dict[str, int]                 # per-user overrides as tier ids
+    slots: dict[str, int] = field(default_factory=dict)
+    tokens: array = field(default_factory=lambda: array("d"))
+    last_refill: array = field(default_factory=lambda: array("d"))
+    tier: array = field(default_factory=lambda: array("I"))
+
+
+def create_columnar_tracker(config: QuotaConfig) -> ColumnarTracker:
+    """Create a columnar tracker, interning identical configs into one tier id each.
+
+    Raises ValueError for configs with org or global limits or other algorithms, which only quota_tracker enforces.
+    """
+    require_token_buckets(config, "the columnar tracker")
+    tiers, user_tiers = intern_tiers(config)
+    return ColumnarTracker(config=config, tiers=tiers, user_tiers=user_tiers)
+
+
+def check_request(
+    tracker: ColumnarTracker, user: str, now: float, cost: float = 1.0
+) -> tuple[bool, float, float | None]:
+    """Look up or allocate the user's slot, then refill and try to consume cost tokens in place.
+
+    Same contract and arithmetic as quota_tracker.check_request.
+    """
+    slot = tracker.slots.get(user)
+    if slot is None:
+        slot = len(tracker.tokens)
+        tier_id = tracker.user_tiers.get(user, 0)
+        tracker.slots[user] = slot
+        tracker.tokens.append(tracker.tiers[tier_id].capacity)
+        tracker.last_refill.append(now)
+        tracker.tier.append(tier_id)
+
+    config = tracker.tiers[tracker.tier[slot]]
+    if cost != 1.0:
+        check_cost(cost, config)
+    tokens = tracker.tokens[slot]
+    elapsed = now - tracker.last_refill[slot]
+    if elapsed > 0:
+        tokens = min(config.capacity, tokens + elapsed * config.refill_rate)
+        tracker.last_refill[slot] = now
+
+    if tokens >= cost:
+        tokens -= cost
+        tracker.tokens[slot] = tokens
+        return (True, tokens, None)
+    tracker.tokens[slot] = tokens
+    return (False, tokens, (cost - tokens) / config.refill_rate)
@@ -4,40 +4,137 @@
 from __future__ import annotations
 
 import json
+from collections.abc import Iterator
+from dataclasses import dataclass
 from pathlib import Path
+from typing import IO
 
+from algorithms import ALGORITHMS
 from token_bucket import BucketConfig
 from quota_tracker import QuotaConfig
+from user_index import UserIndex, open_user_index, user_configs
 
 
-def load_config(config_data: dict) -> QuotaConfig:
+def load_config(config_data: dict, base_dir: Path | None = None) -> QuotaConfig:
     """Parse the config section of a scenario file into a QuotaConfig.
 
     Validates required fields (default.capacity, default.refill_rate).
-    Raises ValueError on malformed input.
+    Users may give an inline config or the name of an entry in the optional
+    "tiers" section. Identical configs are interned, so all users of a tier
+    share one BucketConfig object. Optional "global" and "orgs" sections add
+    ceilings above the user buckets; each org lists its "members". Any bucket
+    config may name an "algorithm" (see algorithms.py); org and global limits
+    require token buckets throughout.
+    Instead of "users", a config may name a "users_index" file written by
+    user_index.write_user_index (relative paths are taken from base_dir, or the
+    working directory); overrides are then looked up on each user's first
+    request instead of parsed here.
+    Raises ValueError on malformed input, FileNotFoundError if the index is missing.
     """
     if "default" not in config_data:
         raise ValueError("config must contain a 'default' section")
 
-    default_data = config_data["default"]
-    if "capacity" not in default_data or "refill_rate" not in default_data:
-        raise ValueError("default config must contain 'capacity' and 'refill_rate'")
+    default = _parse_bucket_config(config_data["default"], "default")
+    interned = {(default.capacity, default.refill_rate, default.algorithm): default}
 
-    default = BucketConfig(
-        capacity=float(default_data["capacity"]),
-        refill_rate=float(default_data["refill_rate"]),
-    )
+    tiers: dict[str, BucketConfig] = {}
+    for tier_name, tier_data in config_data.get("tiers", {}).items():
+        tier = _parse_bucket_config(tier_data, f"tier '{tier_name}'")
+        tiers[tier_name] = interned.setdefault((tier.capacity, tier.refill_rate, tier.algorithm), tier)
 
-    users: dict[str, BucketConfig] = {}
+    users: dict[str, BucketConfig] | UserIndex = {}
+    if "users_index" in config_data:
+        if "users" in config_data:
+            raise ValueError("config may contain 'users' or 'users_index', not both")
+        if not isinstance(config_data["users_index"], str):
+            raise ValueError("'users_index' must be a file path")
+        users = open_user_index(Path(base_dir or ".", config_data["users_index"]))
+        users.configs = [interned.setdefault((c.capacity, c.refill_rate, c.algorithm), c) for c in users.configs]
     for user_id, user_data in config_data.get("users", {}).items():
-        if "capacity" not in user_data or "refill_rate" not in user_data:
-            raise ValueError(f"user '{user_id}' config must contain 'capacity' and 'refill_rate'")
-        users[user_id] = BucketConfig(
-            capacity=float(user_data["capacity"]),
-            refill_rate=float(user_data["refill_rate"]),
-        )
+        if isinstance(user_data, str):
+            if user_data not in tiers:
+                raise ValueError(f"user '{user_id}' refers to unknown tier '{user_data}'")
+            users[user_id] = tiers[user_data]
+        else:
+            user_config = _parse_bucket_config(user_data, f"user '{user_id}'")
+            users[user_id] = interned.setdefault(
+                (user_config.capacity, user_config.refill_rate, user_config.algorithm), user_config,
+            )
+
+    global_limit = None
+    if "global" in config_data:
+        global_limit = _parse_bucket_config(config_data["global"], "global")
+
+    orgs: dict[str, BucketConfig] = {}
+    user_orgs: dict[str, str] = {}
+    for org_name, org_data in config_data.get("orgs", {}).items():
+        orgs[org_name] = _parse_bucket_config(org_data, f"org '{org_name}'")
+        members = org_data.get("members", [])
+        if not isinstance(members, list):
+            raise ValueError(f"org '{org_name}' members must be a list of user IDs")
+        for member in members:
+            if member in user_orgs:
+                raise ValueError(f"user '{member}' belongs to both org '{user_orgs[member]}' and org '{org_name}'")
+            user_orgs[member] = org_name
+
+    if orgs or global_limit is not None:
+        for bucket_config in (default, global_limit, *orgs.values(), *tiers.values(), *user_configs(users)):
+            if bucket_config is not None and bucket_config.algorithm != "token_bucket":
+                raise ValueError("org and global limits require the token_bucket algorithm everywhere")
+
+    return QuotaConfig(
+        default=default, users=users, tiers=tiers, global_limit=global_limit, orgs=orgs, user_orgs=user_orgs,
+    )
+
+
+def dump_config(config: QuotaConfig) -> dict:
+    """Turn a QuotaConfig back into a config section that load_config parses to an equivalent config.
 
-    return QuotaConfig(default=default, users=users)
+    Users sharing a tier's config object refer to that tier by name. An index
+    of users is referred to by its absolute path.
+    """
+    tier_names = {id(tier): name for name, tier in config.tiers.items()}
+    data: dict = {
+        "default": _dump_bucket_config(config.default),
+        "tiers": {name: _dump_bucket_config(tier) for name, tier in config.tiers.items()},
+    }
+    if isinstance(config.users, UserIndex):
+        data["users_index"] = str(config.users.path)
+    else:
+        data["users"] = {
+            user: tier_names.get(id(user_config)) or _dump_bucket_config(user_config)
+            for user, user_config in config.users.items()
+        }
+    if config.global_limit is not None:
+        data["global"] = _dump_bucket_config(config.global_limit)
+    if config.orgs:
+        members: dict[str, list[str]] = {org: [] for org in config.orgs}
+        for user, org in config.user_orgs.items():
+            members[org].append(user)
+        data["orgs"] = {
+            org: {**_dump_bucket_config(org_config), "members": members[org]} for org, org_config in config.orgs.items()
+        }
+    return data
+
+
+def _dump_bucket_config(config: BucketConfig) -> dict:
+    data = {"capacity": config.capacity, "refill_rate": config.refill_rate}
+    if config.algorithm != "token_bucket":
+        data["algorithm"] = config.algorithm
+    return data
+
+
+def _parse_bucket_config(data: dict, owner: str) -> BucketConfig:
+    """Build a BucketConfig from a {"capacity", "refill_rate"[, "algorithm"]} object.
+
+    Raises ValueError if either number is missing or the algorithm is unknown.
+    """
+    if not isinstance(data, dict) or "capacity" not in data or "refill_rate" not in data:
+        raise ValueError(f"{owner} config must contain 'capacity' and 'refill_rate'")
+    algorithm = data.get("algorithm", "token_bucket")
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"{owner} has unknown algorithm '{algorithm}', expected one of {', '.join(ALGORITHMS)}")
+    return BucketConfig(capacity=float(data["capacity"]), refill_rate=float(data["refill_rate"]), algorithm=algorithm)
 
 
 def load_scenario(file_path: str) -> tuple[QuotaConfig, list[dict]]:
@@ -61,7 +158,7 @@ def load_scenario(file_path: str) -> tuple[QuotaConfig, list[dict]]:
     if "requests" not in data:
         raise ValueError("scenario file must contain a 'requests' section")
 
-    config = load_config(data["config"])
+    config = load_config(data["config"], path.parent)
     requests = data["requests"]
 
     if not isinstance(requests, list):
@@ -70,10 +167,168 @@ def load_scenario(file_path: str) -> tuple[QuotaConfig, list[dict]]:
     return (config, requests)
 
 
-def validate_request(request: dict) -> tuple[str, float]:
-    """Validate a single request dict has 'user' (non-empty string) and 'time' (float).
+def load_config_file(file_path: str) -> QuotaConfig:
+    """Read a JSON file holding a config object, or a scenario file whose "config" section is used.
 
-    Returns (user, time). Raises ValueError on invalid input.
+    Raises FileNotFoundError if missing, ValueError if malformed.
+    """
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"config file not found: {file_path}")
+
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"malformed JSON in config file: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("config file must contain a JSON object")
+
+    return load_config(data.get("config", data), path.parent)
+
+
+READ_CHUNK = 1 << 16
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+
+def iter_scenario(file_path: str) -> tuple[QuotaConfig, Iterator[dict]]:
+    """Open a scenario file and stream its requests instead of loading the whole file.
+
+    Accepts the regular JSON format, where "config" must come before "requests",
+    or NDJSON (.ndjson/.jsonl) with {"config": {...}} on the first line and one
+    request object per following line. Returns (QuotaConfig, requests iterator).
+    Raises FileNotFoundError if missing, ValueError if malformed (possibly while iterating).
+    """
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"scenario file not found: {file_path}")
+
+    stream = _stream_ndjson(path) if path.suffix in NDJSON_SUFFIXES else _stream_json(path)
+    config = next(stream)
+    return (config, stream)
+
+
+def _stream_ndjson(path: Path) -> Iterator:
+    """Yield the QuotaConfig from the first line, then one request dict per following line."""
+    with path.open(encoding="utf-8") as f:
+        config = None
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"malformed JSON in scenario file line {line_number}: {e}")
+            if config is None:
+                if not isinstance(data, dict) or "config" not in data:
+                    raise ValueError("first line of an NDJSON scenario must be a 'config' object")
+                config = load_config(data["config"], path.parent)
+                yield config
+            else:
+                yield data
+        if config is None:
+            raise ValueError("scenario file must contain a 'config' section")
+
+
+@dataclass
+class _JsonReader:
+    file: IO[str]
+    buffer: str = ""
+    pos: int = 0
+    eof: bool = False
+
+
+def _fill(reader: _JsonReader, size: int = READ_CHUNK) -> None:
+    """Drop consumed text and append up to size more characters from the file."""
+    chunk = reader.file.read(size)
+    reader.buffer = reader.buffer[reader.pos:] + chunk
+    reader.pos = 0
+    reader.eof = not chunk
+
+
+def _peek(reader: _JsonReader) -> str:
+    """Skip whitespace and return the next character without consuming it ('' at end of file)."""
+    while True:
+        while reader.pos < len(reader.buffer) and reader.buffer[reader.pos] in " \t\r\n":
+            reader.pos += 1
+        if reader.pos < len(reader.buffer) or reader.eof:
+            return reader.buffer[reader.pos:reader.pos + 1]
+        _fill(reader)
+
+
+def _expect(reader: _JsonReader, char: str) -> None:
+    """Consume char or raise ValueError."""
+    found = _peek(reader)
+    if found != char:
+        raise ValueError(f"malformed JSON in scenario file: expected '{char}', found '{found or 'end of file'}'")
+    reader.pos += 1
+
+
+_decoder = json.JSONDecoder()
+
+
+def _decode_value(reader: _JsonReader):
+    """Decode one JSON value, reading more of the file until it is complete.
+
+    A value cut off by the end of the buffer fails further along once more is
+    read, so an error that stays put after a read is raised without reading on.
+    An unterminated string is the exception: its error stays at its opening
+    quote until the closing quote arrives.
+    """
+    _peek(reader)
+    failed_at = None
+    while True:
+        try:
+            value, end = _decoder.raw_decode(reader.buffer, reader.pos)
+        except json.JSONDecodeError as e:
+            at = e.pos - reader.pos
+            if reader.eof or (at == failed_at and not e.msg.startswith("Unterminated string")):
+                raise ValueError(f"malformed JSON in scenario file: {e}")
+            failed_at = at
+        else:
+            # A number running to the end of the buffer may continue in the next chunk.
+            if end < len(reader.buffer) or reader.eof:
+                reader.pos = end
+                return value
+        _fill(reader, max(READ_CHUNK, len(reader.buffer)))
+
+
+def _stream_json(path: Path) -> Iterator:
+    """Yield the QuotaConfig, then each element of the top-level "requests" array as it is parsed."""
+    with path.open(encoding="utf-8") as f:
+        reader = _JsonReader(file=f)
+        config = None
+        _expect(reader, "{")
+        while _peek(reader) != "}":
+            key = _decode_value(reader)
+            _expect(reader, ":")
+            if key == "config":
+                config = load_config(_decode_value(reader), path.parent)
+                yield config
+            elif key == "requests":
+                if config is None:
+                    raise ValueError("streaming a scenario requires 'config' before 'requests'")
+                _expect(reader, "[")
+                if _peek(reader) == "]":
+                    return
+                while True:
+                    yield _decode_value(reader)
+                    if _peek(reader) == "]":
+                        return
+                    _expect(reader, ",")
+            else:
+                _decode_value(reader)
+            if _peek(reader) == ",":
+                reader.pos += 1
+
+        if config is None:
+            raise ValueError("scenario file must contain a 'config' section")
+        raise ValueError("scenario file must contain a 'requests' section")
+
+
+def validate_request(request: dict) -> tuple[str, float, float]:
+    """Validate a single request dict has 'user' (non-empty string), 'time' (float) and optional 'cost'.
+
+    Returns (user, time, cost); cost defaults to 1.0. Raises ValueError on invalid input.
     """
     if "user" not in request:
         raise ValueError("request must contain 'user'")
@@ -84,4 +339,8 @@ def validate_request(request: dict) -> tuple[str, float]:
     if not isinstance(user, str) or not user:
         raise ValueError("user ID must be a non-empty string")
 
-    return (user, float(request["time"]))
+    cost = float(request.get("cost", 1.0))
+    if not cost > 0:
+        raise ValueError("request 'cost' must be a positive number")
+
+    return (user, float(request["time"]), cost)
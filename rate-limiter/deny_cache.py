@@ -0,0 +1,86 @@
+# Fulfills: REQ-RL-002 (deny decisions with retry_after, answered early for users known to be empty)
+"""Deny fast path in front of a QuotaTracker: repeat denials skip the registry and the consume call.
+
+When check_request denies a user, the cache remembers the user's bucket until
+the moment it could succeed again (now + retry_after). A request from that
+user before then is decided right here with the same refill arithmetic as
+try_consume, applied to the same bucket, so the result and the bucket's state
+are exactly what the uncached path would produce; a request the refilled
+bucket can cover falls through to quota_tracker. Only flat token-bucket users
+are cached: org and global buckets are shared and must be refilled on every
+check. The cache holds at most max_entries users, dropping the oldest entry
+first, and an entry is ignored once reload_config has bumped the generation.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+import quota_tracker
+from quota_tracker import QuotaTracker
+from token_bucket import TokenBucket, check_cost
+
+
+@dataclass
+class DenyCache:
+    tracker: QuotaTracker
+    max_entries: int = 1024
+    entries: dict[str, tuple] = field(default_factory=dict)    # user -> (deadline, bucket, generation, capacity, rate)
+    hits: int = 0                                                # requests answered without the tracker
+
+
+def create_deny_cache(tracker: QuotaTracker, max_entries: int = 1024) -> DenyCache:
+    """Put a deny cache in front of tracker.
+
+    Raises ValueError unless max_entries is at least 1, or if the tracker evicts
+    buckets: skipping its LRU bookkeeping would change which buckets it drops.
+    """
+    if max_entries < 1:
+        raise ValueError("max_entries must be at least 1")
+    if tracker.evict_idle or tracker.max_entries is not None:
+        raise ValueError("the deny cache needs a tracker that does not evict buckets")
+    return DenyCache(tracker=tracker, max_entries=max_entries)
+
+
+def check_request(cache: DenyCache, user: str, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """quota_tracker.check_request on cache.tracker, with repeat denials answered from the cache."""
+    entry = cache.entries.get(user)
+    if entry is not None:
+        deadline, bucket, generation, capacity, rate = entry
+        if now < deadline and generation == cache.tracker.generation:
+            if cost != 1.0:
+                check_cost(cost, bucket.config)
+            # The refill try_consume would do, written back only if it still leaves the bucket short.
+            tokens = bucket.tokens
+            elapsed = now - bucket.last_refill
+            if elapsed > 0:
+                tokens += elapsed * rate
+                if tokens > capacity:
+                    tokens = capacity
+                if tokens < cost:
+                    bucket.tokens = tokens
+                    bucket.last_refill = now
+                    cache.hits += 1
+                    return (False, tokens, (cost - tokens) / rate)
+            elif tokens < cost:
+                cache.hits += 1
+                return (False, tokens, (cost - tokens) / rate)
+        del cache.entries[user]
+
+    result = quota_tracker.check_request(cache.tracker, user, now, cost)
+    if not result[0]:
+        _remember(cache, user, now + result[2])
+    return result
+
+
+def _remember(cache: DenyCache, user: str, deadline: float) -> None:
+    """Cache a denied user's bucket until deadline, if it is a flat token bucket."""
+    tracker = cache.tracker
+    config = tracker.config
+    bucket = tracker.buckets[user]
+    if bucket.__class__ is not TokenBucket or config.orgs or config.global_limit is not None:
+        return
+    entries = cache.entries
+    if len(entries) >= cache.max_entries:
+        del entries[next(iter(entries))]
+    entries[user] = (deadline, bucket, tracker.generation, bucket.config.capacity, bucket.config.refill_rate)
@@ -0,0 +1,210 @@
+# Fulfills: REQ-RL-004 (offline stand-in for a shared bucket store)
+"""In-process stand-in for a Redis server, enough to run redis_backend without one.
+
+Speaks RESP over TCP and supports PING, HMGET, HSET, DEL, FLUSHALL, SCRIPT
+LOAD/FLUSH, EVAL and EVALSHA. Lua is not interpreted: the only script it runs
+is redis_backend.TOKEN_BUCKET_SCRIPT, through a Python port with the same
+double arithmetic and %.17g formatting. Commands execute one at a time under a
+lock, like Redis's single thread, so each script call is atomic. A script
+flush can be scheduled partway through a pipeline (schedule_script_flush).
+"""
+
+from __future__ import annotations
+
+import socketserver
+import threading
+from dataclasses import dataclass
+from hashlib import sha1
+
+from redis_backend import SCRIPT_SHA, TOKEN_BUCKET_SCRIPT
+
+
+@dataclass
+class FakeRedis:
+    server: socketserver.ThreadingTCPServer
+    thread: threading.Thread
+    host: str
+    port: int
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int]) -> None:
+        super().__init__(address, _Handler)
+        self.lock = threading.Lock()
+        self.data: dict[bytes, dict[bytes, bytes]] = {}
+        self.scripts: set[str] = set()
+        self.flush_after: int | None = None       # script calls left before the cache is flushed
+        self.reload_after: int | None = None      # then calls refused before the script is loaded again
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        """Read whatever the client pipelined, run every complete command, and answer with one write."""
+        sock = self.request
+        pending = b""
+        while True:
+            data = sock.recv(1 << 16)
+            if not data:
+                return
+            try:
+                commands, pending = parse_commands(pending + data)
+            except ValueError:
+                sock.sendall(b"-ERR Protocol error\r\n")
+                return
+            if commands:
+                with self.server.lock:
+                    replies = [_execute(self.server, args) for args in commands]
+                sock.sendall(b"".join(replies))
+
+
+def start_fake_redis(host: str = "127.0.0.1", port: int = 0) -> FakeRedis:
+    """Start serving on host:port (0 picks a free port) in a daemon thread."""
+    server = _Server((host, port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    bound_host, bound_port = server.server_address[:2]
+    return FakeRedis(server=server, thread=thread, host=bound_host, port=bound_port)
+
+
+def schedule_script_flush(fake: FakeRedis, after: int, reload_after: int | None = None) -> None:
+    """Flush the script cache after the next after script calls, as a SCRIPT FLUSH from another client would.
+
+    With reload_after, the script is loaded again once that many calls have
+    been refused, as another client recovering from NOSCRIPT would.
+    """
+    with fake.server.lock:
+        fake.server.flush_after = after
+        fake.server.reload_after = reload_after
+
+
+def stop_fake_redis(fake: FakeRedis) -> None:
+    """Stop accepting connections and release the port."""
+    fake.server.shutdown()
+    fake.server.server_close()
+    fake.thread.join()
+
+
+def parse_commands(buffer: bytes) -> tuple[list[list[bytes]], bytes]:
+    """Split buffer into complete RESP command arrays and the unparsed rest. Raises ValueError on bad framing."""
+    commands = []
+    pos = 0
+    while True:
+        start = pos
+        end = buffer.find(b"\r\n", pos)
+        if end < 0:
+            break
+        if buffer[pos:pos + 1] != b"*":
+            raise ValueError("expected a RESP array")
+        count = int(buffer[pos + 1:end])
+        pos = end + 2
+        args = []
+        for _ in range(count):
+            end = buffer.find(b"\r\n", pos)
+            if end < 0 or buffer[pos:pos + 1] != b"$":
+                break
+            length = int(buffer[pos + 1:end])
+            if end + 4 + length > len(buffer):
+                break
+            args.append(buffer[end + 2:end + 2 + length])
+            pos = end + 4 + length
+        if len(args) < count:
+            pos = start
+            break
+        commands.append(args)
+    return (commands, buffer[pos:])
+
+
+def _bulk(data: bytes | None) -> bytes:
+    return b"$-1\r\n" if data is None else b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _g17(value: float) -> bytes:
+    """Lua's string.format('%.17g', value)."""
+    return format(value, ".17g").encode()
+
+
+def _execute(server: _Server, args: list[bytes]) -> bytes:
+    """Run one command against the server state and return its encoded reply."""
+    name = args[0].upper() if args else b""
+    if name == b"PING":
+        return b"+PONG\r\n"
+    if name == b"HMGET" and len(args) >= 3:
+        fields = server.data.get(args[1], {})
+        return b"*%d\r\n" % (len(args) - 2) + b"".join(_bulk(fields.get(f)) for f in args[2:])
+    if name == b"HSET" and len(args) >= 4 and len(args) % 2 == 0:
+        fields = server.data.setdefault(args[1], {})
+        added = sum(1 for f in args[2::2] if f not in fields)
+        fields.update(zip(args[2::2], args[3::2]))
+        return b":%d\r\n" % added
+    if name == b"DEL":
+        return b":%d\r\n" % sum(1 for key in args[1:] if server.data.pop(key, None) is not None)
+    if name == b"FLUSHALL":
+        server.data.clear()
+        return b"+OK\r\n"
+    if name == b"SCRIPT" and len(args) >= 2:
+        sub = args[1].upper()
+        if sub == b"FLUSH":
+            server.scripts.clear()
+            return b"+OK\r\n"
+        if sub == b"LOAD" and len(args) == 3:
+            if args[2].decode() != TOKEN_BUCKET_SCRIPT:
+                return b"-ERR fake server only runs the token bucket script\r\n"
+            server.scripts.add(SCRIPT_SHA)
+            return _bulk(SCRIPT_SHA.encode())
+    if name in (b"EVAL", b"EVALSHA") and len(args) >= 3:
+        _count_script_call(server)
+        if name == b"EVAL":
+            if args[1].decode() != TOKEN_BUCKET_SCRIPT:
+                return b"-ERR fake server only runs the token bucket script\r\n"
+            server.scripts.add(sha1(args[1]).hexdigest())
+        elif args[1].decode().lower() not in server.scripts:
+            return b"-NOSCRIPT No matching script. Please use EVAL.\r\n"
+        if int(args[2]) != 1 or len(args) != 8:
+            return b"-ERR token bucket script takes 1 key and 4 arguments\r\n"
+        return _run_token_bucket(server.data, args[3], args[4:])
+    return b"-ERR unknown command or wrong number of arguments\r\n"
+
+
+def _count_script_call(server: _Server) -> None:
+    """Advance a scheduled flush (and reload) by one script call."""
+    if server.flush_after is not None:
+        if server.flush_after > 0:
+            server.flush_after -= 1
+            return
+        server.scripts.clear()
+        server.flush_after = None
+    if server.reload_after is not None:
+        if server.reload_after > 0:
+            server.reload_after -= 1
+            return
+        server.scripts.add(SCRIPT_SHA)
+        server.reload_after = None
+
+
+def _run_token_bucket(data: dict[bytes, dict[bytes, bytes]], key: bytes, argv: list[bytes]) -> bytes:
+    """Python port of TOKEN_BUCKET_SCRIPT, line for line."""
+    capacity, refill_rate, now, cost = (float(arg) for arg in argv)
+    fields = data.setdefault(key, {})
+    if b"tokens" in fields:
+        tokens, last_refill = float(fields[b"tokens"]), float(fields[b"last_refill"])
+    else:
+        tokens, last_refill = capacity, now
+    elapsed = now - last_refill
+    if elapsed > 0:
+        tokens = min(capacity, tokens + elapsed * refill_rate)
+        last_refill = now
+    tokens = min(capacity, tokens)
+    allowed = 0
+    retry_after = b""
+    if tokens >= cost:
+        tokens = tokens - cost
+        allowed = 1
+    else:
+        retry_after = _g17((cost - tokens) / refill_rate)
+    tokens = min(capacity, tokens)
+    fields[b"tokens"] = _g17(tokens)
+    fields[b"last_refill"] = _g17(last_refill)
+    return b"*3\r\n:%d\r\n" % allowed + _bulk(_g17(tokens)) + _bulk(retry_after)
@@ -0,0 +1,124 @@
+# Fulfills: REQ-RL-001 (allow decisions served from locally leased tokens)
+# Fulfills: REQ-RL-002 (deny decisions with retry_after from the authoritative bucket)
+"""Client-side token leases in front of a storage backend: most checks need no remote call.
+
+When a user's local lease cannot cover a request, the node asks the
+authoritative bucket for the request's cost plus a lease of lease_fraction x
+capacity in one atomic consume, and serves later requests from the lease until
+it runs out or lease_ttl passes. Leftover tokens are handed back (capped at
+capacity) when the lease is renewed or expired.
+
+Leased tokens leave the authoritative bucket before they are spent, so the
+total never exceeds what the bucket granted. They can be spent later than they
+were taken, though: over any interval, a user can be admitted up to one lease
+(lease_fraction x capacity) per node more than a single shared bucket would
+allow. Tokens sitting in one node's lease are unavailable to the others until
+they are returned, which bounds the unfairness the same way. lease_fraction=0
+turns leasing off.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from quota_tracker import check_user_cost
+from storage_backend import BackendTracker
+
+
+@dataclass
+class Lease:
+    tokens: float                      # leased tokens not yet spent
+    remote_remaining: float            # authoritative tokens left right after the lease was taken
+    expires_at: float
+
+
+@dataclass
+class LeaseTracker:
+    tracker: BackendTracker            # the authoritative store
+    lease_fraction: float = 0.1        # lease size as a fraction of the user's capacity
+    lease_ttl: float = 1.0             # seconds (request time) before unused tokens go back
+    leases: dict[str, Lease] = field(default_factory=dict)
+    remote_calls: int = 0              # round trips to the backend, for measuring the cache
+
+
+def create_lease_tracker(tracker: BackendTracker, lease_fraction: float = 0.1, lease_ttl: float = 1.0) -> LeaseTracker:
+    """Put a lease cache in front of tracker. Raises ValueError unless 0 <= lease_fraction < 1 and lease_ttl > 0."""
+    if not 0 <= lease_fraction < 1:
+        raise ValueError("lease_fraction must be at least 0 and below 1")
+    if not lease_ttl > 0:
+        raise ValueError("lease_ttl must be positive")
+    return LeaseTracker(tracker=tracker, lease_fraction=lease_fraction, lease_ttl=lease_ttl)
+
+
+def check_request(
+    lease_tracker: LeaseTracker, user: str, now: float, cost: float = 1.0
+) -> tuple[bool, float, float | None]:
+    """Serve the request from the user's lease if it covers cost, otherwise renew the lease remotely.
+
+    Same contract as quota_tracker.check_request. For requests served locally,
+    remaining is an estimate: the lease left plus the authoritative tokens
+    left when the lease was taken.
+    """
+    lease = lease_tracker.leases.get(user)
+    if lease is not None and lease.tokens >= cost and now < lease.expires_at:
+        lease.tokens -= cost
+        return (True, lease.tokens + lease.remote_remaining, None)
+    return _renew(lease_tracker, user, now, cost, lease)
+
+
+def expire_leases(lease_tracker: LeaseTracker, now: float) -> None:
+    """Hand back every lease past its ttl in one pipelined call. Call periodically so idle users' tokens return."""
+    expired = [user for user, lease in lease_tracker.leases.items() if now >= lease.expires_at]
+    _return_leases(lease_tracker, expired, now)
+
+
+def release_leases(lease_tracker: LeaseTracker, now: float) -> None:
+    """Hand back every lease, e.g. on shutdown."""
+    _return_leases(lease_tracker, list(lease_tracker.leases), now)
+
+
+def _return_leases(lease_tracker: LeaseTracker, users: list[str], now: float) -> None:
+    config = lease_tracker.tracker.config
+    refunds = []
+    for user in users:
+        lease = lease_tracker.leases.pop(user)
+        if lease.tokens > 0:
+            refunds.append((user, config.users.get(user, config.default), now, -lease.tokens))
+    if refunds:
+        lease_tracker.remote_calls += 1
+        lease_tracker.tracker.backend.consume_many(refunds)
+
+
+def _renew(
+    lease_tracker: LeaseTracker, user: str, now: float, cost: float, lease: Lease | None
+) -> tuple[bool, float, float | None]:
+    """Return the old lease's leftovers and take cost plus a new lease in one round trip.
+
+    If the bucket cannot cover the lease too, the request is decided on its own
+    cost: from the reply when that is already short, otherwise with one more call.
+    """
+    tracker = lease_tracker.tracker
+    config = tracker.config.users.get(user, tracker.config.default)
+    if cost != 1.0:
+        check_user_cost(tracker.config, user, cost)
+    size = max(0.0, min(lease_tracker.lease_fraction * config.capacity, config.capacity - cost))
+
+    requests = []
+    if lease is not None:
+        del lease_tracker.leases[user]
+        if lease.tokens > 0:
+            requests.append((user, config, now, -lease.tokens))
+    requests.append((user, config, now, cost + size))
+    lease_tracker.remote_calls += 1
+    allowed, remaining, retry_after = tracker.backend.consume_many(requests)[-1]
+
+    if allowed:
+        if size > 0:
+            lease_tracker.leases[user] = Lease(
+                tokens=size, remote_remaining=remaining, expires_at=now + lease_tracker.lease_ttl,
+            )
+        return (True, remaining + size, None)
+    if size == 0 or remaining < cost:
+        return (False, remaining, (cost - remaining) / config.refill_rate)
+    lease_tracker.remote_calls += 1
+    return tracker.backend.consume(user, config, now, cost)
@@ -0,0 +1,197 @@
+# Fulfills: REQ-RL-001 (visibility into allow decisions)
+# Fulfills: REQ-RL-002 (visibility into deny decisions and throttled users)
+"""Decision metrics for a QuotaTracker: counters, a latency histogram and the most-denied users.
+
+check_request and check_requests here wrap the quota_tracker functions of the
+same name and record each decision in a Metrics; code that calls quota_tracker
+directly pays nothing. Latency is sampled: one single check in sample_every is
+timed, and each batch is timed once and counted at its per-request average,
+because reading the clock costs about as much as a decision. Denied users are
+queued and merged PENDING_DENIALS at a time into a Space-Saving sketch of top_k
+entries, whose counts over-estimate by at most their reported error. Updates
+are not locked, so record from one thread at a time, as serve and the scenario
+command do.
+"""
+
+from __future__ import annotations
+
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import compress
+from operator import itemgetter, not_
+from pathlib import Path
+from time import perf_counter_ns
+
+import quota_tracker
+from quota_tracker import QuotaTracker
+
+
+LATENCY_BUCKETS = 32                  # bucket i counts latencies under 2**i ns; the last one also takes anything slower
+PENDING_DENIALS = 4096                # denied users queued before they are merged into the sketch
+
+
+@dataclass
+class SpaceSaving:
+    size: int                                                      # keys tracked at most
+    counts: dict[str, int] = field(default_factory=dict)           # key -> estimated count, never an under-estimate
+    errors: dict[str, int] = field(default_factory=dict)           # key -> most its count can be over
+
+
+@dataclass
+class Metrics:
+    tracker: QuotaTracker
+    sample_every: int = 64                                         # single checks per timed one
+    allowed: int = 0
+    denied: int = 0
+    latency_counts: list[int] = field(default_factory=lambda: [0] * LATENCY_BUCKETS)
+    latency_sum: float = 0.0                                       # seconds, over the timed decisions
+    countdown: int = 0                                             # single checks left before the next timed one
+    denied_users: SpaceSaving = field(default_factory=lambda: SpaceSaving(size=32))
+    pending_denials: list[str] = field(default_factory=list)      # denied users not yet merged into denied_users
+
+
+def create_metrics(tracker: QuotaTracker, sample_every: int = 64, top_k: int = 32) -> Metrics:
+    """Start recording decisions made on tracker. Raises ValueError unless sample_every and top_k are at least 1."""
+    if sample_every < 1 or top_k < 1:
+        raise ValueError("sample_every and top_k must be at least 1")
+    return Metrics(tracker=tracker, sample_every=sample_every, denied_users=SpaceSaving(size=top_k))
+
+
+def merge(sketch: SpaceSaving, batch: dict[str, int]) -> None:
+    """Count every key of batch by its weight, keeping at most size keys.
+
+    Keys not yet tracked start from the smallest tracked count (0 while the
+    sketch has room) and carry it as error, since an untracked key was seen
+    at most that often; then only the size largest estimates are kept. Only
+    the batch's size heaviest new keys can make the cut, so the rest are never
+    looked at.
+    """
+    counts = sketch.counts
+    errors = sketch.errors
+    floor = min(counts.values()) if len(counts) >= sketch.size else 0
+    tracked = batch.keys() & counts.keys()
+    for key in tracked:
+        counts[key] += batch[key]
+    heaviest = sorted(batch.items(), key=itemgetter(1), reverse=True)[:sketch.size + len(tracked)]
+    for key, weight in heaviest:
+        if key not in tracked:
+            counts[key] = floor + weight
+            errors[key] = floor
+    if len(counts) > sketch.size:
+        kept = sorted(counts.items(), key=itemgetter(1), reverse=True)[:sketch.size]
+        sketch.counts = dict(kept)
+        sketch.errors = {key: errors[key] for key, _ in kept}
+
+
+def top(sketch: SpaceSaving, n: int | None = None) -> list[tuple[str, int, int]]:
+    """The n keys with the highest estimates as (key, estimate, error), highest first."""
+    ranked = sorted(sketch.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+    return [(key, count, sketch.errors[key]) for key, count in ranked]
+
+
+def check_request(metrics: Metrics, user: str, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """quota_tracker.check_request on metrics.tracker, recording the decision."""
+    if metrics.countdown:
+        metrics.countdown -= 1
+        result = quota_tracker.check_request(metrics.tracker, user, now, cost)
+    else:
+        metrics.countdown = metrics.sample_every - 1
+        start = perf_counter_ns()
+        result = quota_tracker.check_request(metrics.tracker, user, now, cost)
+        _observe(metrics, perf_counter_ns() - start, 1)
+    if result[0]:
+        metrics.allowed += 1
+    else:
+        metrics.denied += 1
+        pending = metrics.pending_denials
+        pending.append(user)
+        if len(pending) >= PENDING_DENIALS:
+            flush_denials(metrics)
+    return result
+
+
+def check_requests(
+    metrics: Metrics, users: list[str], times: list[float], costs: list[float] | None = None
+) -> tuple[list[bool], list[float], list[float | None]]:
+    """quota_tracker.check_requests on metrics.tracker, recording every decision in the batch."""
+    start = perf_counter_ns()
+    results = quota_tracker.check_requests(metrics.tracker, users, times, costs)
+    elapsed = perf_counter_ns() - start
+    count = len(users)
+    if count:
+        _observe(metrics, elapsed, count)
+        allowed = results[0]
+        granted = allowed.count(True)
+        metrics.allowed += granted
+        if granted < count:
+            metrics.denied += count - granted
+            pending = metrics.pending_denials
+            pending.extend(compress(users, map(not_, allowed)))
+            if len(pending) >= PENDING_DENIALS:
+                flush_denials(metrics)
+    return results
+
+
+def flush_denials(metrics: Metrics) -> None:
+    """Merge the queued denied users into the sketch."""
+    merge(metrics.denied_users, Counter(metrics.pending_denials))
+    metrics.pending_denials.clear()
+
+
+def _observe(metrics: Metrics, elapsed_ns: int, count: int) -> None:
+    """Record count decisions that took elapsed_ns together."""
+    index = min((elapsed_ns // count).bit_length(), LATENCY_BUCKETS - 1)
+    metrics.latency_counts[index] += count
+    metrics.latency_sum += elapsed_ns / 1e9
+
+
+def render_prometheus(metrics: Metrics) -> str:
+    """Everything recorded so far, plus the tracker's bucket count, in the Prometheus text format."""
+    flush_denials(metrics)
+    lines = [
+        "# HELP ratelimiter_decisions_total Rate limit decisions by outcome.",
+        "# TYPE ratelimiter_decisions_total counter",
+        f'ratelimiter_decisions_total{{decision="allow"}} {metrics.allowed}',
+        f'ratelimiter_decisions_total{{decision="deny"}} {metrics.denied}',
+        "# HELP ratelimiter_decision_seconds Decision latency, sampled.",
+        "# TYPE ratelimiter_decision_seconds histogram",
+    ]
+    cumulative = 0
+    for i, count in enumerate(metrics.latency_counts[:-1]):
+        cumulative += count
+        lines.append(f'ratelimiter_decision_seconds_bucket{{le="{2 ** i / 1e9!r}"}} {cumulative}')
+    cumulative += metrics.latency_counts[-1]
+    lines += [
+        f'ratelimiter_decision_seconds_bucket{{le="+Inf"}} {cumulative}',
+        f"ratelimiter_decision_seconds_sum {metrics.latency_sum!r}",
+        f"ratelimiter_decision_seconds_count {cumulative}",
+        "# HELP ratelimiter_buckets Per-user buckets currently held.",
+        "# TYPE ratelimiter_buckets gauge",
+        f"ratelimiter_buckets {len(metrics.tracker.buckets)}",
+        "# HELP ratelimiter_denied_top Estimated denials of the most-denied users (Space-Saving sketch).",
+        "# TYPE ratelimiter_denied_top gauge",
+    ]
+    ranked = top(metrics.denied_users)
+    for user, count, _ in ranked:
+        lines.append(f'ratelimiter_denied_top{{user="{_escape(user)}"}} {count}')
+    lines += [
+        "# HELP ratelimiter_denied_top_error Most each ratelimiter_denied_top estimate can be over.",
+        "# TYPE ratelimiter_denied_top_error gauge",
+    ]
+    for user, _, error in ranked:
+        lines.append(f'ratelimiter_denied_top_error{{user="{_escape(user)}"}} {error}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics: Metrics, file_path: str) -> None:
+    """Write render_prometheus output to file_path atomically, e.g. for a node_exporter textfile collector."""
+    path = Path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(render_prometheus(metrics), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,38 +1,449 @@
 # Fulfills: REQ-RL-004 (independent per-user buckets)
 # Fulfills: REQ-RL-005 (configurable per-user rate limits)
 # Fulfills: REQ-RL-006 (first-request bucket creation at full capacity)
-"""Per-user bucket registry: lookup, create, and configure independent token buckets."""
+"""Per-user bucket registry: lookup, create, and configure independent token buckets.
+
+Users may also be nested under an org bucket and a global bucket; a check then
+refills and charges the whole chain in one pass, all or nothing. A tier may use
+another algorithm from algorithms.py instead of a token bucket; its users then
+hold that algorithm's state in place of a TokenBucket.
+"""
 
 from __future__ import annotations
 
+import heapq
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from itertools import count
 
-from token_bucket import BucketConfig, TokenBucket, create_bucket, try_consume
+from algorithms import ALGORITHMS, bucket_refund
+from token_bucket import BucketConfig, TokenBucket, _refill, check_cost, create_bucket, try_consume, try_consume_all
+from snapshot import Snapshot, restore_bucket
+from user_index import UserIndex, user_configs
 
 
 @dataclass
 class QuotaConfig:
     default: BucketConfig
-    users: dict[str, BucketConfig]
+    users: dict[str, BucketConfig] | UserIndex                       # values shared per tier, not per user
+    tiers: dict[str, BucketConfig] = field(default_factory=dict)     # named tiers users may refer to
+    global_limit: BucketConfig | None = None                         # ceiling shared by every user
+    orgs: dict[str, BucketConfig] = field(default_factory=dict)      # org name -> ceiling shared by its members
+    user_orgs: dict[str, str] = field(default_factory=dict)          # user -> org name
 
 
 @dataclass
 class QuotaTracker:
     config: QuotaConfig
     buckets: dict[str, TokenBucket] = field(default_factory=dict)
+    evict_idle: bool = False              # drop buckets that have refilled to capacity
+    max_entries: int | None = None        # hard cap; least recently used buckets dropped beyond it
+    sweep_budget: int = 2                 # idle heap entries examined per check when evict_idle is on
+    snapshot: Snapshot | None = None      # saved state paged in on each user's first request
+    generation: int = 0                   # bumped by reload_config; stale buckets rebind lazily
+    org_buckets: dict[str, TokenBucket] = field(default_factory=dict)
+    global_bucket: TokenBucket | None = None
+    idle_heap: list[tuple[float, int, str]] = field(default_factory=list)   # (when full, seq, user) with evict_idle
+    idle_entries: dict[str, int] = field(default_factory=dict)             # user -> seq of their live heap entry
+    idle_seq: count = field(default_factory=count)
+    created: list[str | None] | None = None   # users in creation order, for snapshots to walk; None = not kept
+    latest: float = float("-inf")         # latest request time seen with evict_idle; earlier ones are rejected
+
+
+def create_tracker(
+    config: QuotaConfig,
+    evict_idle: bool = False,
+    max_entries: int | None = None,
+    sweep_budget: int = 2,
+    snapshot: Snapshot | None = None,
+) -> QuotaTracker:
+    """Create a new tracker with the given config and an empty bucket registry.
+
+    With evict_idle or max_entries set, the registry is kept in least-recently-used
+    order for the max_entries cap, and with evict_idle each bucket is scheduled on
+    a heap by the time it will be full again, so eviction only has to look at the
+    heap's front. Eviction is exact only while request times never go backwards,
+    so with evict_idle a check earlier than one already seen raises ValueError.
+    With a snapshot, users' saved buckets are restored on their first request.
+    """
+    if evict_idle or max_entries is not None:
+        return QuotaTracker(
+            config=config, buckets=OrderedDict(), evict_idle=evict_idle,
+            max_entries=max_entries, sweep_budget=sweep_budget, snapshot=snapshot,
+        )
+    return QuotaTracker(config=config, snapshot=snapshot)
+
+
+def intern_tiers(config: QuotaConfig) -> tuple[list[BucketConfig], dict[str, int]]:
+    """Collapse identical configs into a tier table. Returns (tiers, user tier ids); tier 0 is the default."""
+    tiers = [config.default]
+    tier_ids = {(config.default.capacity, config.default.refill_rate, config.default.algorithm): 0}
+    user_tiers: dict[str, int] = {}
+    for user, user_config in config.users.items():
+        key = (user_config.capacity, user_config.refill_rate, user_config.algorithm)
+        if key not in tier_ids:
+            tier_ids[key] = len(tiers)
+            tiers.append(user_config)
+        user_tiers[user] = tier_ids[key]
+    return (tiers, user_tiers)
+
+
+def check_request(tracker: QuotaTracker, user: str, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Look up or create the user's bucket, then try to consume cost tokens, all or nothing.
+
+    Uses user-specific config if present, otherwise the default config. If the
+    user belongs to an org or a global limit is set, those buckets are charged
+    too, and retry_after is the longest wait among the levels that are short.
+    Raises ValueError if cost is not positive or exceeds a capacity on the way.
+    """
+    if tracker.evict_idle or tracker.max_entries is not None:
+        return _check_with_eviction(tracker, user, now, cost)
+    bucket = tracker.buckets.get(user)
+    if bucket is None:
+        bucket = _new_bucket(tracker, user, now)
+        tracker.buckets[user] = bucket
+    elif bucket.generation != tracker.generation:
+        bucket = _rebind(tracker, user, bucket, now)
+    if bucket.__class__ is not TokenBucket:
+        return ALGORITHMS[bucket.config.algorithm].consume(bucket, now, cost)
+    config = tracker.config
+    if config.orgs or config.global_limit is not None:
+        return try_consume_all(_bucket_chain(tracker, user, bucket, now), now, cost)
+    return try_consume(bucket, now, cost)
+
+
+def require_token_buckets(config: QuotaConfig, owner: str) -> None:
+    """Raise ValueError if config uses org or global limits or any algorithm other than token_bucket."""
+    if config.orgs or config.global_limit is not None:
+        raise ValueError(f"org and global limits are not supported by {owner}")
+    for bucket_config in (config.default, *config.tiers.values(), *user_configs(config.users)):
+        if bucket_config.algorithm != "token_bucket":
+            raise ValueError(f"algorithm {bucket_config.algorithm!r} is not supported by {owner}")
+
+
+def check_user_cost(config: QuotaConfig, user: str, cost: float) -> None:
+    """Raise ValueError unless cost fits every bucket the user's checks charge (user, org, global)."""
+    check_cost(cost, config.users.get(user, config.default))
+    org = config.user_orgs.get(user)
+    if org is not None:
+        check_cost(cost, config.orgs[org])
+    if config.global_limit is not None:
+        check_cost(cost, config.global_limit)
+
+
+def refund_request(tracker: QuotaTracker, user: str, granted_at: float, cost: float = 1.0) -> None:
+    """Give back cost that check_request took for user at granted_at, e.g. for a grant its caller never used.
+
+    The user's org and global buckets get it back too. If the user's bucket has
+    been evicted since, it had refilled, so there is nothing to give back.
+    """
+    bucket = tracker.buckets.get(user)
+    if bucket is None:
+        return
+    ALGORITHMS[bucket.config.algorithm].refund(bucket, granted_at, cost)
+    org = tracker.config.user_orgs.get(user)
+    if org is not None and org in tracker.org_buckets:
+        bucket_refund(tracker.org_buckets[org], granted_at, cost)
+    if tracker.global_bucket is not None and tracker.config.global_limit is not None:
+        bucket_refund(tracker.global_bucket, granted_at, cost)
+
+
+def reload_config(tracker: QuotaTracker, config: QuotaConfig) -> None:
+    """Atomically swap in a new config without touching any bucket.
+
+    Each existing bucket picks up its new capacity and refill_rate on its
+    user's next check, keeping its token level clamped to the new capacity.
+    Users of other algorithms whose limits or algorithm change start over.
+    """
+    tracker.config = config
+    tracker.generation += 1
+
+
+def _rebind(tracker: QuotaTracker, user: str, bucket, now: float):
+    """Move a stale bucket to the user's current config and return it.
+
+    A token bucket is refilled under its old config up to now first. Other
+    algorithms keep their state only if capacity and refill_rate are unchanged;
+    otherwise, as when the algorithm itself changed, the user gets a fresh
+    state, stored in the registry.
+    """
+    config = tracker.config.users.get(user, tracker.config.default)
+    old = bucket.config
+    if config.algorithm != old.algorithm or (
+        bucket.__class__ is not TokenBucket
+        and (config.capacity != old.capacity or config.refill_rate != old.refill_rate)
+    ):
+        bucket = ALGORITHMS[config.algorithm].create(config, now)
+        bucket.generation = tracker.generation
+        tracker.buckets[user] = bucket
+    elif bucket.__class__ is TokenBucket:
+        _rebind_to(tracker, bucket, config, now)
+    else:
+        bucket.config = config
+        bucket.generation = tracker.generation
+    return bucket
+
+
+def _rebind_to(tracker: QuotaTracker, bucket: TokenBucket, config: BucketConfig, now: float) -> None:
+    """Refill bucket under its old config up to now, then move it to config, clamping tokens."""
+    _refill(bucket, now)
+    bucket.config = config
+    bucket.tokens = min(bucket.tokens, config.capacity)
+    bucket.generation = tracker.generation
+
+
+def _parent_bucket(tracker: QuotaTracker, bucket: TokenBucket | None, config: BucketConfig, now: float) -> TokenBucket:
+    """Return an org or global bucket under the current config, creating it full if there is none yet."""
+    if bucket is None:
+        bucket = create_bucket(config, now)
+        bucket.generation = tracker.generation
+    elif bucket.generation != tracker.generation:
+        _rebind_to(tracker, bucket, config, now)
+    return bucket
 
 
-def create_tracker(config: QuotaConfig) -> QuotaTracker:
-    """Create a new tracker with the given config and an empty bucket registry."""
-    return QuotaTracker(config=config)
+def _bucket_chain(tracker: QuotaTracker, user: str, bucket: TokenBucket, now: float) -> list[TokenBucket]:
+    """The buckets one check of user charges: the user's, then the user's org (if any), then global (if set)."""
+    config = tracker.config
+    chain = [bucket]
+    org = config.user_orgs.get(user)
+    if org is not None:
+        org_bucket = tracker.org_buckets.get(org)
+        if org_bucket is None or org_bucket.generation != tracker.generation:
+            org_bucket = tracker.org_buckets[org] = _parent_bucket(tracker, org_bucket, config.orgs[org], now)
+        chain.append(org_bucket)
+    if config.global_limit is not None:
+        global_bucket = tracker.global_bucket
+        if global_bucket is None or global_bucket.generation != tracker.generation:
+            global_bucket = tracker.global_bucket = _parent_bucket(tracker, global_bucket, config.global_limit, now)
+        chain.append(global_bucket)
+    return chain
 
 
-def check_request(tracker: QuotaTracker, user: str, now: float) -> tuple[bool, float, float | None]:
-    """Look up or create the user's bucket, then try to consume a token.
+def _new_bucket(tracker: QuotaTracker, user: str, now: float):
+    """Restore the user's bucket from the snapshot if saved there, otherwise create a full one."""
+    if tracker.created is not None:
+        tracker.created.append(user)
+    config = tracker.config.users.get(user, tracker.config.default)
+    if config.algorithm != "token_bucket":
+        state = ALGORITHMS[config.algorithm].create(config, now)
+        state.generation = tracker.generation
+        return state
+    bucket = restore_bucket(tracker.snapshot, user, config) if tracker.snapshot is not None else None
+    if bucket is None:
+        bucket = create_bucket(config, now)
+    bucket.generation = tracker.generation
+    return bucket
 
-    Uses user-specific config if present, otherwise the default config.
+
+def _check_with_eviction(
+    tracker: QuotaTracker, user: str, now: float, cost: float
+) -> tuple[bool, float, float | None]:
+    """check_request for an LRU-ordered registry: touch the user's bucket, then evict a bounded amount."""
+    if tracker.evict_idle:
+        tracker.latest = _require_in_order(tracker.latest, (now,))
+    bucket = tracker.buckets.get(user)
+    created = bucket is None
+    if created:
+        bucket = _new_bucket(tracker, user, now)
+        tracker.buckets[user] = bucket
+    else:
+        tracker.buckets.move_to_end(user)
+        if bucket.generation != tracker.generation:
+            bucket = _rebind(tracker, user, bucket, now)
+    config = tracker.config
+    if bucket.__class__ is not TokenBucket:
+        result = ALGORITHMS[bucket.config.algorithm].consume(bucket, now, cost)
+    elif config.orgs or config.global_limit is not None:
+        result = try_consume_all(_bucket_chain(tracker, user, bucket, now), now, cost)
+    else:
+        result = try_consume(bucket, now, cost)
+    if created and tracker.evict_idle:
+        _schedule_idle(tracker, user, now)
+    _evict(tracker, now, tracker.sweep_budget)
+    return result
+
+
+def _is_full(tracker: QuotaTracker, user: str, bucket, now: float) -> bool:
+    """True if a refill at now would reach capacity (for other algorithms, if the state is idle).
+
+    Such a bucket behaves exactly like a fresh create_bucket at any later time,
+    so dropping it cannot change a decision as long as request times never go
+    backwards, which _require_in_order enforces.
+    A bucket left over from before reload_config is judged by what _rebind would
+    make of it: a full token bucket is rebound to min(old, new capacity) tokens,
+    so it only matches a fresh one if the capacity did not grow; other
+    algorithms start over unless their limits are unchanged.
     """
-    if user not in tracker.buckets:
+    if bucket.generation != tracker.generation:
         config = tracker.config.users.get(user, tracker.config.default)
-        tracker.buckets[user] = create_bucket(config, now)
-    return try_consume(tracker.buckets[user], now)
+        old = bucket.config
+        if config.algorithm != old.algorithm:
+            return True
+        if bucket.__class__ is not TokenBucket:
+            if config.capacity != old.capacity or config.refill_rate != old.refill_rate:
+                return True
+        elif config.capacity > old.capacity:
+            return False
+    if bucket.__class__ is not TokenBucket:
+        return ALGORITHMS[bucket.config.algorithm].is_idle(bucket, now)
+    return bucket.tokens + (now - bucket.last_refill) * bucket.config.refill_rate >= bucket.config.capacity
+
+
+def _require_in_order(latest: float, times) -> float:
+    """Return the latest of latest and times. Raises ValueError if a time is earlier than any before it.
+
+    A bucket dropped as full at some time comes back full at the next request,
+    which matches the dropped one only if that request is not earlier.
+    """
+    for now in times:
+        if now < latest:
+            raise ValueError(f"request time {now} is earlier than {latest}; evict_idle needs times in order")
+        if now > latest:
+            latest = now
+    return latest
+
+
+def _idle_at(tracker: QuotaTracker, bucket, now: float) -> float:
+    """When bucket will next be worth testing with _is_full: the time a token bucket refills to capacity.
+
+    Consuming only moves that time later, so a heap entry is never late for a
+    bucket checked since. For other algorithms and stale buckets, or if rounding
+    left a bucket just short at its computed time, the test is repeated after
+    capacity / refill_rate seconds, within which any state goes idle.
+    """
+    config = bucket.config
+    if bucket.__class__ is TokenBucket and bucket.generation == tracker.generation:
+        full_at = bucket.last_refill + (config.capacity - bucket.tokens) / config.refill_rate
+        if full_at > now:
+            return full_at
+    return now + config.capacity / config.refill_rate
+
+
+def _schedule_idle(tracker: QuotaTracker, user: str, now: float) -> None:
+    """Give user's bucket its one heap entry, replacing any older entry."""
+    seq = next(tracker.idle_seq)
+    tracker.idle_entries[user] = seq
+    heapq.heappush(tracker.idle_heap, (_idle_at(tracker, tracker.buckets[user], now), seq, user))
+
+
+def _evict(tracker: QuotaTracker, now: float, budget: int) -> None:
+    """Examine up to budget due idle heap entries, dropping buckets that are full, then enforce max_entries.
+
+    Each bucket has one entry, keyed on when it will be full again; an entry
+    that comes due for a bucket consumed from since is pushed back to its new
+    time. So each call does bounded work, and a slow-refilling bucket never
+    holds up one that is already full. The max_entries fallback drops the least recently used bucket even if it is not
+    full, which hands that user a fresh burst; it is a memory safety valve only.
+    A user evicted before a reload_config that raises their capacity returns as
+    a new user at the new capacity, where a kept bucket is clamped to the old one.
+    """
+    buckets = tracker.buckets
+    if tracker.evict_idle:
+        heap, entries = tracker.idle_heap, tracker.idle_entries
+        for _ in range(budget):
+            if not heap or heap[0][0] > now:
+                break
+            _, seq, user = heapq.heappop(heap)
+            if entries.get(user) != seq:
+                continue                    # the bucket was dropped, or rescheduled under a newer entry
+            if _is_full(tracker, user, buckets[user], now):
+                del buckets[user]
+                del entries[user]
+            else:
+                _schedule_idle(tracker, user, now)
+    if tracker.max_entries is not None:
+        while len(buckets) > tracker.max_entries:
+            user, _ = buckets.popitem(last=False)
+            tracker.idle_entries.pop(user, None)
+
+
+def check_requests(
+    tracker: QuotaTracker, users: list[str], times: list[float], costs: list[float] | None = None
+) -> tuple[list[bool], list[float], list[float | None]]:
+    """Decide a batch of requests with the same results as check_request on each, in order.
+
+    Requests are grouped by user; each bucket is loaded once, run through a tight
+    loop over its requests, and written back once. Returns parallel lists
+    (allowed, remaining, retry_after). costs defaults to 1.0 per request; every
+    cost, and with evict_idle the order of times, is validated before any bucket
+    changes, so a ValueError leaves the tracker untouched. With org or global buckets, users share state, and with
+    max_entries a user's bucket may be dropped between two of their requests,
+    so the batch is decided one request at a time instead.
+    """
+    count = len(users)
+    if len(times) != count or (costs is not None and len(costs) != count):
+        raise ValueError("users, times and costs must have the same length")
+
+    allowed = [False] * count
+    remaining = [0.0] * count
+    retry_after: list[float | None] = [None] * count
+
+    groups: dict[str, list[int]] = {}
+    for i, user in enumerate(users):
+        group = groups.get(user)
+        if group is None:
+            groups[user] = [i]
+        else:
+            group.append(i)
+
+    config = tracker.config
+    if costs is None:
+        costs = [1.0] * count
+    else:
+        for user, group in groups.items():
+            for i in group:
+                if costs[i] != 1.0:
+                    check_user_cost(config, user, costs[i])
+    if tracker.evict_idle:
+        tracker.latest = _require_in_order(tracker.latest, times)
+
+    if config.orgs or config.global_limit is not None or tracker.max_entries is not None:
+        for i in range(count):
+            allowed[i], remaining[i], retry_after[i] = check_request(tracker, users[i], times[i], costs[i])
+        return (allowed, remaining, retry_after)
+
+    scheduled: list[str] = []              # users created here, scheduled for idle eviction once decided
+    for user, group in groups.items():
+        bucket = tracker.buckets.get(user)
+        if bucket is None:
+            bucket = _new_bucket(tracker, user, times[group[0]])
+            tracker.buckets[user] = bucket
+            if tracker.evict_idle:
+                scheduled.append(user)
+        elif bucket.generation != tracker.generation:
+            bucket = _rebind(tracker, user, bucket, times[group[0]])
+
+        if bucket.__class__ is not TokenBucket:
+            consume = ALGORITHMS[bucket.config.algorithm].consume
+            for i in group:
+                allowed[i], remaining[i], retry_after[i] = consume(bucket, times[i], costs[i])
+            continue
+
+        capacity = bucket.config.capacity
+        refill_rate = bucket.config.refill_rate
+        tokens = bucket.tokens
+        last_refill = bucket.last_refill
+        for i in group:
+            now = times[i]
+            cost = costs[i]
+            elapsed = now - last_refill
+            if elapsed > 0:
+                tokens = min(capacity, tokens + elapsed * refill_rate)
+                last_refill = now
+            if tokens >= cost:
+                tokens -= cost
+                allowed[i] = True
+                remaining[i] = tokens
+            else:
+                remaining[i] = tokens
+                retry_after[i] = (cost - tokens) / refill_rate
+        bucket.tokens = tokens
+        bucket.last_refill = last_refill
+
+    if count and tracker.evict_idle:
+        for user in scheduled:
+            _schedule_idle(tracker, user, times[groups[user][-1]])
+        _evict(tracker, max(times), tracker.sweep_budget * count)
+
+    return (allowed, remaining, retry_after)
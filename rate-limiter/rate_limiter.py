@@ -6,19 +6,52 @@
 from __future__ import annotations
 
 import argparse
+import csv
 import json
+import math
+import multiprocessing
+import os
 import sys
 import time
+import zlib
+from collections import deque
+from collections.abc import Iterable, Iterator
+from itertools import chain, compress
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+from types import SimpleNamespace
+from typing import IO, Optional
 
 from token_bucket import BucketConfig
-from quota_tracker import QuotaConfig, create_tracker, check_request
-from config_loader import load_config, load_scenario, validate_request
+from quota_tracker import QuotaConfig, QuotaTracker, create_tracker, check_request, check_requests, check_user_cost
+from config_loader import load_config, load_config_file, load_scenario, iter_scenario, validate_request
+from metrics import (
+    Metrics, create_metrics, write_metrics, check_request as check_request_metered,
+    check_requests as check_requests_metered,
+)
+from request_trace import Trace, close_trace, is_trace, open_trace, write_trace
+from server import run_server
+from coarse_clock import create_coarse_clock
+from snapshot import open_snapshot
+from user_index import write_user_index
 
 
-def format_response(user: str, time_val: float, decision: str, remaining: float, retry_after: float | None) -> dict:
+DEFAULT_CONFIG = {"default": {"capacity": 5, "refill_rate": 1.0}, "users": {}}
+REPLAY_CHUNK = 4096                   # requests decided, and results written, per batch
+STREAM_CHUNK = 256                    # results per write with scenario --stream
+PARALLEL_CHUNK = 65536                # requests split across the workers at a time with scenario --workers
+
+# Optional, not `float | None`: an alias is evaluated at import, and Python 3.9 has no `|` on types.
+Row = tuple[str, float, float, bool, float, Optional[float]]   # user, time, cost, allowed, remaining, retry_after
+
+
+def format_response(
+    user: str, time_val: float, decision: str, remaining: float, retry_after: float | None, cost: float = 1.0
+) -> dict:
     """Build a JSON-serializable response dict.
 
-    Rounds remaining and retry_after to 2 decimal places.
+    Rounds remaining and retry_after to 2 decimal places. cost is included only
+    when it is not the default of 1.
     """
     response = {
         "user": user,
@@ -26,36 +59,449 @@ def format_response(user: str, time_val: float, decision: str, remaining: float,
         "decision": decision,
         "remaining": round(remaining, 2),
     }
+    if cost != 1.0:
+        response["cost"] = cost
     if retry_after is not None:
         response["retry_after"] = round(retry_after, 2)
     return response
 
 
-def run_check(user: str, time_val: float | None, config: dict) -> dict:
-    """Process a single check request. Returns the response dict."""
+def run_check(user: str, time_val: float | None, config: dict, cost: float = 1.0) -> dict:
+    """Process a single check request. Returns the response dict. Raises ValueError on an invalid cost."""
     quota_config = load_config(config)
     tracker = create_tracker(quota_config)
 
     now = time_val if time_val is not None else time.time()
-    allowed, remaining, retry_after = check_request(tracker, user, now)
+    allowed, remaining, retry_after = check_request(tracker, user, now, cost)
     decision = "ALLOW" if allowed else "DENY"
 
-    return format_response(user, now, decision, remaining, retry_after)
+    return format_response(user, now, decision, remaining, retry_after, cost)
+
+
+def process_requests(
+    tracker: QuotaTracker, requests: Iterable[dict], metrics: Metrics | None = None
+) -> Iterator[dict]:
+    """Validate and check each request in order, yielding its response dict as soon as it is decided.
+
+    With metrics (bound to tracker), every decision is recorded there.
+    """
+    for rows in decide_requests(tracker, requests, metrics, batch_size=1):
+        yield _row_response(rows[0])
+
+
+def decide_requests(
+    tracker: QuotaTracker, requests: Iterable[dict], metrics: Metrics | None = None, batch_size: int = REPLAY_CHUNK
+) -> Iterator[list[Row]]:
+    """Validate and check each request in order, yielding the decided rows batch_size at a time.
+
+    If a request is invalid, the rows decided before it are yielded before the ValueError propagates.
+    """
+    target, check = (tracker, check_request) if metrics is None else (metrics, check_request_metered)
+    rows: list[Row] = []
+    try:
+        for req in requests:
+            user, req_time, cost = validate_request(req)
+            rows.append((user, req_time, cost, *check(target, user, req_time, cost)))
+            if len(rows) == batch_size:
+                yield rows
+                rows = []
+    except ValueError:
+        if rows:
+            yield rows
+        raise
+    if rows:
+        yield rows
+
+
+def decide_trace(tracker: QuotaTracker, trace: Trace, metrics: Metrics | None = None) -> Iterator[list[Row]]:
+    """Decide every request of a trace in order, yielding rows REPLAY_CHUNK at a time.
+
+    The requests were validated when the trace was written, so they go straight
+    from the mapped columns to check_requests.
+    """
+    names = trace.users.__getitem__
+    for start in range(0, trace.count, REPLAY_CHUNK):
+        end = start + REPLAY_CHUNK
+        users = list(map(names, trace.user_ids[start:end]))
+        times = trace.times[start:end].tolist()
+        costs = trace.costs[start:end].tolist() if trace.costs is not None else [1.0] * len(users)
+        if metrics is None:
+            allowed, remaining, retry_after = check_requests(tracker, users, times, costs)
+        else:
+            allowed, remaining, retry_after = check_requests_metered(metrics, users, times, costs)
+        yield list(zip(users, times, costs, allowed, remaining, retry_after))
+
+
+def replay_trace(tracker: QuotaTracker, trace: Trace, metrics: Metrics | None = None) -> Iterator[dict]:
+    """Decide every request of a trace in order, yielding response dicts."""
+    for rows in decide_trace(tracker, trace, metrics):
+        yield from map(_row_response, rows)
+
+
+def scenario_decisions(
+    file_path: str, stream: bool = False, evict_idle: bool = False, metrics_path: str | None = None,
+    batch_size: int = REPLAY_CHUNK,
+) -> Iterator[list[Row]]:
+    """Open a scenario file or trace and decide its requests in order, yielding rows in batches.
+
+    A JSON scenario is loaded whole, or with stream read incrementally as JSON
+    or NDJSON and decided batch_size requests at a time. A trace is mapped
+    either way. The file is opened by this call, so a missing or malformed
+    file raises here rather than from iteration. With evict_idle, buckets that
+    refill to capacity are dropped, and a request time earlier than one before
+    it raises ValueError; with metrics_path, metrics are written there after
+    the last batch.
+    """
+    trace = None
+    if is_trace(file_path):
+        trace = open_trace(file_path)
+        config = trace.config
+    elif stream:
+        config, requests = iter_scenario(file_path)
+    else:
+        config, requests = load_scenario(file_path)
+    tracker = create_tracker(config, evict_idle=evict_idle)
+    metrics = create_metrics(tracker) if metrics_path is not None else None
+
+    def batches() -> Iterator[list[Row]]:
+        if trace is None:
+            yield from decide_requests(tracker, requests, metrics, batch_size)
+        else:
+            try:
+                yield from decide_trace(tracker, trace, metrics)
+            finally:
+                close_trace(trace)
+        if metrics is not None:
+            write_metrics(metrics, metrics_path)
+
+    return batches()
+
+
+def run_scenario(file_path: str, metrics_path: str | None = None) -> list[dict]:
+    """Load a scenario file or trace, process all requests in order, return list of response dicts.
+
+    With metrics_path, the run's metrics are written there as Prometheus text.
+    """
+    return [_row_response(row) for rows in scenario_decisions(file_path, metrics_path=metrics_path) for row in rows]
+
+
+def stream_scenario(file_path: str, evict_idle: bool = False, metrics_path: str | None = None) -> Iterator[dict]:
+    """Stream a JSON or NDJSON scenario file or a trace, yielding response dicts while the file is still being read.
+
+    With evict_idle, buckets that refill to capacity are dropped so memory stays
+    bounded by the number of recently active users rather than the log size.
+    With metrics_path, metrics are written there once the file is exhausted.
+    """
+    batches = scenario_decisions(file_path, True, evict_idle, metrics_path, batch_size=1)
+    return (_row_response(row) for rows in batches for row in rows)
+
+
+def _row_response(row: Row) -> dict:
+    user, time_val, cost, allowed, remaining, retry_after = row
+    return format_response(user, time_val, "ALLOW" if allowed else "DENY", remaining, retry_after, cost)
+
+
+def json_lines(rows: list[Row]) -> list[str]:
+    """Render each row as a JSON line, byte for byte what json.dumps(format_response(...)) prints for it.
+
+    Floats are written with repr, as json does; a batch holding an infinity or
+    NaN, which json spells differently, is rendered through json.dumps instead.
+    """
+    if not _finite(rows):
+        return [json.dumps(_row_response(row)) + "\n" for row in rows]
+    quote = encode_basestring_ascii
+    lines = []
+    append = lines.append
+    for user, time_val, cost, allowed, remaining, retry_after in rows:
+        if cost == 1.0:
+            if allowed:
+                append(
+                    f'{{"user": {quote(user)}, "time": {time_val!r}, "decision": "ALLOW", '
+                    f'"remaining": {round(remaining, 2)!r}}}\n'
+                )
+            else:
+                append(
+                    f'{{"user": {quote(user)}, "time": {time_val!r}, "decision": "DENY", '
+                    f'"remaining": {round(remaining, 2)!r}, "retry_after": {round(retry_after, 2)!r}}}\n'
+                )
+        elif allowed:
+            append(
+                f'{{"user": {quote(user)}, "time": {time_val!r}, "decision": "ALLOW", '
+                f'"remaining": {round(remaining, 2)!r}, "cost": {cost!r}}}\n'
+            )
+        else:
+            append(
+                f'{{"user": {quote(user)}, "time": {time_val!r}, "decision": "DENY", '
+                f'"remaining": {round(remaining, 2)!r}, "cost": {cost!r}, "retry_after": {round(retry_after, 2)!r}}}\n'
+            )
+    return lines
+
+
+def _finite(rows: list[Row]) -> bool:
+    """True if no time, cost, remaining or retry_after in rows is infinite or NaN (or their sum overflows)."""
+    total = sum(map(itemgetter(1), rows)) + sum(map(itemgetter(2), rows)) + sum(map(itemgetter(4), rows))
+    return math.isfinite(total + sum(filter(None, map(itemgetter(5), rows))))
+
+
+CSV_HEADER = "user,time,decision,remaining,retry_after,cost\n"
+
+
+def csv_lines(rows: list[Row]) -> list[str]:
+    """Render each row as a CSV line for CSV_HEADER, rounded like the JSON output; retry_after is empty when allowed."""
+    lines: list[str] = []
+    # The csv writer makes exactly one write call per row.
+    csv.writer(SimpleNamespace(write=lines.append), lineterminator="\n").writerows(
+        (
+            user, time_val, "ALLOW" if allowed else "DENY", round(remaining, 2),
+            None if retry_after is None else round(retry_after, 2), cost,
+        )
+        for user, time_val, cost, allowed, remaining, retry_after in rows
+    )
+    return lines
+
+
+OUTPUT_FORMATS = {"json": json_lines, "csv": csv_lines}
+
+
+def write_scenario(
+    file_path: str, out: IO[str], stream: bool = False, evict_idle: bool = False,
+    metrics_path: str | None = None, output_format: str = "json", workers: int = 1,
+) -> None:
+    """Decide a scenario file or trace and write its results to out in output_format ("json" or "csv").
+
+    Without stream, every request of a JSON scenario is decided before anything
+    is written, so an invalid request leaves out untouched; the results then go
+    out in one write. A trace was validated when it was written, so its results
+    are written REPLAY_CHUNK at a time as they are decided, and memory does not
+    grow with its length. With stream, each batch of STREAM_CHUNK results is
+    written as soon as it is decided, and out is flushed after the first. With
+    workers above 1, the replay is sharded across that many processes (see
+    write_sharded).
+    """
+    lines_of = OUTPUT_FORMATS[output_format]
+    header = CSV_HEADER if output_format == "csv" else ""
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if workers > 1:
+        if metrics_path is not None:
+            raise ValueError("metrics cannot be recorded across replay workers")
+        write_sharded(file_path, out, workers, stream, evict_idle, lines_of, header)
+        return
+    batches = scenario_decisions(file_path, stream, evict_idle, metrics_path, STREAM_CHUNK if stream else REPLAY_CHUNK)
+    if not stream and not is_trace(file_path):
+        out.write(header + "".join(chain.from_iterable(map(lines_of, batches))))
+        return
+    out.write(header)
+    for i, rows in enumerate(batches):
+        out.write("".join(lines_of(rows)))
+        if stream and i == 0:
+            out.flush()
+
+
+def shard_of(key: str, workers: int) -> int:
+    """The worker that owns key: crc32 of its UTF-8 bytes, so every run splits the same way."""
+    return zlib.crc32(key.encode("utf-8")) % workers
+
+
+def write_sharded(
+    file_path: str, out: IO[str], workers: int, stream: bool = False, evict_idle: bool = False,
+    lines_of=json_lines, header: str = "",
+) -> None:
+    """write_scenario across forked worker processes, each deciding its own users on its own tracker.
 
+    Buckets of different users never interact, so requests are split by a
+    stable hash of the user (of the org, for org members), PARALLEL_CHUNK at a
+    time. Each worker decides and renders its share in input order, and the
+    lines are merged back into input order, so the output is the same as a
+    serial replay. Workers read their share of a trace straight from the
+    mapping; other inputs are parsed and split here. The next chunk is sent
+    before the previous one is collected, so this process keeps reading while
+    the workers decide. Raises ValueError if the config has a global limit,
+    which ties every user together. A ValueError in a worker stops every
+    worker and is raised here, as serial replay would raise it.
+    """
+    trace = open_trace(file_path) if is_trace(file_path) else None
+    try:
+        if trace is not None:
+            config = trace.config
+            shard_by_id = [shard_of(config.user_orgs.get(user, user), workers) for user in trace.users]
+            chunks = _trace_chunks(trace, shard_by_id, workers)
+        else:
+            config, requests = iter_scenario(file_path) if stream else load_scenario(file_path)
+            shard_by_id = None
+            chunks = _request_chunks(config, requests, workers)
+            if not stream:
+                chunks = iter(list(chunks))   # validate every request before anything is written
+        if config.global_limit is not None:
+            raise ValueError("a global limit ties every user together, so it cannot be replayed by workers")
+
+        context = multiprocessing.get_context("fork")
+        inboxes = [context.Queue() for _ in range(workers)]
+        outboxes = [context.Queue() for _ in range(workers)]
+        processes = [
+            context.Process(
+                target=_shard_worker, args=(config, evict_idle, lines_of, trace, shard_by_id, k, inbox, outbox),
+                daemon=True,
+            )
+            for k, (inbox, outbox) in enumerate(zip(inboxes, outboxes))
+        ]
+        for process in processes:
+            process.start()
+
+        def collect(shards: list[int]) -> str:
+            results = [outbox.get() for outbox in outboxes]
+            for result in results:
+                if isinstance(result, ValueError):
+                    raise result
+                if isinstance(result, Exception):
+                    raise RuntimeError(f"replay worker failed: {result!r}")
+            parts = list(map(iter, results))
+            return "".join(map(next, map(parts.__getitem__, shards)))
+
+        out.write(header)
+        error = None
+        in_flight: deque[list[int]] = deque()
+        try:
+            while True:
+                try:
+                    shares, shards = next(chunks, (None, None))
+                except ValueError as e:
+                    error = e             # write what was decided before the invalid request, then raise
+                    break
+                if shares is None:
+                    break
+                for inbox, share in zip(inboxes, shares):
+                    inbox.put(share)
+                in_flight.append(shards)
+                if len(in_flight) > 1:
+                    out.write(collect(in_flight.popleft()))
+                    if stream:
+                        out.flush()
+            while in_flight:
+                out.write(collect(in_flight.popleft()))
+            for inbox in inboxes:
+                inbox.put(None)
+            for process in processes:
+                process.join()
+        finally:
+            if any(process.is_alive() for process in processes):      # a worker failed: stop the others
+                for inbox in inboxes:
+                    inbox.cancel_join_thread()
+                for process in processes:
+                    process.terminate()
+                    process.join()
+        if error is not None:
+            raise error
+    finally:
+        if trace is not None:
+            close_trace(trace)
+
+
+def _request_chunks(config: QuotaConfig, requests: Iterable[dict], workers: int) -> Iterator[tuple[list, list[int]]]:
+    """Validate requests PARALLEL_CHUNK at a time, yielding each worker's (users, times, costs) and the shard column.
+
+    If a request is invalid, the requests before it are yielded before the ValueError propagates.
+    """
+    shard_by_user: dict[str, int] = {}
+    users: list[str] = []
+    times: list[float] = []
+    costs: list[float] = []
+    shards: list[int] = []
+    try:
+        for req in requests:
+            user, req_time, cost = validate_request(req)
+            if cost != 1.0:
+                check_user_cost(config, user, cost)
+            shard = shard_by_user.get(user)
+            if shard is None:
+                shard = shard_by_user[user] = shard_of(config.user_orgs.get(user, user), workers)
+            users.append(user)
+            times.append(req_time)
+            costs.append(cost)
+            shards.append(shard)
+            if len(users) == PARALLEL_CHUNK:
+                yield _split(users, times, costs, shards, workers)
+                users, times, costs, shards = [], [], [], []
+    except ValueError:
+        if users:
+            yield _split(users, times, costs, shards, workers)
+        raise
+    if users:
+        yield _split(users, times, costs, shards, workers)
+
+
+def _split(
+    users: list[str], times: list[float], costs: list[float], shards: list[int], workers: int
+) -> tuple[list, list[int]]:
+    """Each worker's (users, times, costs) in input order, and the shard column."""
+    index: list[list[int]] = [[] for _ in range(workers)]
+    appends = [positions.append for positions in index]
+    for i, shard in enumerate(shards):
+        appends[shard](i)
+    shares = [
+        (list(map(users.__getitem__, positions)), list(map(times.__getitem__, positions)),
+         list(map(costs.__getitem__, positions)))
+        for positions in index
+    ]
+    return (shares, shards)
 
-def run_scenario(file_path: str) -> list[dict]:
-    """Load a scenario file, process all requests in order, return list of response dicts."""
-    config, requests = load_scenario(file_path)
-    tracker = create_tracker(config)
-    results = []
 
-    for req in requests:
-        user, req_time = validate_request(req)
-        allowed, remaining, retry_after = check_request(tracker, user, req_time)
-        decision = "ALLOW" if allowed else "DENY"
-        results.append(format_response(user, req_time, decision, remaining, retry_after))
+def _trace_chunks(trace: Trace, shard_by_id: list[int], workers: int) -> Iterator[tuple[list, list[int]]]:
+    """Each worker's (start, end) range and the shard column of a trace, PARALLEL_CHUNK requests at a time."""
+    for start in range(0, trace.count, PARALLEL_CHUNK):
+        end = min(start + PARALLEL_CHUNK, trace.count)
+        yield ([(start, end)] * workers, list(map(shard_by_id.__getitem__, trace.user_ids[start:end])))
 
-    return results
+
+def _shard_worker(
+    config: QuotaConfig, evict_idle: bool, lines_of, trace: Trace | None, shard_by_id: list[int] | None, shard: int,
+    inbox, outbox,
+) -> None:
+    """Decide each share from inbox on one tracker and put its rendered lines on outbox.
+
+    A share is (users, times, costs), or with a trace a (start, end) range from
+    which this worker picks its own users. None on inbox stops the worker; a
+    failure is put on outbox in place of the lines.
+    """
+    tracker = create_tracker(config, evict_idle=evict_idle)
+    try:
+        if trace is not None:
+            mine = [owner == shard for owner in shard_by_id]
+        for share in iter(inbox.get, None):
+            if trace is None:
+                users, times, costs = share
+            else:
+                start, end = share
+                selected = list(map(mine.__getitem__, trace.user_ids[start:end]))
+                users = list(map(trace.users.__getitem__, compress(trace.user_ids[start:end], selected)))
+                times = list(compress(trace.times[start:end], selected))
+                costs = [1.0] * len(users)
+                if trace.costs is not None:
+                    costs = list(compress(trace.costs[start:end], selected))
+            allowed, remaining, retry_after = check_requests(tracker, users, times, costs)
+            outbox.put(lines_of(list(zip(users, times, costs, allowed, remaining, retry_after))))
+    except Exception as e:
+        outbox.put(e)
+
+
+def convert_scenario(file_path: str, out_path: str) -> dict:
+    """Stream a JSON or NDJSON scenario file into a trace at out_path. Returns a summary dict.
+
+    Raises FileNotFoundError if the input is missing, ValueError if it or any request is malformed.
+    """
+    config, requests = iter_scenario(file_path)
+    count, user_count = write_trace(out_path, config, requests)
+    return {"requests": count, "users": user_count, "bytes": os.path.getsize(out_path)}
+
+
+def index_users(config_path: str, out_path: str) -> dict:
+    """Write the "users" section of a config or scenario file as a user index at out_path. Returns a summary dict.
+
+    Raises FileNotFoundError if the input is missing, ValueError if it is malformed.
+    """
+    config = load_config_file(config_path)
+    user_count, config_count = write_user_index(out_path, config.users)
+    return {"users": user_count, "configs": config_count, "bytes": os.path.getsize(out_path)}
 
 
 def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
@@ -66,9 +512,59 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     check_parser = subparsers.add_parser("check", help="Check a single request")
     check_parser.add_argument("--user", required=True, help="User identifier")
     check_parser.add_argument("--time", type=float, default=None, help="Timestamp in seconds")
+    check_parser.add_argument("--cost", type=float, default=1.0, help="Tokens to consume, all or nothing (default: 1)")
 
     scenario_parser = subparsers.add_parser("scenario", help="Run a scenario from a file")
-    scenario_parser.add_argument("--file", required=True, dest="file_path", help="Path to scenario JSON file")
+    scenario_parser.add_argument("--file", required=True, dest="file_path", help="Path to scenario JSON file or trace")
+    scenario_parser.add_argument(
+        "--stream", action="store_true",
+        help="Read the file incrementally (JSON or NDJSON) and print results as they are produced",
+    )
+    scenario_parser.add_argument(
+        "--evict-idle", action="store_true",
+        help="Drop buckets that have refilled to capacity, in any replay (batch, --stream, trace or --workers); "
+        "request times must then never go backwards",
+    )
+    scenario_parser.add_argument(
+        "--metrics", default=None, dest="metrics_path", help="Write decision metrics here as Prometheus text",
+    )
+    scenario_parser.add_argument(
+        "--format", choices=list(OUTPUT_FORMATS), default="json", dest="output_format",
+        help="Result format: JSON lines (default) or CSV with a header row",
+    )
+    scenario_parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Replay in this many processes, split by user; the output is the same as with 1 (default: 1)",
+    )
+
+    convert_parser = subparsers.add_parser("convert", help="Convert a JSON or NDJSON scenario into a binary trace")
+    convert_parser.add_argument("--file", required=True, dest="file_path", help="Scenario JSON or NDJSON file")
+    convert_parser.add_argument("--out", required=True, dest="out_path", help="Trace file to write")
+
+    index_parser = subparsers.add_parser(
+        "index", help="Write a config's per-user overrides as an index for the 'users_index' config key",
+    )
+    index_parser.add_argument("--config", required=True, dest="config_path", help="JSON config or scenario file")
+    index_parser.add_argument("--out", required=True, dest="out_path", help="Index file to write")
+
+    serve_parser = subparsers.add_parser("serve", help="Answer checks from one resident tracker")
+    serve_parser.add_argument("--socket", default=None, dest="socket_path", help="Unix socket path (default: stdin/stdout)")
+    serve_parser.add_argument("--config", default=None, dest="config_path", help="JSON config or scenario file")
+    serve_parser.add_argument(
+        "--snapshot", default=None, dest="snapshot_path",
+        help="Bucket snapshot file: restored lazily at startup, checkpointed periodically and on shutdown",
+    )
+    serve_parser.add_argument(
+        "--snapshot-interval", type=float, default=60.0, help="Seconds between checkpoints (default: 60)",
+    )
+    serve_parser.add_argument(
+        "--metrics-port", type=int, default=None,
+        help="Record decision metrics and serve them as Prometheus text over HTTP on this localhost port",
+    )
+    serve_parser.add_argument(
+        "--clock-resolution", type=float, default=None,
+        help="Read the clock once per batch, rounded down to this many seconds; refill is late by at most this",
+    )
 
     args = parser.parse_args(argv)
 
@@ -88,13 +584,55 @@ def main() -> None:
             print("Error: user ID must be a non-empty string", file=sys.stderr)
             sys.exit(1)
 
-        default_config = {"default": {"capacity": 5, "refill_rate": 1.0}, "users": {}}
-        result = run_check(args.user, args.time, default_config)
+        try:
+            result = run_check(args.user, args.time, DEFAULT_CONFIG, args.cost)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
         print(json.dumps(result))
 
     elif args.command == "scenario":
         try:
-            results = run_scenario(args.file_path)
+            write_scenario(
+                args.file_path, sys.stdout, args.stream, args.evict_idle, args.metrics_path, args.output_format,
+                args.workers,
+            )
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(2)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    elif args.command == "convert":
+        try:
+            summary = convert_scenario(args.file_path, args.out_path)
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(2)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(summary))
+
+    elif args.command == "index":
+        try:
+            summary = index_users(args.config_path, args.out_path)
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(2)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(summary))
+
+    elif args.command == "serve":
+        try:
+            config = load_config_file(args.config_path) if args.config_path else load_config(DEFAULT_CONFIG)
+            snapshot = None
+            if args.snapshot_path and os.path.exists(args.snapshot_path):
+                snapshot = open_snapshot(args.snapshot_path)
+            clock = create_coarse_clock(args.clock_resolution) if args.clock_resolution is not None else None
         except FileNotFoundError as e:
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(2)
@@ -102,8 +640,12 @@ def main() -> None:
             print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
 
-        for result in results:
-            print(json.dumps(result))
+        tracker = create_tracker(config, snapshot=snapshot)
+        metrics = create_metrics(tracker) if args.metrics_port is not None else None
+        run_server(
+            tracker, args.socket_path, args.config_path, args.snapshot_path, args.snapshot_interval,
+            metrics, args.metrics_port, clock,
+        )
 
 
 if __name__ == "__main__":
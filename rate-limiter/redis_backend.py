@@ -0,0 +1,182 @@
+# Fulfills: REQ-RL-003 (lazy refill, evaluated server-side)
+# Fulfills: REQ-RL-004 (independent per-user buckets shared by every node)
+"""Storage backend for a Redis-compatible server: one Lua script call per check.
+
+The script refills and consumes inside the server, so concurrent checks from
+any number of nodes are atomic with one round trip each. Numbers cross the
+wire as %.17g strings, which round-trip doubles exactly, so decisions match
+the in-process tracker. Connections come from a fixed-size pool; a batch is
+pipelined on one connection, PIPELINE_CHUNK commands per write.
+"""
+
+from __future__ import annotations
+
+import queue
+import socket
+from dataclasses import dataclass, field
+from hashlib import sha1
+
+from token_bucket import BucketConfig
+
+
+TOKEN_BUCKET_SCRIPT = """\
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last_refill')
+local tokens = tonumber(state[1])
+local last_refill = tonumber(state[2])
+if tokens == nil then
+  tokens = capacity
+  last_refill = now
+end
+local elapsed = now - last_refill
+if elapsed > 0 then
+  tokens = math.min(capacity, tokens + elapsed * refill_rate)
+  last_refill = now
+end
+tokens = math.min(capacity, tokens)
+local allowed = 0
+local retry_after = ''
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry_after = string.format('%.17g', (cost - tokens) / refill_rate)
+end
+tokens = math.min(capacity, tokens)
+redis.call('HSET', KEYS[1], 'tokens', string.format('%.17g', tokens), 'last_refill', string.format('%.17g', last_refill))
+return {allowed, string.format('%.17g', tokens), retry_after}
+"""
+SCRIPT_SHA = sha1(TOKEN_BUCKET_SCRIPT.encode()).hexdigest()
+PIPELINE_CHUNK = 512                  # commands per write, so replies never fill the socket buffers both ways
+
+
+def encode_command(*args: bytes | str) -> bytes:
+    """Encode one command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode("utf-8") if isinstance(arg, str) else arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+def read_reply(reader):
+    """Read one RESP reply from a buffered binary reader. Error replies are returned as RuntimeError instances."""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RuntimeError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        return None if length < 0 else [read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"malformed reply: {line!r}")
+
+
+@dataclass
+class _Connection:
+    sock: socket.socket
+    reader: object                     # buffered binary file over sock
+
+
+def _parse_result(reply) -> tuple[bool, float, float | None]:
+    """Turn the script's {allowed, remaining, retry_after} reply into the check_request tuple."""
+    if isinstance(reply, Exception):
+        raise reply
+    allowed, remaining, retry_after = reply
+    return (allowed == 1, float(remaining), float(retry_after) if retry_after else None)
+
+
+@dataclass
+class RespBackend:
+    host: str = "127.0.0.1"
+    port: int = 6379
+    pool_size: int = 8
+    key_prefix: str = "rl:"
+    timeout: float = 5.0
+    pool: queue.LifoQueue = field(init=False)    # idle connections; None marks a slot not yet connected
+
+    def __post_init__(self) -> None:
+        self.pool = queue.LifoQueue(maxsize=self.pool_size)
+        for _ in range(self.pool_size):
+            self.pool.put(None)
+
+    def consume(self, key: str, config: BucketConfig, now: float, cost: float) -> tuple[bool, float, float | None]:
+        return self.consume_many([(key, config, now, cost)])[0]
+
+    def consume_many(
+        self, requests: list[tuple[str, BucketConfig, float, float]]
+    ) -> list[tuple[bool, float, float | None]]:
+        commands = [
+            encode_command(
+                "EVALSHA", SCRIPT_SHA, "1", self.key_prefix + key,
+                repr(config.capacity), repr(config.refill_rate), repr(now), repr(cost),
+            )
+            for key, config, now, cost in requests
+        ]
+        replies = self._pipeline(commands)
+        missing = [i for i, r in enumerate(replies) if isinstance(r, RuntimeError) and str(r).startswith("NOSCRIPT")]
+        if missing:
+            # The script cache was flushed: only the commands answered NOSCRIPT did not run. Another client
+            # may have loaded the script again in between, so the commands after them may have run.
+            self._pipeline([encode_command("SCRIPT", "LOAD", TOKEN_BUCKET_SCRIPT)])
+            for i, reply in zip(missing, self._pipeline([commands[i] for i in missing])):
+                replies[i] = reply
+        return [_parse_result(reply) for reply in replies]
+
+    def execute(self, *args: bytes | str):
+        """Send one arbitrary command and return its reply (errors are raised)."""
+        reply = self._pipeline([encode_command(*args)])[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def close(self) -> None:
+        """Close the idle pooled connections; the backend reconnects on next use."""
+        slots = []
+        while True:
+            try:
+                slots.append(self.pool.get_nowait())
+            except queue.Empty:
+                break
+        for connection in slots:
+            if connection is not None:
+                connection.sock.close()
+            self.pool.put(None)
+
+    def _pipeline(self, commands: list[bytes]) -> list:
+        """Send commands on one pooled connection, PIPELINE_CHUNK at a time, and return one reply per command."""
+        connection = self.pool.get()
+        replies = []
+        try:
+            if connection is None:
+                connection = self._connect()
+            for start in range(0, len(commands), PIPELINE_CHUNK):
+                chunk = commands[start:start + PIPELINE_CHUNK]
+                connection.sock.sendall(b"".join(chunk))
+                replies.extend(read_reply(connection.reader) for _ in chunk)
+        except Exception:
+            if connection is not None:
+                connection.sock.close()
+            self.pool.put(None)
+            raise
+        self.pool.put(connection)
+        return replies
+
+    def _connect(self) -> _Connection:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return _Connection(sock=sock, reader=sock.makefile("rb"))
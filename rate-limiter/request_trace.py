@@ -0,0 +1,188 @@
+# Fulfills: REQ-RL-005 (config carried with the recorded requests)
+"""Binary request traces: a scenario stored as fixed-width columns for fast replay.
+
+A trace file is a header, then one column per field, then the user dictionary
+and the config:
+
+    header   magic, request count, user count, config bytes, flags
+    times    float64 per request
+    costs    float64 per request (only with FLAG_COSTS; otherwise every cost is 1)
+    users    uint32 per request, an index into the user dictionary
+    offsets  uint64 per user + 1, padded to 8 bytes; user i is blob[offsets[i]:offsets[i + 1]]
+    blob     the UTF-8 user IDs, back to back
+    config   the config section as JSON
+
+Everything is little-endian. open_trace maps the file and casts each column
+to a memoryview, so replay reads numbers straight from the page cache and
+never builds a request dict. Requests are validated when the trace is
+written, against the config they are written with.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from quota_tracker import QuotaConfig, check_user_cost
+from config_loader import dump_config, load_config, validate_request
+from bucket_table import column, write_column
+
+
+MAGIC = b"RLTRACE1"
+HEADER = struct.Struct("<8sQQQQ")     # magic, request count, user count, config bytes, flags
+FLAG_COSTS = 1                        # the trace has a costs column
+WRITE_CHUNK = 1 << 16                 # requests buffered per column write
+
+
+@dataclass
+class Trace:
+    config: QuotaConfig
+    users: list[str]                  # user dictionary: index -> user ID
+    times: memoryview                 # float64 per request
+    costs: memoryview | None          # float64 per request, or None when every cost is 1
+    user_ids: memoryview              # uint32 per request, into users
+    mapping: mmap.mmap | None
+
+    @property
+    def count(self) -> int:
+        return len(self.times)
+
+
+def is_trace(file_path: str) -> bool:
+    """True if file_path exists and starts with the trace magic."""
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_trace(file_path: str, config: QuotaConfig, requests: Iterable[dict]) -> tuple[int, int]:
+    """Write config and requests as a trace, streaming. Returns (request count, user count).
+
+    Each request is validated as in a scenario file, and its cost checked
+    against config. Raises ValueError on the first invalid request, leaving
+    no file behind.
+    """
+    path = Path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    index: dict[str, int] = {}
+    count = 0
+    weighted = False
+    try:
+        with tmp_path.open("wb") as out, tempfile.TemporaryFile() as costs_file, \
+                tempfile.TemporaryFile() as ids_file:
+            out.write(bytes(HEADER.size))
+            times, costs, ids = array("d"), array("d"), array("I")
+            for request in requests:
+                user, now, cost = validate_request(request)
+                if cost != 1.0:
+                    check_user_cost(config, user, cost)
+                    weighted = True
+                user_id = index.get(user)
+                if user_id is None:
+                    user_id = index[user] = len(index)
+                times.append(now)
+                costs.append(cost)
+                ids.append(user_id)
+                if len(times) == WRITE_CHUNK:
+                    count += _flush_columns(out, costs_file, ids_file, times, costs, ids)
+            count += _flush_columns(out, costs_file, ids_file, times, costs, ids)
+
+            if weighted:
+                _copy(costs_file, out)
+            _copy(ids_file, out)
+            blob = [user.encode("utf-8") for user in index]
+            offsets = array("Q", [0])
+            for data in blob:
+                offsets.append(offsets[-1] + len(data))
+            out.write(bytes(-out.tell() % 8))
+            write_column(out, offsets)
+            out.write(b"".join(blob))
+            config_bytes = json.dumps(dump_config(config)).encode("utf-8")
+            out.write(config_bytes)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, count, len(index), len(config_bytes), FLAG_COSTS if weighted else 0))
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return (count, len(index))
+
+
+def open_trace(file_path: str) -> Trace:
+    """Map a trace for replay. Raises FileNotFoundError if missing, ValueError if malformed."""
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"trace file not found: {file_path}")
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"not a request trace: {file_path}")
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, count, user_count, config_bytes, flags = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        mapping.close()
+        raise ValueError(f"not a request trace: {file_path}")
+    pos = HEADER.size
+    columns_end = pos + count * (16 if flags & FLAG_COSTS else 8) + count * 4
+    offsets_at = columns_end + -columns_end % 8
+    blob_at = offsets_at + (user_count + 1) * 8
+    if size < blob_at or size != blob_at + struct.unpack_from("<Q", mapping, blob_at - 8)[0] + config_bytes:
+        mapping.close()
+        raise ValueError(f"request trace is truncated: {file_path}")
+    try:
+        config = load_config(json.loads(mapping[size - config_bytes:]))
+    except ValueError:
+        mapping.close()
+        raise
+
+    times = column(mapping, pos, count, "d")
+    pos += count * 8
+    costs = None
+    if flags & FLAG_COSTS:
+        costs = column(mapping, pos, count, "d")
+        pos += count * 8
+    user_ids = column(mapping, pos, count, "I")
+    offsets = column(mapping, offsets_at, user_count + 1, "Q")
+    blob = mapping[blob_at:blob_at + offsets[-1]]
+    users = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(user_count)]
+    offsets.release()
+    return Trace(config=config, users=users, times=times, costs=costs, user_ids=user_ids, mapping=mapping)
+
+
+def close_trace(trace: Trace) -> None:
+    """Release the column views and unmap the file."""
+    for view in (trace.times, trace.costs, trace.user_ids):
+        if view is not None:
+            view.release()
+    if trace.mapping is not None:
+        trace.mapping.close()
+
+
+def _flush_columns(out, costs_file, ids_file, times: array, costs: array, ids: array) -> int:
+    """Write the buffered columns to their files, empty the buffers, and return how many requests were written."""
+    count = len(times)
+    write_column(out, times)
+    write_column(costs_file, costs)
+    write_column(ids_file, ids)
+    del times[:], costs[:], ids[:]
+    return count
+
+
+def _copy(source, out) -> None:
+    """Append the whole of a temporary file to out."""
+    source.seek(0)
+    while True:
+        chunk = source.read(1 << 20)
+        if not chunk:
+            return
+        out.write(chunk)
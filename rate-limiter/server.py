@@ -0,0 +1,278 @@
+# Fulfills: REQ-RL-001 (allow decisions for a long-running process)
+# Fulfills: REQ-RL-002 (deny decisions with retry_after for a long-running process)
+"""Long-running server: one resident QuotaTracker answering checks over a line protocol.
+
+Each request line is `<user> [<time> [<cost>]]`; a missing time means the current
+wall clock and a missing cost means 1 token. With a coarse clock, the wall
+clock is read once per batch and rounded down to the clock's resolution, and
+denials stamped with it report one resolution more retry_after (see
+coarse_clock.py).
+Each reply line is `ALLOW <remaining>`, `DENY <remaining> <retry_after>`, or
+`ERR <message>`, in request order, with values rounded to 2 decimal places.
+Every line read in one event-loop tick is decided with one check_requests call
+and answered with one write. With a snapshot path, the bucket table is
+checkpointed in bounded steps between ticks and written in full on shutdown.
+SIGHUP reloads the config file without losing bucket state. With metrics on,
+every decision is recorded and GET requests on the metrics port are answered
+with Prometheus text.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import stat
+import sys
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from functools import partial
+
+from quota_tracker import QuotaTracker, check_requests, check_user_cost, reload_config
+from config_loader import load_config_file
+from metrics import Metrics, render_prometheus, check_requests as check_requests_metered
+from snapshot import begin_snapshot, finish_snapshot, snapshot_step, write_snapshot
+from coarse_clock import CoarseClock, tick
+
+
+READ_SIZE = 1 << 16
+SNAPSHOT_BUDGET = 256                 # buckets written, then pages flushed, per event-loop tick while checkpointing
+
+
+def answer_lines(
+    tracker: QuotaTracker, lines: list[bytes], metrics: Metrics | None = None, clock: CoarseClock | None = None
+) -> bytes:
+    """Parse a batch of request lines, decide the valid ones together, and return all replies.
+
+    With metrics (bound to tracker), the decisions are recorded there. With a
+    clock, lines without a time are stamped with one tick for the whole batch.
+    """
+    replies: list[bytes | None] = []
+    users: list[str] = []
+    times: list[float] = []
+    costs: list[float] = []
+    ticked: list[bool] = []
+    config = tracker.config
+    batch_now = None
+    for line in lines:
+        parts = line.split()
+        if not parts or len(parts) > 3:
+            replies.append(b"ERR expected '<user> [<time> [<cost>]]'\n")
+            continue
+        try:
+            user = parts[0].decode("utf-8")
+            if len(parts) >= 2:
+                now = float(parts[1])
+            elif clock is None:
+                now = time.time()
+            else:
+                if batch_now is None:
+                    batch_now = tick(clock)
+                now = batch_now
+            cost = float(parts[2]) if len(parts) == 3 else 1.0
+        except ValueError:
+            replies.append(b"ERR malformed user, time or cost\n")
+            continue
+        try:
+            if cost != 1.0:
+                check_user_cost(config, user, cost)
+        except ValueError as e:
+            replies.append(f"ERR {e}\n".encode())
+            continue
+        users.append(user)
+        times.append(now)
+        costs.append(cost)
+        ticked.append(len(parts) == 1 and clock is not None)
+        replies.append(None)
+
+    if metrics is None:
+        allowed, remaining, retry_after = check_requests(tracker, users, times, costs)
+    else:
+        allowed, remaining, retry_after = check_requests_metered(metrics, users, times, costs)
+    decided = iter(range(len(users)))
+    out = []
+    for reply in replies:
+        if reply is None:
+            i = next(decided)
+            if allowed[i]:
+                reply = f"ALLOW {round(remaining[i], 2)}\n".encode()
+            else:
+                wait = retry_after[i] + clock.resolution if ticked[i] else retry_after[i]
+                reply = f"DENY {round(remaining[i], 2)} {round(wait, 2)}\n".encode()
+        out.append(reply)
+    return b"".join(out)
+
+
+async def _read_batches(read: Callable[[int], Awaitable[bytes]]) -> AsyncIterator[list[bytes]]:
+    """Yield the complete lines available after each read; a trailing partial line waits for more."""
+    pending = b""
+    while True:
+        data = await read(READ_SIZE)
+        if not data:
+            break
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        if lines:
+            yield lines
+    if pending.strip():
+        yield [pending]
+
+
+async def checkpoint_periodically(tracker: QuotaTracker, snapshot_path: str, interval: float) -> None:
+    """Every interval seconds, write a snapshot SNAPSHOT_BUDGET buckets at a time, yielding between steps.
+
+    The sync and rename at the end run in a thread, off the event loop. That
+    thread owns the writer, so cancelling the task waits for it to finish.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        writer = begin_snapshot(tracker.buckets, snapshot_path, tracker.snapshot, tracker.created)
+        try:
+            while not snapshot_step(writer, tracker.buckets, SNAPSHOT_BUDGET):
+                await asyncio.sleep(0)
+        except BaseException:
+            writer.mapping.close()
+            writer.file.close()
+            raise
+        finishing = asyncio.ensure_future(asyncio.to_thread(finish_snapshot, writer))
+        try:
+            await asyncio.shield(finishing)
+        except asyncio.CancelledError:
+            await asyncio.wait([finishing])
+            raise
+
+
+async def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1") -> None:
+    """Answer every HTTP request on host:port with the current metrics in Prometheus text, until cancelled."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        body = render_prometheus(metrics).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body)
+        )
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host=host, port=port)
+    async with server:
+        await server.serve_forever()
+
+
+def reload_from_file(tracker: QuotaTracker, config_path: str) -> None:
+    """Re-read config_path and swap it in; on error keep the current config and report to stderr."""
+    try:
+        reload_config(tracker, load_config_file(config_path))
+    except (OSError, ValueError) as e:
+        print(f"Error: config reload failed, keeping current config: {e}", file=sys.stderr)
+
+
+async def _serve(
+    tracker: QuotaTracker,
+    socket_path: str | None,
+    config_path: str | None,
+    snapshot_path: str | None,
+    interval: float,
+    metrics: Metrics | None,
+    metrics_port: int | None,
+    clock: CoarseClock | None,
+) -> None:
+    """Run the chosen transport, plus periodic checkpoints and the metrics endpoint.
+
+    SIGTERM shuts down like Ctrl-C, SIGHUP reloads config.
+    """
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    if config_path is not None:
+        loop.add_signal_handler(signal.SIGHUP, reload_from_file, tracker, config_path)
+    checkpoints = None
+    if snapshot_path is not None:
+        if tracker.created is None:
+            tracker.created = list(tracker.buckets)
+        checkpoints = asyncio.create_task(checkpoint_periodically(tracker, snapshot_path, interval))
+    exporter = None
+    if metrics is not None and metrics_port is not None:
+        exporter = asyncio.create_task(serve_metrics(metrics, metrics_port))
+    try:
+        if socket_path is None:
+            await serve_stdio(tracker, metrics, clock)
+        else:
+            await serve_unix(tracker, socket_path, metrics, clock)
+    finally:
+        if checkpoints is not None:
+            checkpoints.cancel()
+            await asyncio.wait([checkpoints])
+        if exporter is not None:
+            exporter.cancel()
+
+
+async def serve_stdio(tracker: QuotaTracker, metrics: Metrics | None = None, clock: CoarseClock | None = None) -> None:
+    """Answer request lines from stdin on stdout until end of input.
+
+    A pipe, socket or terminal is read on the event loop. The loop cannot watch
+    a regular file (serve < requests.txt), so one is read in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    if stat.S_ISREG(os.fstat(fd).st_mode):
+        read = partial(asyncio.to_thread, os.read, fd)
+    else:
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        read = reader.read
+    out = sys.stdout.buffer
+    async for lines in _read_batches(read):
+        out.write(answer_lines(tracker, lines, metrics, clock))
+        out.flush()
+
+
+async def serve_unix(
+    tracker: QuotaTracker, socket_path: str, metrics: Metrics | None = None, clock: CoarseClock | None = None
+) -> None:
+    """Answer request lines from any number of clients on a Unix socket until cancelled."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async for lines in _read_batches(reader.read):
+            writer.write(answer_lines(tracker, lines, metrics, clock))
+            await writer.drain()
+        writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+def run_server(
+    tracker: QuotaTracker,
+    socket_path: str | None = None,
+    config_path: str | None = None,
+    snapshot_path: str | None = None,
+    snapshot_interval: float = 60.0,
+    metrics: Metrics | None = None,
+    metrics_port: int | None = None,
+    clock: CoarseClock | None = None,
+) -> None:
+    """Serve on socket_path if given, otherwise on stdin/stdout. Returns on end of input, Ctrl-C or SIGTERM.
+
+    With config_path, SIGHUP reloads it. With snapshot_path, checkpoints every
+    snapshot_interval seconds and once more on the way out. With metrics, every
+    decision is recorded, and with metrics_port they are served over HTTP on localhost.
+    With a clock, checks without a time use its tick instead of reading the wall clock each.
+    """
+    try:
+        asyncio.run(_serve(
+            tracker, socket_path, config_path, snapshot_path, snapshot_interval, metrics, metrics_port, clock,
+        ))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if snapshot_path is not None:
+            write_snapshot(tracker.buckets, snapshot_path, tracker.snapshot)
@@ -0,0 +1,88 @@
+# Fulfills: REQ-RL-004 (independent per-user buckets, one quota across processes)
+# Fulfills: REQ-RL-006 (first-request bucket creation at full capacity)
+"""Multi-process bucket registry: a bucket_table in shared memory guarded by striped process locks.
+
+Create the tracker in the parent, then fork workers; every worker on the host
+enforces the same per-user quota without a network round trip.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+
+from token_bucket import BucketConfig, check_cost
+from quota_tracker import QuotaConfig, intern_tiers, require_token_buckets
+from bucket_table import SLOT, init_table, key_hash, slot_offset, table_bytes
+
+
+@dataclass
+class SharedTracker:
+    config: QuotaConfig
+    tiers: list[BucketConfig]
+    user_tiers: dict[str, int]
+    memory: SharedMemory
+    slot_count: int
+    locks: list                         # multiprocessing locks; slot i is guarded by locks[i % len(locks)]
+
+
+def create_shared_tracker(config: QuotaConfig, slot_count: int = 1 << 20, stripe_count: int = 64) -> SharedTracker:
+    """Allocate a zeroed shared bucket table with slot_count slots and stripe_count process locks.
+
+    Keep slot_count well above the expected number of users; probing slows as the table fills.
+    Raises ValueError for configs with org or global limits or other algorithms, which only quota_tracker enforces.
+    """
+    require_token_buckets(config, "the shared tracker")
+    tiers, user_tiers = intern_tiers(config)
+    memory = SharedMemory(create=True, size=table_bytes(slot_count))
+    init_table(memory.buf, slot_count)
+    return SharedTracker(
+        config=config, tiers=tiers, user_tiers=user_tiers, memory=memory, slot_count=slot_count,
+        locks=[multiprocessing.Lock() for _ in range(stripe_count)],
+    )
+
+
+def close_shared_tracker(tracker: SharedTracker, unlink: bool = False) -> None:
+    """Detach this process from the table; the creating process passes unlink=True once workers are done."""
+    tracker.memory.close()
+    if unlink:
+        tracker.memory.unlink()
+
+
+def check_request(tracker: SharedTracker, user: str, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Find or claim the user's slot, then refill and try to consume cost tokens under that slot's lock.
+
+    Same contract and arithmetic as quota_tracker.check_request. Raises RuntimeError if the table is full.
+    """
+    if cost != 1.0:
+        check_cost(cost, tracker.tiers[tracker.user_tiers.get(user, 0)])
+    buf = tracker.memory.buf
+    locks = tracker.locks
+    slot_count = tracker.slot_count
+    h = key_hash(user)
+    index = h % slot_count
+    for _ in range(slot_count):
+        offset = slot_offset(index)
+        with locks[index % len(locks)]:
+            key, tokens, last_refill, tier_id = SLOT.unpack_from(buf, offset)
+            if key == 0:
+                key = h
+                tier_id = tracker.user_tiers.get(user, 0)
+                tokens = tracker.tiers[tier_id].capacity
+                last_refill = now
+            if key == h:
+                config = tracker.tiers[tier_id]
+                elapsed = now - last_refill
+                if elapsed > 0:
+                    tokens = min(config.capacity, tokens + elapsed * config.refill_rate)
+                    last_refill = now
+                if tokens >= cost:
+                    tokens -= cost
+                    result = (True, tokens, None)
+                else:
+                    result = (False, tokens, (cost - tokens) / config.refill_rate)
+                SLOT.pack_into(buf, offset, h, tokens, last_refill, tier_id)
+                return result
+        index = (index + 1) % slot_count
+    raise RuntimeError("shared bucket table is full")
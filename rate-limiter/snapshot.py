@@ -0,0 +1,199 @@
+# Fulfills: REQ-RL-003 (lazy refill continues across restarts)
+# Fulfills: REQ-RL-006 (bucket creation restores saved state instead of a full burst)
+"""Persistent bucket snapshots: a bucket_table in a memory-mapped file, written in bounded steps.
+
+Opening a snapshot only maps the file, so startup does not depend on user
+count; a user's saved state is paged in on that user's first request. Writing
+fills a table in anonymous memory a fixed number of buckets per step, writes
+it to a temporary file a fixed number of pages per step, then syncs it and
+atomically renames it over the old snapshot (finish_snapshot, which blocks, so
+a server runs it off the event loop). No step copies or walks the whole
+registry: given the tracker's log of users in creation order
+(QuotaTracker.created), a writer walks the part that existed when it began,
+compacting it in place as it goes.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+
+from token_bucket import BucketConfig, TokenBucket
+from bucket_table import SLOT, find_slot, init_table, key_hash, read_header, slot_offset, table_bytes
+
+
+TAKEN = float("-inf")                 # last_refill of an entry already restored in this process
+
+
+@dataclass
+class Snapshot:
+    path: Path
+    mapping: mmap.mmap                 # private copy-on-write view; TAKEN marks never reach the file
+    slot_count: int
+    used: int
+
+
+@dataclass
+class SnapshotWriter:
+    path: Path
+    tmp_path: Path
+    file: BinaryIO                     # the temporary file, unbuffered
+    mapping: mmap.mmap                 # the table, in anonymous memory until written out
+    slot_count: int
+    users: list[str | None]            # creation log (or a key copy); users[:count] existed at begin_snapshot
+    count: int
+    previous: Snapshot | None
+    cursor: int = 0                    # next index into users, then into previous slots
+    kept: int = 0                      # users[:kept] are the distinct live users walked so far
+    written: int = -1                  # bytes of the table written to the file, once every entry is in
+    used: int = 0
+    seen: set[str] = field(default_factory=set)     # walked users of other algorithms, which have no entry
+
+
+def open_snapshot(file_path: str) -> Snapshot:
+    """Map a snapshot file for lazy restores. Raises FileNotFoundError if missing, ValueError if malformed."""
+    path = Path(file_path)
+    if not path.exists():
+        raise FileNotFoundError(f"snapshot file not found: {file_path}")
+
+    with path.open("rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    slot_count, used = read_header(mapping)
+    if len(mapping) != table_bytes(slot_count):
+        raise ValueError(f"snapshot file is truncated: {file_path}")
+    return Snapshot(path=path, mapping=mapping, slot_count=slot_count, used=used)
+
+
+def restore_bucket(snapshot: Snapshot, user: str, config: BucketConfig) -> TokenBucket | None:
+    """Return the user's saved bucket under the current config, or None if not saved.
+
+    Tokens are clamped to the current capacity. Each entry is restored at most
+    once, so a bucket re-created later (after idle eviction) starts fresh.
+    """
+    index, found = find_slot(snapshot.mapping, snapshot.slot_count, key_hash(user))
+    if not found:
+        return None
+    offset = slot_offset(index)
+    h, tokens, last_refill, tier_id = SLOT.unpack_from(snapshot.mapping, offset)
+    if last_refill == TAKEN:
+        return None
+    SLOT.pack_into(snapshot.mapping, offset, h, tokens, TAKEN, tier_id)
+    return TokenBucket(config=config, tokens=min(tokens, config.capacity), last_refill=last_refill)
+
+
+def begin_snapshot(
+    buckets: dict[str, TokenBucket],
+    file_path: str,
+    previous: Snapshot | None = None,
+    created: list[str | None] | None = None,
+) -> SnapshotWriter:
+    """Start writing a snapshot of buckets to file_path.
+
+    Entries of previous that were never restored in this process are carried
+    over, so users idle since the last restart keep their saved state. With
+    created, the tracker's creation log, the writer walks it in place instead
+    of copying the registry's keys; otherwise it copies them here.
+    """
+    path = Path(file_path)
+    users = created if created is not None else list(buckets)
+    carried = previous.used if previous is not None else 0
+    slot_count = max(16, 2 * (len(users) + carried))
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    mapping = mmap.mmap(-1, table_bytes(slot_count))
+    init_table(mapping, slot_count)
+    return SnapshotWriter(
+        path=path, tmp_path=tmp_path, file=tmp_path.open("wb", buffering=0), mapping=mapping,
+        slot_count=slot_count, users=users, count=len(users), previous=previous,
+    )
+
+
+def snapshot_step(writer: SnapshotWriter, buckets: dict[str, TokenBucket], budget: int = 1024) -> bool:
+    """Write up to budget more entries, or up to budget more pages of the table once they are all in.
+
+    Returns True once the table is in the file; finish_snapshot then puts it
+    in place. Users evicted since begin_snapshot are skipped, and dropped from
+    the creation log along with repeats; users created since then are picked
+    up by the next snapshot.
+    Only token buckets are saved; users of other algorithms start fresh after
+    a restart.
+    """
+    users = writer.users
+    end = writer.cursor + budget
+    while writer.cursor < end and writer.cursor < writer.count:
+        user = users[writer.cursor]
+        users[writer.cursor] = None
+        writer.cursor += 1
+        bucket = buckets.get(user) if user is not None else None
+        if bucket is None:
+            continue
+        if bucket.__class__ is TokenBucket:
+            fresh = _write_entry(writer, key_hash(user), bucket.tokens, bucket.last_refill)
+        else:
+            fresh = user not in writer.seen
+            writer.seen.add(user)
+        if fresh:
+            users[writer.kept] = user
+            writer.kept += 1
+
+    previous = writer.previous
+    if previous is not None:
+        while writer.cursor < end and writer.cursor - writer.count < previous.slot_count:
+            index = writer.cursor - writer.count
+            writer.cursor += 1
+            h, tokens, last_refill, _ = SLOT.unpack_from(previous.mapping, slot_offset(index))
+            if h != 0 and last_refill != TAKEN:
+                _write_entry(writer, h, tokens, last_refill)
+
+    total = writer.count + (previous.slot_count if previous is not None else 0)
+    if writer.cursor < total:
+        return False
+
+    mapping = writer.mapping
+    if writer.written < 0:
+        init_table(mapping, writer.slot_count, writer.used)
+        del users[writer.kept:writer.count]
+        writer.count = writer.kept
+        writer.seen.clear()
+        writer.written = 0
+    with memoryview(mapping) as view:
+        stop = min(len(mapping), writer.written + budget * mmap.PAGESIZE)
+        while writer.written < stop:
+            writer.written += writer.file.write(view[writer.written:stop])
+    return writer.written == len(mapping)
+
+
+def finish_snapshot(writer: SnapshotWriter) -> None:
+    """Sync the written table to disk and rename it over the old snapshot. Blocks on I/O with the GIL released.
+
+    Closes the writer's mapping and file whether or not it succeeds.
+    """
+    try:
+        writer.mapping.close()
+        os.fsync(writer.file.fileno())
+    finally:
+        writer.file.close()
+    os.replace(writer.tmp_path, writer.path)
+
+
+def _write_entry(writer: SnapshotWriter, h: int, tokens: float, last_refill: float) -> bool:
+    """Store one entry unless the key is already present (registry state wins over carried state).
+
+    Returns whether it was stored.
+    """
+    index, found = find_slot(writer.mapping, writer.slot_count, h)
+    if not found:
+        SLOT.pack_into(writer.mapping, slot_offset(index), h, tokens, last_refill, 0)
+        writer.used += 1
+    return not found
+
+
+def write_snapshot(buckets: dict[str, TokenBucket], file_path: str, previous: Snapshot | None = None) -> None:
+    """Write a complete snapshot in one call, e.g. on shutdown."""
+    writer = begin_snapshot(buckets, file_path, previous)
+    while not snapshot_step(writer, buckets, budget=1 << 16):
+        pass
+    finish_snapshot(writer)
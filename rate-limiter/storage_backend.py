@@ -0,0 +1,105 @@
+# Fulfills: REQ-RL-004 (independent per-user buckets, stored wherever the backend keeps them)
+# Fulfills: REQ-RL-005 (configurable per-user rate limits)
+"""Pluggable bucket storage: every check is one atomic refill-and-consume call on a backend.
+
+The tracker resolves each user's limits from its config and hands them to the
+backend with the request, so a backend stores only (tokens, last_refill) per
+key. MemoryBackend keeps them in this process; redis_backend.RespBackend runs
+the same step as a server-side script, so many nodes can share one quota.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from token_bucket import BucketConfig, TokenBucket, _refill, create_bucket, try_consume
+from quota_tracker import QuotaConfig, check_user_cost, require_token_buckets
+
+
+class StorageBackend(Protocol):
+    def consume(self, key: str, config: BucketConfig, now: float, cost: float) -> tuple[bool, float, float | None]:
+        """Atomically create-if-missing, refill and try to consume cost from key's bucket.
+
+        A negative cost hands -cost tokens back, capped at capacity, and is always allowed.
+        """
+        ...
+
+    def consume_many(
+        self, requests: list[tuple[str, BucketConfig, float, float]]
+    ) -> list[tuple[bool, float, float | None]]:
+        """consume for each (key, config, now, cost) in order, in as few round trips as the backend allows."""
+        ...
+
+
+@dataclass
+class MemoryBackend:
+    buckets: dict[str, TokenBucket] = field(default_factory=dict)
+
+    def consume(self, key: str, config: BucketConfig, now: float, cost: float) -> tuple[bool, float, float | None]:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = create_bucket(config, now)
+        elif bucket.config is not config:
+            bucket.config = config
+            bucket.tokens = min(bucket.tokens, config.capacity)
+        if cost < 0:
+            _refill(bucket, now)
+            bucket.tokens = min(config.capacity, bucket.tokens - cost)
+            return (True, bucket.tokens, None)
+        return try_consume(bucket, now, cost)
+
+    def consume_many(
+        self, requests: list[tuple[str, BucketConfig, float, float]]
+    ) -> list[tuple[bool, float, float | None]]:
+        return [self.consume(key, config, now, cost) for key, config, now, cost in requests]
+
+
+@dataclass
+class BackendTracker:
+    config: QuotaConfig
+    backend: StorageBackend
+
+
+def create_backend_tracker(config: QuotaConfig, backend: StorageBackend) -> BackendTracker:
+    """Create a tracker whose buckets live in backend.
+
+    Raises ValueError for org or global limits or algorithms other than token_bucket.
+    """
+    require_token_buckets(config, "storage backends")
+    return BackendTracker(config=config, backend=backend)
+
+
+def check_request(
+    tracker: BackendTracker, user: str, now: float, cost: float = 1.0
+) -> tuple[bool, float, float | None]:
+    """One atomic backend call per check. Same contract and arithmetic as quota_tracker.check_request."""
+    config = tracker.config.users.get(user, tracker.config.default)
+    if cost != 1.0:
+        check_user_cost(tracker.config, user, cost)
+    return tracker.backend.consume(user, config, now, cost)
+
+
+def check_requests(
+    tracker: BackendTracker, users: list[str], times: list[float], costs: list[float] | None = None
+) -> tuple[list[bool], list[float], list[float | None]]:
+    """Decide a batch with one consume_many call; same results as check_request on each, in order.
+
+    Every cost is validated before anything is sent. Returns parallel lists (allowed, remaining, retry_after).
+    """
+    count = len(users)
+    if len(times) != count or (costs is not None and len(costs) != count):
+        raise ValueError("users, times and costs must have the same length")
+    config = tracker.config
+    if costs is None:
+        costs = [1.0] * count
+    else:
+        for user, cost in zip(users, costs):
+            if cost != 1.0:
+                check_user_cost(config, user, cost)
+
+    requests = [
+        (user, config.users.get(user, config.default), now, cost) for user, now, cost in zip(users, times, costs)
+    ]
+    results = tracker.backend.consume_many(requests)
+    return ([r[0] for r in results], [r[1] for r in results], [r[2] for r in results])
@@ -2,7 +2,7 @@
 # Fulfills: REQ-RL-002 (deny decision with retry_after calculation)
 # Fulfills: REQ-RL-003 (lazy token refill capped at capacity)
 # Fulfills: REQ-RL-006 (first-request bucket creation at full capacity)
-"""Token bucket algorithm for a single bucket: lazy refill, consume, and deny."""
+"""Token bucket algorithm: lazy refill, consume, and deny, for one bucket or a chain of nested buckets."""
 
 from __future__ import annotations
 
@@ -13,6 +13,7 @@ from dataclasses import dataclass
 class BucketConfig:
     capacity: float
     refill_rate: float
+    algorithm: str = "token_bucket"   # key in algorithms.ALGORITHMS; quota_tracker dispatches on it
 
 
 @dataclass
@@ -20,6 +21,7 @@ class TokenBucket:
     config: BucketConfig
     tokens: float
     last_refill: float
+    generation: int = 0               # registry config generation the bucket's config came from
 
 
 def create_bucket(config: BucketConfig, now: float) -> TokenBucket:
@@ -35,16 +37,61 @@ def _refill(bucket: TokenBucket, now: float) -> None:
         bucket.last_refill = now
 
 
-def try_consume(bucket: TokenBucket, now: float) -> tuple[bool, float, float | None]:
-    """Refill tokens, then attempt to consume one token.
+def check_cost(cost: float, config: BucketConfig) -> None:
+    """Raise ValueError unless 0 < cost <= capacity; a larger cost could never be allowed."""
+    if not cost > 0:
+        raise ValueError("cost must be a positive number")
+    if cost > config.capacity:
+        raise ValueError(f"cost {cost} exceeds bucket capacity {config.capacity}")
+
+
+def try_consume(bucket: TokenBucket, now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Refill tokens, then attempt to consume cost tokens, all or nothing.
 
     Returns (allowed, remaining, retry_after).
-    retry_after is None when allowed.
+    retry_after is None when allowed, otherwise the wait until cost tokens are available.
+    Raises ValueError if cost is not positive or exceeds capacity.
     """
+    if cost != 1.0:
+        check_cost(cost, bucket.config)
     _refill(bucket, now)
-    if bucket.tokens >= 1.0:
-        bucket.tokens -= 1.0
+    if bucket.tokens >= cost:
+        bucket.tokens -= cost
         return (True, bucket.tokens, None)
     else:
-        retry_after = (1.0 - bucket.tokens) / bucket.config.refill_rate
+        retry_after = (cost - bucket.tokens) / bucket.config.refill_rate
         return (False, bucket.tokens, retry_after)
+
+
+def try_consume_all(buckets: list[TokenBucket], now: float, cost: float = 1.0) -> tuple[bool, float, float | None]:
+    """Refill every bucket to now, then consume cost from all of them or from none.
+
+    For nested quotas (user, org, global). remaining is the lowest token count
+    across the buckets; on denial, retry_after is the longest wait among the
+    buckets short of cost. With a single bucket this is exactly try_consume.
+    Raises ValueError if cost is not positive or exceeds any bucket's capacity.
+    """
+    if cost != 1.0:
+        for bucket in buckets:
+            check_cost(cost, bucket.config)
+
+    lowest = float("inf")
+    retry_after = None
+    for bucket in buckets:
+        config = bucket.config
+        elapsed = now - bucket.last_refill
+        if elapsed > 0:
+            bucket.tokens = min(config.capacity, bucket.tokens + elapsed * config.refill_rate)
+            bucket.last_refill = now
+        tokens = bucket.tokens
+        if tokens < lowest:
+            lowest = tokens
+        if tokens < cost:
+            wait = (cost - tokens) / config.refill_rate
+            if retry_after is None or wait > retry_after:
+                retry_after = wait
+    if retry_after is not None:
+        return (False, lowest, retry_after)
+    for bucket in buckets:
+        bucket.tokens -= cost
+    return (True, lowest - cost, None)
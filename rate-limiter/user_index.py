@@ -0,0 +1,191 @@
+# Fulfills: REQ-RL-005 (configurable per-user rate limits, looked up on each user's first request)
+"""On-disk index of per-user overrides: a sorted key table in a memory-mapped file.
+
+An index file is a header, then the columns and the distinct configs:
+
+    header   magic, user count, config count, configs bytes
+    configs  uint32 per user, an index into the config table (in key order)
+    offsets  uint64 per user + 1, padded to 8 bytes; key i is blob[offsets[i]:offsets[i + 1]]
+    blob     the UTF-8 user IDs, sorted, back to back
+    table    the distinct configs as a JSON list
+
+Everything is little-endian. Opening an index maps the file and parses only
+the config table, so startup time and memory do not depend on user count. A
+UserIndex is a read-only mapping from user ID to BucketConfig: a lookup
+binary-searches the keys in place and remembers the answer, found or not, in
+a bounded least-recently-used cache. It can stand in for QuotaConfig.users.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from algorithms import ALGORITHMS
+from bucket_table import column, write_column
+from token_bucket import BucketConfig
+
+
+MAGIC = b"RLUSERS1"
+HEADER = struct.Struct("<8sQQQ")      # magic, user count, config count, configs bytes
+CACHE_SIZE = 1 << 16                  # users whose lookups are remembered
+MISSING = -1                          # cached config id of a user without an override
+
+
+@dataclass(eq=False)
+class UserIndex(Mapping):
+    path: Path
+    configs: list[BucketConfig]       # distinct configs; users hold an index into this list
+    mapping: mmap.mmap
+    config_ids: memoryview            # uint32 per user, in key order
+    offsets: memoryview               # uint64 per user + 1, into the blob
+    blob_at: int
+    cache_size: int = CACHE_SIZE
+    cache: OrderedDict[str, int] = field(default_factory=OrderedDict)     # user -> config id or MISSING
+
+    def __getitem__(self, user: str) -> BucketConfig:
+        config = self.get(user)
+        if config is None:
+            raise KeyError(user)
+        return config
+
+    def get(self, user: str, default: BucketConfig | None = None) -> BucketConfig | None:
+        config_id = self.cache.get(user)
+        if config_id is None:
+            config_id = _search(self, user)
+            self.cache[user] = config_id
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(user)
+        return default if config_id == MISSING else self.configs[config_id]
+
+    def __contains__(self, user: object) -> bool:
+        return isinstance(user, str) and self.get(user) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        offsets, mapping, blob_at = self.offsets, self.mapping, self.blob_at
+        for i in range(len(self.config_ids)):
+            yield mapping[blob_at + offsets[i]:blob_at + offsets[i + 1]].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.config_ids)
+
+
+def write_user_index(file_path: str, users: Mapping[str, BucketConfig]) -> tuple[int, int]:
+    """Write users as an index file. Returns (user count, distinct config count).
+
+    Configs that are equal are stored once. Leaves no file behind on failure.
+    """
+    path = Path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    config_ids: dict[tuple, int] = {}
+    configs: list[dict] = []
+    ids = array("I")
+    offsets = array("Q", [0])
+    keys = []
+    for user in sorted(users):
+        config = users[user]
+        key = (config.capacity, config.refill_rate, config.algorithm)
+        config_id = config_ids.get(key)
+        if config_id is None:
+            config_id = config_ids[key] = len(configs)
+            configs.append(
+                {"capacity": config.capacity, "refill_rate": config.refill_rate, "algorithm": config.algorithm}
+            )
+        ids.append(config_id)
+        data = user.encode("utf-8")
+        offsets.append(offsets[-1] + len(data))
+        keys.append(data)
+
+    table = json.dumps(configs).encode("utf-8")
+    try:
+        with tmp_path.open("wb") as out:
+            out.write(HEADER.pack(MAGIC, len(ids), len(configs), len(table)))
+            write_column(out, ids)
+            out.write(bytes(-out.tell() % 8))
+            write_column(out, offsets)
+            out.write(b"".join(keys))
+            out.write(table)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return (len(ids), len(configs))
+
+
+def open_user_index(file_path: str | Path, cache_size: int = CACHE_SIZE) -> UserIndex:
+    """Map an index file for lazy lookups. Raises FileNotFoundError if missing, ValueError if malformed."""
+    path = Path(file_path).resolve()
+    if not path.exists():
+        raise FileNotFoundError(f"user index file not found: {file_path}")
+    if cache_size < 1:
+        raise ValueError("user index cache_size must be at least 1")
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"not a user index: {file_path}")
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, count, config_count, table_bytes = HEADER.unpack_from(mapping, 0)
+    offsets_at = HEADER.size + count * 4
+    offsets_at += -offsets_at % 8
+    blob_at = offsets_at + (count + 1) * 8
+    if magic != MAGIC:
+        mapping.close()
+        raise ValueError(f"not a user index: {file_path}")
+    if size < blob_at or size != blob_at + struct.unpack_from("<Q", mapping, blob_at - 8)[0] + table_bytes:
+        mapping.close()
+        raise ValueError(f"user index is truncated: {file_path}")
+    try:
+        configs = [_parse_config(data) for data in json.loads(mapping[size - table_bytes:])]
+        if len(configs) != config_count:
+            raise ValueError(f"user index config table is malformed: {file_path}")
+    except ValueError:
+        mapping.close()
+        raise
+
+    return UserIndex(
+        path=path, configs=configs, mapping=mapping, config_ids=column(mapping, HEADER.size, count, "I"),
+        offsets=column(mapping, offsets_at, count + 1, "Q"), blob_at=blob_at, cache_size=cache_size,
+    )
+
+
+def user_configs(users: Mapping[str, BucketConfig]) -> Iterable[BucketConfig]:
+    """The configs users hold, without reading every key of an index (an index yields each config once)."""
+    return users.configs if isinstance(users, UserIndex) else users.values()
+
+
+def _search(index: UserIndex, user: str) -> int:
+    """Binary-search the sorted keys for user. Returns its config id, or MISSING."""
+    key = user.encode("utf-8")
+    offsets, mapping, blob_at = index.offsets, index.mapping, index.blob_at
+    low, high = 0, len(index.config_ids)
+    while low < high:
+        mid = (low + high) // 2
+        found = mapping[blob_at + offsets[mid]:blob_at + offsets[mid + 1]]
+        if found < key:
+            low = mid + 1
+        elif found > key:
+            high = mid
+        else:
+            return index.config_ids[mid]
+    return MISSING
+
+
+def _parse_config(data) -> BucketConfig:
+    """Rebuild one entry of the config table. Raises ValueError if it is not a valid config."""
+    if not isinstance(data, dict) or data.get("algorithm") not in ALGORITHMS:
+        raise ValueError(f"user index holds an invalid config: {data!r}")
+    try:
+        capacity, refill_rate = float(data["capacity"]), float(data["refill_rate"])
+        return BucketConfig(capacity=capacity, refill_rate=refill_rate, algorithm=data["algorithm"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"user index holds an invalid config: {data!r}") from e
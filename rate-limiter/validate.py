@@ -1,13 +1,48 @@
 # Fulfills: Behavioral Scenarios 1-5 from specification
-"""Automated validation: run all 5 spec scenarios, compare output to expected values."""
+"""Automated validation: run all 5 spec scenarios and property checks, compare output to expected values."""
 
 from __future__ import annotations
 
+import asyncio
+import copy
+import csv
+import io
 import json
+import multiprocessing
+import os
+import random
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 from pathlib import Path
 
+from token_bucket import BucketConfig
+from algorithms import ALGORITHMS
+from quota_tracker import QuotaConfig, create_tracker, check_request, check_requests, reload_config
+from async_limiter import acquire, create_async_limiter, pending
+from columnar_tracker import create_columnar_tracker, check_request as check_request_columnar
+from concurrent_tracker import create_concurrent_tracker, check_request as check_request_concurrent
+from shared_tracker import create_shared_tracker, close_shared_tracker, check_request as check_request_shared
+from storage_backend import MemoryBackend, create_backend_tracker
+from storage_backend import check_request as check_request_backend, check_requests as check_requests_backend
+from redis_backend import RespBackend
+from metrics import create_metrics, flush_denials, render_prometheus
+from metrics import check_request as check_request_metered, check_requests as check_requests_metered
+from lease_cache import create_lease_tracker, check_request as check_request_leased
+from deny_cache import create_deny_cache, check_request as check_request_deny_cached
+from fake_redis import schedule_script_flush, start_fake_redis, stop_fake_redis
+from snapshot import begin_snapshot, finish_snapshot, open_snapshot, restore_bucket, snapshot_step
+from config_loader import READ_CHUNK, dump_config, iter_scenario, load_config, load_config_file
+from request_trace import HEADER as TRACE_HEADER, open_trace, close_trace
+import server
+from server import answer_lines
+from coarse_clock import create_coarse_clock, tick
+from rate_limiter import convert_scenario, index_users, run_scenario, stream_scenario, write_scenario
+
 
 SCENARIOS = [
     {
@@ -76,6 +111,7 @@ SCENARIOS = [
 ]
 
 TOLERANCE = 0.01
+GCRA_TOLERANCE = 1e-9                 # tokens or seconds by which GCRA may differ from a token bucket
 
 
 def run_scenario_file(file_path: str) -> list[dict]:
@@ -122,8 +158,1165 @@ def compare_results(actual: list[dict], expected: list[dict], scenario_name: str
     return passed
 
 
+def random_workload(
+    seed: int, count: int, user_count: int, disorder: float = 0.05
+) -> tuple[QuotaConfig, list[str], list[float]]:
+    """Build a seeded mixed-tier workload with repeated users and a share of out-of-order times."""
+    rng = random.Random(seed)
+    config = QuotaConfig(
+        default=BucketConfig(capacity=3, refill_rate=0.7),
+        users={"user-0": BucketConfig(capacity=10, refill_rate=2.5)},
+    )
+    users = [f"user-{rng.randrange(user_count)}" for _ in range(count)]
+    times = []
+    now = 0.0
+    for _ in range(count):
+        now += rng.random() * 0.3
+        times.append(now - rng.random() if rng.random() < disorder else now)
+    return (config, users, times)
+
+
+def check_batch_matches_sequential() -> bool:
+    """check_requests must return exactly what check_request returns one request at a time."""
+    config, users, times = random_workload(seed=2, count=5000, user_count=20)
+    sequential = create_tracker(config)
+    expected = [check_request(sequential, user, now) for user, now in zip(users, times)]
+
+    batched = create_tracker(config)
+    actual = []
+    for start in range(0, len(users), 700):
+        allowed, remaining, retry_after = check_requests(batched, users[start:start + 700], times[start:start + 700])
+        actual.extend(zip(allowed, remaining, retry_after))
+
+    for i, (act, exp) in enumerate(zip(actual, expected)):
+        if act != exp:
+            print(f"  Request {i + 1}: batch gave {act}, sequential gave {exp}")
+            return False
+    return True
+
+
+def check_eviction_preserves_decisions() -> bool:
+    """Idle eviction must never change a decision, and must actually shrink the registry."""
+    config, users, times = random_workload(seed=3, count=20000, user_count=2000, disorder=0.0)
+    plain = create_tracker(config)
+    evicting = create_tracker(config, evict_idle=True)
+
+    for i, (user, now) in enumerate(zip(users, times)):
+        act = check_request(evicting, user, now)
+        exp = check_request(plain, user, now)
+        if act != exp:
+            print(f"  Request {i + 1}: evicting tracker gave {act}, plain tracker gave {exp}")
+            return False
+
+    if len(evicting.buckets) >= len(plain.buckets):
+        print(f"  registry not reduced: {len(evicting.buckets)} buckets vs {len(plain.buckets)}")
+        return False
+
+    # A slow-refilling bucket must not hold up the eviction of buckets that are already full.
+    slow = QuotaConfig(default=BucketConfig(capacity=2, refill_rate=10.0), users={"slow": BucketConfig(100, 0.001)})
+    tracker = create_tracker(slow, evict_idle=True)
+    check_request(tracker, "slow", 0.0)
+    for i in range(1000):
+        check_request(tracker, f"user-{i}", i / 1000)
+    for i in range(1000):
+        check_request(tracker, "probe", 10.0 + i / 1000)
+    if sorted(tracker.buckets) != ["probe", "slow"]:
+        print(f"  {len(tracker.buckets)} buckets left behind a slow one, expected only 'slow' and 'probe'")
+        return False
+
+    # With max_entries a batch must match check_request one request at a time, even though buckets are dropped.
+    capped = QuotaConfig(default=BucketConfig(capacity=2, refill_rate=0.1), users={})
+    batch_users, batch_times = ["a", "b", "a", "a"], [0.0] * 4
+    sequential = create_tracker(capped, max_entries=1)
+    expected = [check_request(sequential, user, now) for user, now in zip(batch_users, batch_times)]
+    allowed, remaining, retry_after = check_requests(create_tracker(capped, max_entries=1), batch_users, batch_times)
+    if list(zip(allowed, remaining, retry_after)) != expected:
+        print(f"  max_entries batch gave {list(zip(allowed, remaining, retry_after))}, sequential {expected}")
+        return False
+
+    # A bucket re-created at an earlier time than it was dropped at could decide differently, so that is rejected.
+    tracker = create_tracker(capped, evict_idle=True)
+    check_request(tracker, "a", 5.0)
+    for batch_users, batch_times in ((["a"], [4.0]), (["b", "c"], [6.0, 5.5])):
+        try:
+            check_requests(tracker, batch_users, batch_times)
+        except ValueError:
+            continue
+        print(f"  evict_idle accepted times {batch_times} after 5.0")
+        return False
+    try:
+        check_request(tracker, "a", 4.0)
+    except ValueError:
+        pass
+    else:
+        print("  evict_idle accepted a check at 4.0 after 5.0")
+        return False
+    if sorted(tracker.buckets) != ["a"] or check_request(tracker, "a", 5.0) != (True, 0.0, None):
+        print("  a rejected out-of-order check changed the tracker")
+        return False
+    return True
+
+
+def check_streaming_stops_at_malformed_value() -> bool:
+    """A malformed request must fail where it stands, without reading the rest of a large scenario file."""
+    long_user = "u" * (3 * READ_CHUNK)
+    tail = ",\n".join(['{"user": "tail", "time": 1.0}'] * 400_000)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "malformed.json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"config": {"default": {"capacity": 5, "refill_rate": 1.0}}, "requests": [\n')
+            f.write(f'{{"user": "{long_user}", "time": 0.0}},\n{{"user": "bad", "time": tru}},\n{tail}]}}\n')
+
+        tracemalloc.start()
+        try:
+            _, requests = iter_scenario(path)
+            first = next(requests)
+            next(requests)
+        except ValueError:
+            peak = tracemalloc.get_traced_memory()[1]
+        else:
+            print("  A malformed request was accepted")
+            return False
+        finally:
+            tracemalloc.stop()
+
+    if first["user"] != long_user:
+        print("  A user ID longer than a read chunk was not streamed whole")
+        return False
+    if peak > 32 * READ_CHUNK:
+        print(f"  Reading up to the malformed request peaked at {peak} bytes, the file is {len(tail)} characters")
+        return False
+    return True
+
+
+def check_concurrent_no_over_admission() -> bool:
+    """Threads hammering shared users at a frozen time must be allowed exactly capacity requests each."""
+    config = QuotaConfig(default=BucketConfig(capacity=200, refill_rate=1.0), users={})
+    tracker = create_concurrent_tracker(config, stripe_count=4)
+    users = [f"user-{i}" for i in range(8)]
+    allowed = [0] * 16
+
+    def worker(index: int) -> None:
+        for i in range(2000):
+            if check_request_concurrent(tracker, users[(index + i) % len(users)], 0.0)[0]:
+                allowed[index] += 1
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(allowed))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+
+    expected = len(users) * 200
+    if sum(allowed) != expected:
+        print(f"  allowed {sum(allowed)} requests, bucket capacity allows exactly {expected}")
+        return False
+    return True
+
+
+def _hammer_shared(tracker, users: list[str], results) -> None:
+    """Worker process body: count how many checks on shared users are allowed at a frozen time."""
+    allowed = sum(1 for i in range(1000) if check_request_shared(tracker, users[i % len(users)], 0.0)[0])
+    results.put(allowed)
+
+
+def check_shared_one_quota_across_processes() -> bool:
+    """Forked workers sharing one table must be allowed exactly capacity requests per user in total."""
+    context = multiprocessing.get_context("fork")
+    config = QuotaConfig(default=BucketConfig(capacity=100, refill_rate=1.0), users={})
+    tracker = create_shared_tracker(config, slot_count=1024, stripe_count=8)
+    users = [f"user-{i}" for i in range(8)]
+    results = context.Queue()
+    try:
+        workers = [context.Process(target=_hammer_shared, args=(tracker, users, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        allowed = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+    finally:
+        close_shared_tracker(tracker, unlink=True)
+
+    expected = len(users) * 100
+    if allowed != expected:
+        print(f"  workers allowed {allowed} requests in total, one shared quota allows {expected}")
+        return False
+    return True
+
+
+def check_snapshot_restart_preserves_decisions() -> bool:
+    """Restarting from an incrementally written snapshot must continue exactly where the old tracker stopped.
+
+    Also with idle eviction and the creation log, after snapshots written (or abandoned) between requests.
+    """
+    config, users, times = random_workload(seed=4, count=6000, user_count=300, disorder=0.0)
+    reference = create_tracker(config)
+    expected = [check_request(reference, user, now) for user, now in zip(users, times)]
+
+    for evict_idle in (False, True):
+        actual = []
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "buckets.snapshot")
+            tracker = create_tracker(config, evict_idle)
+            for start in range(0, len(users), 2000):
+                batch = list(zip(users[start:start + 2000], times[start:start + 2000]))
+                if evict_idle:
+                    tracker.created = tracker.created if tracker.created is not None else []
+                    writer = begin_snapshot(tracker.buckets, path, tracker.snapshot, tracker.created)
+                    done = False
+                    for step, (user, now) in enumerate(batch[:1000]):
+                        actual.append(check_request(tracker, user, now))
+                        if start == 0 and step == 100:
+                            writer.mapping.close()
+                            writer.file.close()
+                            done = True
+                        if not done:
+                            done = snapshot_step(writer, tracker.buckets, budget=1)
+                    while not done:
+                        done = snapshot_step(writer, tracker.buckets, budget=1)
+                    if not writer.file.closed:
+                        finish_snapshot(writer)
+                    batch = batch[1000:]
+                for user, now in batch:
+                    actual.append(check_request(tracker, user, now))
+                writer = begin_snapshot(tracker.buckets, path, tracker.snapshot, tracker.created)
+                while not snapshot_step(writer, tracker.buckets, budget=64):
+                    pass
+                finish_snapshot(writer)
+                if evict_idle and sorted(tracker.created) != sorted(tracker.buckets):
+                    print(f"  creation log holds {len(tracker.created)} users, registry {len(tracker.buckets)}")
+                    return False
+                tracker = create_tracker(config, evict_idle, snapshot=open_snapshot(path))
+
+        for i, (act, exp) in enumerate(zip(actual, expected)):
+            if act != exp:
+                print(f"  Request {i + 1}: restarted tracker gave {act}, uninterrupted tracker gave {exp}")
+                return False
+    return True
+
+
+def check_checkpoint_cancel_waits_for_finish() -> bool:
+    """Cancelling the checkpoint task while a snapshot is being synced must still put that snapshot in place."""
+    config = QuotaConfig(default=BucketConfig(capacity=5, refill_rate=1.0), users={})
+    tracker = create_tracker(config)
+    for i in range(100):
+        check_request(tracker, f"user-{i}", 0.0)
+    tracker.created = list(tracker.buckets)
+    finishing = threading.Event()
+
+    def slow_finish(writer) -> None:
+        finishing.set()
+        time.sleep(0.1)
+        finish_snapshot(writer)
+
+    async def cancel_while_finishing(path: str) -> None:
+        task = asyncio.create_task(server.checkpoint_periodically(tracker, path, 0.0))
+        while not finishing.is_set():
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await asyncio.wait([task])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "buckets.snapshot")
+        server.finish_snapshot = slow_finish
+        try:
+            asyncio.run(cancel_while_finishing(path))
+        finally:
+            server.finish_snapshot = finish_snapshot
+        try:
+            snapshot = open_snapshot(path)
+        except FileNotFoundError:
+            print("  cancelling during the final sync lost the snapshot")
+            return False
+        restored = restore_bucket(snapshot, "user-0", config.default)
+        snapshot.mapping.close()
+    if restored is None or restored.tokens != 4.0:
+        print(f"  restored {restored}, expected user-0 with 4 tokens")
+        return False
+    return True
+
+
+def check_reload_rebinds_buckets_lazily() -> bool:
+    """After reload_config, existing buckets must switch to the new limits with tokens clamped to capacity.
+
+    Idle eviction must not change that: a stale bucket is only dropped if rebinding it would give a fresh one.
+    """
+    if not check_reload_is_lazy(evict_idle=False) or not check_reload_is_lazy(evict_idle=True):
+        return False
+    for evict_idle in (False, True):
+        tracker = create_tracker(QuotaConfig(default=BucketConfig(capacity=5, refill_rate=1.0), users={}), evict_idle)
+        check_request(tracker, "a", 0.0)
+        reload_config(tracker, QuotaConfig(default=BucketConfig(capacity=10, refill_rate=1.0), users={}))
+        check_request(tracker, "b", 100.0)
+        actual = check_request(tracker, "a", 100.0)
+        if actual != (True, 4.0, None):      # refilled to the old capacity of 5, then charged
+            print(f"  evict_idle={evict_idle}: a bucket rebound after a capacity increase gave {actual}")
+            return False
+
+    config, users, times = random_workload(seed=9, count=6000, user_count=40, disorder=0.0)
+    reloads = [                              # no capacity grows: a bucket evicted before the reload comes back fresh
+        QuotaConfig(default=BucketConfig(capacity=3, refill_rate=0.5), users={}),
+        QuotaConfig(default=BucketConfig(capacity=2, refill_rate=2.0), users={"user-0": BucketConfig(3, 0.7, "gcra")}),
+        QuotaConfig(default=BucketConfig(capacity=2, refill_rate=0.9), users={"user-0": BucketConfig(2, 0.7, "gcra")}),
+    ]
+    plain, evicting = create_tracker(config), create_tracker(config, evict_idle=True)
+    for i, (user, now) in enumerate(zip(users, times)):
+        if i % 2000 == 1999:
+            reload_config(plain, reloads[i // 2000])
+            reload_config(evicting, reloads[i // 2000])
+        expected, actual = check_request(plain, user, now), check_request(evicting, user, now)
+        if actual != expected:
+            print(f"  Request {i + 1} ({user} at {now}): evicting {actual}, plain {expected} across reloads")
+            return False
+    return True
+
+
+def check_reload_is_lazy(evict_idle: bool) -> bool:
+    """The fixed reload steps of check_reload_rebinds_buckets_lazily, with or without idle eviction."""
+    tracker = create_tracker(QuotaConfig(default=BucketConfig(capacity=5, refill_rate=1.0), users={}), evict_idle)
+    for _ in range(4):
+        check_request(tracker, "alice", 0.0)
+    check_request(tracker, "bob", 0.0)
+
+    premium = BucketConfig(capacity=2, refill_rate=10.0)
+    reload_config(tracker, QuotaConfig(default=premium, users={}, tiers={"premium": premium}))
+    steps = [
+        ("alice", 0.0, (True, 0.0, None)),     # 1 token left, under the new capacity
+        ("bob", 0.0, (True, 1.0, None)),       # 4 tokens left, clamped to 2
+        ("alice", 0.1, (True, 0.0, None)),     # refilled at the new rate: 0.1 s * 10/s
+        ("carol", 0.1, (True, 1.0, None)),     # new users start at the new capacity
+    ]
+    passed = True
+    for user, now, expected in steps:
+        actual = check_request(tracker, user, now)
+        if actual != expected:
+            print(f"  {user} at t={now} (evict_idle={evict_idle}): got {actual}, expected {expected}")
+            passed = False
+    return passed
+
+
+def check_weighted_cost_is_atomic() -> bool:
+    """Weighted checks agree across registries and batching; a denial charges nothing and waits for the full cost."""
+    config, users, times = random_workload(seed=7, count=5000, user_count=20)
+    rng = random.Random(7)
+    costs = [rng.choice((0.5, 1.0, 2.0, 3.0)) for _ in users]
+
+    tracker = create_tracker(config)
+    expected = []
+    for user, now, cost in zip(users, times, costs):
+        before = tracker.buckets.get(user)
+        tokens_before = before.tokens if before is not None else None
+        result = check_request(tracker, user, now, cost)
+        allowed, remaining, retry_after = result
+        rate = tracker.buckets[user].config.refill_rate
+        if not allowed and (remaining >= cost or retry_after != (cost - remaining) / rate):
+            print(f"  {user} at {now}: denial {result} for cost {cost} is inconsistent")
+            return False
+        if not allowed and tokens_before is not None and remaining < tokens_before:
+            print(f"  {user} at {now}: denied request for cost {cost} still charged tokens")
+            return False
+        expected.append(result)
+
+    batched = create_tracker(config)
+    allowed, remaining, retry_after = check_requests(batched, users, times, costs)
+    columnar = create_columnar_tracker(config)
+    for i, (user, now, cost) in enumerate(zip(users, times, costs)):
+        for name, act in (
+            ("batch", (allowed[i], remaining[i], retry_after[i])),
+            ("columnar", check_request_columnar(columnar, user, now, cost)),
+        ):
+            if act != expected[i]:
+                print(f"  Request {i + 1}: {name} gave {act}, sequential gave {expected[i]}")
+                return False
+
+    try:
+        check_requests(batched, ["user-1", "user-2"], [1e9, 1e9], [1.0, 4.0])
+    except ValueError:
+        pass
+    else:
+        print("  A cost above capacity was accepted")
+        return False
+    if batched.buckets["user-1"].last_refill == 1e9:
+        print("  A rejected batch still changed a bucket")
+        return False
+    return True
+
+
+def check_hierarchy_is_atomic() -> bool:
+    """Nested user/org/global checks charge every level or none, never exceed a level, and batch exactly."""
+    config, users, times = random_workload(seed=8, count=5000, user_count=20, disorder=0.0)
+    config.orgs = {"acme": BucketConfig(capacity=6, refill_rate=1.5), "beta": BucketConfig(capacity=4, refill_rate=1.0)}
+    config.user_orgs = {f"user-{i}": "acme" if i % 2 else "beta" for i in range(12)}
+    config.global_limit = BucketConfig(capacity=8, refill_rate=3.0)
+    rng = random.Random(8)
+    costs = [rng.choice((1.0, 2.0)) for _ in users]
+
+    tracker = create_tracker(config)
+    admitted: dict[str, float] = {}
+    first_seen: dict[str, float] = {}
+    expected = []
+    for user, now, cost in zip(users, times, costs):
+        org = config.user_orgs.get(user)
+        levels = {user: lambda: tracker.buckets.get(user), "global": lambda: tracker.global_bucket}
+        if org is not None:
+            levels[org] = lambda: tracker.org_buckets.get(org)
+        before = {name: (b.tokens, b.last_refill) for name, get in levels.items() if (b := get()) is not None}
+
+        result = check_request(tracker, user, now, cost)
+        expected.append(result)
+        for name, get in levels.items():
+            bucket = get()
+            first_seen.setdefault(name, now)
+            if result[0]:
+                admitted[name] = admitted.get(name, 0.0) + cost
+            elif name in before:
+                tokens, last_refill = before[name]
+                if now > last_refill:
+                    tokens = min(bucket.config.capacity, tokens + (now - last_refill) * bucket.config.refill_rate)
+                if bucket.tokens != tokens:
+                    print(f"  {user} at {now}: denied request changed level {name} beyond its refill")
+                    return False
+            limit = bucket.config.capacity + (now - first_seen[name]) * bucket.config.refill_rate
+            if admitted.get(name, 0.0) > limit + 1e-9:
+                print(f"  Level {name} admitted {admitted[name]} by {now}, more than its bucket allows ({limit})")
+                return False
+
+    allowed, remaining, retry_after = check_requests(create_tracker(config), users, times, costs)
+    for i, act in enumerate(zip(allowed, remaining, retry_after)):
+        if act != expected[i]:
+            print(f"  Request {i + 1}: batch gave {act}, sequential gave {expected[i]}")
+            return False
+    return True
+
+
+def check_concurrent_hierarchy_no_over_admission() -> bool:
+    """Threads hammering one hot org under a global limit must be allowed exactly what the tightest levels hold."""
+    config = QuotaConfig(
+        default=BucketConfig(capacity=5, refill_rate=1.0), users={},
+        global_limit=BucketConfig(capacity=60, refill_rate=1.0),
+        orgs={"acme": BucketConfig(capacity=20, refill_rate=1.0)},
+        user_orgs={f"user-{i}": "acme" for i in range(32)},
+    )
+    tracker = create_concurrent_tracker(config, stripe_count=4)
+    allowed = [[0, 0] for _ in range(8)]
+
+    def worker(index: int) -> None:
+        for i in range(500):
+            user = f"user-{(index * 500 + i) % 64}"
+            if check_request_concurrent(tracker, user, 0.0)[0]:
+                allowed[index][user in config.user_orgs] += 1
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(allowed))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+
+    in_org = sum(counts[1] for counts in allowed)
+    total = in_org + sum(counts[0] for counts in allowed)
+    if in_org != 20 or total != 60:
+        print(f"  allowed {in_org} requests in the org and {total} in total, expected exactly 20 and 60")
+        return False
+    return True
+
+
+def check_async_acquire_is_fifo_and_punctual() -> bool:
+    """Awaiting waiters are granted in FIFO order as each token refills; cancelled waiters are skipped, never charged.
+
+    A waiter cancelled after its grant but before it resumes gives the tokens back to the next waiter, under every
+    algorithm.
+    """
+    async def race(algorithm: str) -> tuple[bool, float, float]:
+        config = QuotaConfig(default=BucketConfig(capacity=1, refill_rate=50.0, algorithm=algorithm), users={})
+        limiter = create_async_limiter(create_tracker(config))
+        granted_at = {}
+
+        async def waiter(index: int) -> None:
+            await acquire(limiter, "alice")
+            granted_at[index] = limiter.loop.time()
+
+        tasks = [asyncio.create_task(waiter(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        future = limiter.waiters["alice"][0][0]                    # waiter 1's, granted when the timer fires
+        limiter.loop.call_at(limiter.timer_when, tasks[1].cancel)  # runs right after the timer, before waiter 1
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return (future.cancelled(), future.result()[1] if not future.cancelled() else 0.0, granted_at.get(2, 0.0))
+
+    for algorithm in ALGORITHMS:
+        cancelled, cancelled_grant, next_grant = asyncio.run(race(algorithm))
+        if cancelled or not abs(next_grant - cancelled_grant) < 0.01:
+            print(f"  {algorithm}: waiter 2 granted {next_grant - cancelled_grant:.4f}s after the cancelled grant")
+            return False
+
+    async def run() -> list[tuple[int, float]]:
+        config = QuotaConfig(default=BucketConfig(capacity=1, refill_rate=50.0), users={})
+        limiter = create_async_limiter(create_tracker(config))
+        start = limiter.loop.time()
+        granted = []
+
+        async def waiter(index: int) -> None:
+            await acquire(limiter, "alice")
+            granted.append((index, limiter.loop.time() - start))
+
+        tasks = [asyncio.create_task(waiter(i)) for i in range(8)]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        tasks[2].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if pending(limiter) or limiter.timer is not None:
+            granted.append((-1, 0.0))
+        return granted
+
+    granted = asyncio.run(run())
+    order = [index for index, _ in granted]
+    if order != [0, 3, 4, 5, 6, 7]:
+        print(f"  grant order {order}, expected [0, 3, 4, 5, 6, 7] with the queue fully drained")
+        return False
+    for k, (index, elapsed) in enumerate(granted):
+        if not k * 0.02 - 1e-9 <= elapsed <= k * 0.02 + 0.05:
+            print(f"  waiter {index} granted at {elapsed:.4f}s, its token refilled at {k * 0.02:.2f}s")
+            return False
+    return True
+
+
+def check_storage_backends_match_tracker() -> bool:
+    """Memory and RESP-script backends decide exactly like quota_tracker, single or pipelined, from several nodes."""
+    config, users, times = random_workload(seed=9, count=3000, user_count=30)
+    rng = random.Random(9)
+    costs = [rng.choice((0.5, 1.0, 2.0)) for _ in users]
+    reference = create_tracker(config)
+    expected = [check_request(reference, u, now, cost) for u, now, cost in zip(users, times, costs)]
+
+    fake = start_fake_redis()
+    nodes = [RespBackend(host=fake.host, port=fake.port, pool_size=2) for _ in range(2)]
+    try:
+        memory = create_backend_tracker(config, MemoryBackend())
+        remote = create_backend_tracker(config, nodes[0])
+        half = len(users) // 2
+        runs = {
+            "memory": [check_request_backend(memory, u, now, cost) for u, now, cost in zip(users, times, costs)],
+            "resp": [check_request_backend(remote, u, now, cost) for u, now, cost in zip(users[:half], times, costs)],
+        }
+        nodes[0].execute("SCRIPT", "FLUSH")
+        allowed, remaining, retry_after = check_requests_backend(remote, users[half:], times[half:], costs[half:])
+        runs["resp"].extend(zip(allowed, remaining, retry_after))
+        for name, actual in runs.items():
+            for i, (act, exp) in enumerate(zip(actual, expected)):
+                if act != exp:
+                    print(f"  Request {i + 1}: {name} backend gave {act}, quota_tracker gave {exp}")
+                    return False
+
+        nodes[0].execute("FLUSHALL")
+        shared = QuotaConfig(default=BucketConfig(capacity=100, refill_rate=1.0), users={})
+        trackers = [create_backend_tracker(shared, node) for node in nodes]
+        allowed_counts = [0] * 8
+
+        def worker(index: int) -> None:
+            tracker = trackers[index % 2]
+            for i in range(200):
+                if check_request_backend(tracker, f"user-{i % 4}", 0.0)[0]:
+                    allowed_counts[index] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(allowed_counts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if sum(allowed_counts) != 400:
+            print(f"  two nodes allowed {sum(allowed_counts)} requests on 4 shared buckets of 100")
+            return False
+
+        # The script is flushed after 50 calls of a pipeline and loaded again 20 calls later: only the 20 refused
+        # commands are sent again, so every bucket is charged once.
+        fresh = [f"fresh-{i}" for i in range(200)]
+        schedule_script_flush(fake, after=50, reload_after=20)
+        allowed, remaining, _ = check_requests_backend(trackers[0], fresh, [0.0] * 200, [1.0] * 200)
+        if not all(allowed) or set(remaining) != {99.0}:
+            print(f"  after a flush partway through a pipeline, remaining tokens were {sorted(set(remaining))}")
+            return False
+    finally:
+        for node in nodes:
+            node.close()
+        stop_fake_redis(fake)
+    return True
+
+
+def check_leases_bound_over_admission() -> bool:
+    """Leasing nodes admit at most one lease per node beyond one shared bucket, and hot users rarely go remote."""
+    config, users, times = random_workload(seed=10, count=6000, user_count=5, disorder=0.0)
+    rng = random.Random(10)
+    store = create_backend_tracker(config, MemoryBackend())
+    nodes = [create_lease_tracker(store, lease_fraction=0.5, lease_ttl=0.5) for _ in range(3)]
+    admitted: dict[str, list[float]] = {}
+    for user, now in zip(users, times):
+        if check_request_leased(nodes[rng.randrange(len(nodes))], user, now)[0]:
+            admitted.setdefault(user, []).append(now)
+
+    for user, stamps in admitted.items():
+        bucket = config.users.get(user, config.default)
+        slack = bucket.capacity + len(nodes) * 0.5 * bucket.capacity + 1e-9
+        for i, start in enumerate(stamps):
+            for j in range(i, len(stamps)):
+                if j - i + 1 > slack + (stamps[j] - start) * bucket.refill_rate:
+                    print(f"  {user}: {j - i + 1} admitted in [{start}, {stamps[j]}], above the documented bound")
+                    return False
+
+    plain = create_backend_tracker(config, MemoryBackend())
+    unleased = create_lease_tracker(create_backend_tracker(config, MemoryBackend()), lease_fraction=0.0)
+    for i, (user, now) in enumerate(zip(users, times)):
+        exp = check_request_backend(plain, user, now)
+        act = check_request_leased(unleased, user, now)
+        if act != exp:
+            print(f"  Request {i + 1}: lease_fraction=0 gave {act}, the backend gave {exp}")
+            return False
+
+    hot = create_lease_tracker(
+        create_backend_tracker(QuotaConfig(default=BucketConfig(capacity=100, refill_rate=2000.0), users={}),
+                               MemoryBackend()),
+        lease_fraction=0.1,
+    )
+    allowed = sum(check_request_leased(hot, "hot", i * 0.001)[0] for i in range(10_000))
+    if allowed != 10_000 or hot.remote_calls > 1000:
+        print(f"  hot user: {allowed} of 10000 allowed with {hot.remote_calls} remote calls, expected all and <= 1000")
+        return False
+    return True
+
+
+def check_algorithms_honour_their_limits() -> bool:
+    """GCRA decides like a token bucket; the sliding log and counter never exceed capacity per window.
+
+    The two bucket forms round differently, so they agree to within GCRA_TOLERANCE rather than exactly: remaining
+    and retry_after may differ by that much, and a request landing that close to the refill boundary may be allowed
+    by one and denied by the other (about 0.8% of requests when times are picked to land on boundaries). Checked
+    over 100 seeds. Every denial's retry_after must also be honest: the same request just after it is allowed.
+    """
+    config, users, times = random_workload(seed=11, count=6000, user_count=20, disorder=0.0)
+    rng = random.Random(11)
+    costs = [rng.choice([1.0, 1.0, 2.0, 0.5, 2.5]) for _ in users]
+
+    def with_algorithm(algorithm: str) -> QuotaConfig:
+        return QuotaConfig(
+            default=BucketConfig(config.default.capacity, config.default.refill_rate, algorithm),
+            users={u: BucketConfig(c.capacity, c.refill_rate, algorithm) for u, c in config.users.items()},
+        )
+
+    for seed in range(100):
+        rng = random.Random(seed)
+        capacity = rng.choice([1.0, 2.0, 3.0, 5.0, 0.5 * rng.randint(1, 20)])
+        rate = rng.choice([0.1, 0.7, 1.0, 2.5, rng.uniform(0.1, 5.0)])
+        reference = create_tracker(QuotaConfig(default=BucketConfig(capacity, rate), users={}))
+        gcra = create_tracker(QuotaConfig(default=BucketConfig(capacity, rate, "gcra"), users={}))
+        now = 0.0
+        for i in range(1000):
+            cost = min(capacity, rng.choice([1.0, 0.5, 2.0, 0.1, 0.3]))
+            exp = check_request(reference, "user", now, cost)
+            act = check_request(gcra, "user", now, cost)
+            if act[0] != exp[0]:
+                if (exp[2] if act[0] else act[2]) > GCRA_TOLERANCE:
+                    print(f"  seed {seed} request {i + 1}: gcra gave {act}, token bucket gave {exp}")
+                    return False
+                reference.buckets.clear()          # the states now differ by cost: start both over
+                gcra.buckets.clear()
+            elif abs(act[1] - exp[1]) > GCRA_TOLERANCE or abs((act[2] or 0.0) - (exp[2] or 0.0)) > GCRA_TOLERANCE:
+                print(f"  seed {seed} request {i + 1}: gcra gave {act}, token bucket gave {exp}")
+                return False
+            now += rng.choice([0.0, 0.1, 1 / rate, cost / rate, 0.5 / rate, rng.random()])   # often on a boundary
+
+    for algorithm in ("sliding_log", "sliding_window"):
+        tracker = create_tracker(with_algorithm(algorithm))
+        admitted: dict[str, list[tuple[float, float]]] = {}
+        for i, (user, now, cost) in enumerate(zip(users, times, costs)):
+            allowed, _, retry_after = check_request(tracker, user, now, cost)
+            if allowed:
+                admitted.setdefault(user, []).append((now, cost))
+                continue
+            probe = copy.deepcopy(tracker.buckets[user])
+            if not ALGORITHMS[algorithm].consume(probe, now + retry_after + 1e-9, cost)[0]:
+                print(f"  {algorithm} request {i + 1}: still denied {retry_after}s later")
+                return False
+
+        for user, stamps in admitted.items():
+            bucket = config.users.get(user, config.default)
+            window = bucket.capacity / bucket.refill_rate
+            # The log bounds every window; the counter bounds every fixed, aligned one.
+            if algorithm == "sliding_log":
+                starts = [t for t, _ in stamps]
+            else:
+                starts = sorted({t // window * window for t, _ in stamps})
+            for start in starts:
+                total = sum(c for t, c in stamps if start <= t < start + window)
+                if total > bucket.capacity + 1e-9:
+                    print(f"  {algorithm} {user}: {total} admitted in [{start}, {start + window}), "
+                          f"capacity {bucket.capacity}")
+                    return False
+
+    for algorithm in ("gcra", "sliding_log", "sliding_window"):
+        evicting = create_tracker(with_algorithm(algorithm), evict_idle=True)
+        plain = create_tracker(with_algorithm(algorithm))
+        for i, (user, now, cost) in enumerate(zip(users, times, costs)):
+            act = check_request(evicting, user, now, cost)
+            exp = check_request(plain, user, now, cost)
+            if act != exp:
+                print(f"  Request {i + 1}: evicting {algorithm} tracker gave {act}, plain gave {exp}")
+                return False
+    return True
+
+
+def check_metrics_record_every_decision() -> bool:
+    """Metered checks decide exactly like plain ones, count every decision and find the most-denied users."""
+    config = QuotaConfig(default=BucketConfig(capacity=3, refill_rate=0.7), users={})
+    rng = random.Random(12)
+    # Half the traffic from 10 hot users, half spread over 300, at 500 requests/s.
+    users = [f"user-{rng.randrange(10 if rng.random() < 0.5 else 300)}" for _ in range(20000)]
+    times = [i * 0.002 for i in range(20000)]
+    plain = create_tracker(config)
+    metrics = create_metrics(create_tracker(config), sample_every=7, top_k=16)
+    denials: dict[str, int] = {}
+    for start in range(0, len(users), 1000):
+        batch_users, batch_times = users[start:start + 1000], times[start:start + 1000]
+        if start % 2000:
+            expected = [check_request(plain, u, t) for u, t in zip(batch_users, batch_times)]
+            actual = [check_request_metered(metrics, u, t) for u, t in zip(batch_users, batch_times)]
+        else:
+            expected = list(zip(*check_requests(plain, batch_users, batch_times)))
+            actual = list(zip(*check_requests_metered(metrics, batch_users, batch_times)))
+        if actual != expected:
+            print(f"  requests {start + 1}-{start + 1000}: metered decisions differ from plain ones")
+            return False
+        for user, result in zip(batch_users, expected):
+            if not result[0]:
+                denials[user] = denials.get(user, 0) + 1
+
+    denied = sum(denials.values())
+    if metrics.allowed + denied != len(users) or metrics.denied != denied:
+        print(f"  counted {metrics.allowed} allowed and {metrics.denied} denied, "
+              f"expected {len(users) - denied} and {denied}")
+        return False
+
+    text = render_prometheus(metrics)
+    sketch = metrics.denied_users
+    if len(denials) <= sketch.size:
+        print(f"  only {len(denials)} users were denied, too few to exercise the sketch")
+        return False
+    for user, true_count in denials.items():
+        estimate = sketch.counts.get(user)
+        if estimate is None:
+            if true_count > denied / sketch.size:
+                print(f"  {user} was denied {true_count} of {denied} times but is missing from the sketch")
+                return False
+        elif not true_count <= estimate <= true_count + sketch.errors[user]:
+            print(f"  {user}: estimate {estimate} (error {sketch.errors[user]}) does not bound true count {true_count}")
+            return False
+    if f'ratelimiter_decisions_total{{decision="deny"}} {denied}' not in text:
+        print("  Prometheus text is missing the deny counter")
+        return False
+
+    # One window after a full log, rounding keeps the entry in the window: a denial with retry_after 0.0.
+    log = BucketConfig(capacity=1.0, refill_rate=0.3, algorithm="sliding_log")
+    metrics = create_metrics(create_tracker(QuotaConfig(default=log, users={})))
+    allowed, _, retry_after = check_requests_metered(metrics, ["u", "u"], [0.4, 0.4 + log.capacity / log.refill_rate])
+    flush_denials(metrics)
+    if allowed != [True, False] or retry_after[1] != 0.0 or metrics.denied_users.counts.get("u") != 1:
+        print(f"  a denial with retry_after {retry_after[1]} was not recorded as a denied user")
+        return False
+    return True
+
+
+def check_trace_replay_matches_json() -> bool:
+    """Replaying a converted trace must print exactly what the JSON scenario prints, chunk boundaries included."""
+    # In order: --evict-idle is exact only while times never go backwards, and the two replays batch differently.
+    config, users, times = random_workload(seed=13, count=9000, user_count=400, disorder=0.0)
+    config.tiers = {"gold": BucketConfig(capacity=10, refill_rate=2.5), "gcra": BucketConfig(3, 0.7, "gcra")}
+    config.users = {"user-0": config.tiers["gold"], "user-1": config.tiers["gcra"], "user-2": BucketConfig(4, 1.5)}
+    rng = random.Random(13)
+    requests = []
+    for user, now in zip(users, times):
+        request = {"user": user, "time": now}
+        if rng.random() < 0.2:
+            request["cost"] = rng.choice((0.5, 2.0, 3.0))
+        requests.append(request)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = [str(Path(__file__).parent / scenario["file"]) for scenario in SCENARIOS]
+        sources.append(os.path.join(tmp, "random.ndjson"))
+        with open(sources[-1], "w", encoding="utf-8") as f:
+            f.write(json.dumps({"config": dump_config(config)}) + "\n")
+            f.writelines(json.dumps(request) + "\n" for request in requests)
+
+        trace_path = os.path.join(tmp, "replay.trace")
+        for source in sources:
+            convert_scenario(source, trace_path)
+            if source.endswith(".json"):
+                expected, actual = run_scenario_file(source), run_scenario_file(trace_path)
+            else:
+                expected = list(stream_scenario(source, evict_idle=True))
+                actual = list(stream_scenario(trace_path, evict_idle=True))
+            if actual != expected:
+                print(f"  {source}: trace replay differs from the scenario file")
+                return False
+        if len(run_scenario(trace_path)) != len(requests):
+            print("  trace replay lost requests")
+            return False
+
+        with open(trace_path, "r+b") as f:
+            f.truncate(os.path.getsize(trace_path) - 1)
+        try:
+            close_trace(open_trace(trace_path))
+        except ValueError:
+            pass
+        else:
+            print("  A truncated trace was accepted")
+            return False
+    return True
+
+
+def check_fast_output_matches_json_dumps() -> bool:
+    """Scenario output must be byte for byte json.dumps of each response dict, streamed or not; CSV must agree."""
+    config, users, times = random_workload(seed=14, count=6000, user_count=30)
+    rng = random.Random(14)
+    odd_users = ('q"uote', "back\\slash", "ünïcode", "nan: inf, x")
+    users = [rng.choice(odd_users) if rng.random() < 0.05 else user for user in users]
+    requests = [{"user": user, "time": now} for user, now in zip(users, times)]
+    for request in rng.sample(requests, 1000):
+        request["cost"] = rng.choice((0.5, 2.0, 3.0))
+    requests[100]["time"] = 1e17
+    requests[200]["time"] = 1e-7
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scenario.json")
+        for extra in ([], [{"user": "late", "time": float("inf")}]):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"config": dump_config(config), "requests": requests + extra}, f)
+            expected = "".join(json.dumps(response) + "\n" for response in run_scenario(path))
+            for stream in (False, True):
+                out = io.StringIO()
+                write_scenario(path, out, stream=stream)
+                if out.getvalue() != expected:
+                    print(f"  stream={stream}, {len(extra)} non-finite times: output differs from json.dumps")
+                    return False
+
+        out = io.StringIO()
+        write_scenario(path, out, output_format="csv")
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        for row, response in zip(rows, run_scenario(path)):
+            if (row["user"], float(row["time"]), row["decision"], float(row["remaining"])) != (
+                response["user"], response["time"], response["decision"], response["remaining"]
+            ) or (row["retry_after"] and float(row["retry_after"])) != response.get("retry_after", ""):
+                print(f"  CSV row {row} does not match {response}")
+                return False
+        if len(rows) != len(requests) + 1:
+            print(f"  CSV has {len(rows)} rows for {len(requests) + 1} requests")
+            return False
+    return True
+
+
+def check_sharded_replay_matches_serial() -> bool:
+    """Replay split across worker processes must print exactly what one process prints, up to an invalid request."""
+    config, users, times = random_workload(seed=15, count=70000, user_count=3000)
+    config.orgs = {"acme": BucketConfig(capacity=20, refill_rate=5.0)}
+    config.user_orgs = {f"user-{i}": "acme" for i in range(0, 3000, 7)}
+    rng = random.Random(15)
+    requests = [{"user": user, "time": now} for user, now in zip(users, times)]
+    for request in rng.sample(requests, 5000):
+        request["cost"] = rng.choice((0.5, 2.0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "scenario.json")
+        trace_path = os.path.join(tmp, "scenario.trace")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": dump_config(config), "requests": requests}, f)
+        convert_scenario(json_path, trace_path)
+        serial = io.StringIO()
+        write_scenario(json_path, serial)
+        for path, stream, workers in ((json_path, False, 3), (json_path, True, 2), (trace_path, False, 4)):
+            sharded = io.StringIO()
+            write_scenario(path, sharded, stream=stream, workers=workers)
+            if sharded.getvalue() != serial.getvalue():
+                print(f"  {os.path.basename(path)} with {workers} workers, stream={stream}: output differs from serial")
+                return False
+
+        with open(trace_path, "r+b") as f:        # a cost above every capacity, seen only by a worker
+            f.seek(TRACE_HEADER.size + len(requests) * 8 + 30000 * 8)
+            f.write(struct.pack("<d", 50.0))
+        try:
+            write_scenario(trace_path, io.StringIO(), workers=3)
+        except ValueError:
+            pass
+        else:
+            print("  A worker's invalid cost was not raised as ValueError")
+            return False
+        result = subprocess.run(
+            [sys.executable, str(Path(__file__).parent / "rate_limiter.py"), "scenario", "--file", trace_path,
+             "--workers", "2"],
+            capture_output=True, text=True,
+        )
+        if result.returncode != 1 or not result.stderr.startswith("Error: cost 50.0"):
+            print(f"  A worker failure exited {result.returncode} with {result.stderr[-200:]!r}")
+            return False
+
+        requests[40000]["cost"] = 50.0            # above every capacity
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": dump_config(config), "requests": requests}, f)
+        outputs = []
+        for workers in (1, 3):
+            out = io.StringIO()
+            try:
+                write_scenario(json_path, out, stream=True, workers=workers)
+            except ValueError:
+                outputs.append(out.getvalue())
+        if len(outputs) != 2 or outputs[0] != outputs[1] or outputs[0].count("\n") != 40000:
+            print("  An invalid request did not stop sharded replay at the same place as serial replay")
+            return False
+
+        config.global_limit = BucketConfig(capacity=100, refill_rate=50.0)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": dump_config(config), "requests": requests[:10]}, f)
+        try:
+            write_scenario(json_path, io.StringIO(), workers=2)
+        except ValueError:
+            pass
+        else:
+            print("  A global limit was replayed by independent workers")
+            return False
+    return True
+
+
+def check_sub_unit_capacity_on_every_path() -> bool:
+    """A tier with capacity below 1 must deny default-cost requests on every path, never reject them as invalid."""
+    config, users, times = random_workload(seed=24, count=3000, user_count=30)
+    config.users.update({f"user-{i}": BucketConfig(capacity=0.5, refill_rate=0.4) for i in range(1, 30, 3)})
+    expected_tracker = create_tracker(config)
+    expected = [check_request(expected_tracker, user, now) for user, now in zip(users, times)]
+    reference = [(allowed, round(remaining, 2), None if wait is None else round(wait, 2))
+                 for allowed, remaining, wait in expected]
+
+    costs = [1.0] * len(users)                         # given explicitly, as serve and scenario replay do
+    allowed, remaining, retry_after = check_requests(create_tracker(config), users, times, costs)
+    paths = {"check_requests": list(zip(allowed, remaining, retry_after))}
+    backend = create_backend_tracker(config, MemoryBackend())
+    allowed, remaining, retry_after = check_requests_backend(backend, users, times, costs)
+    paths["MemoryBackend"] = list(zip(allowed, remaining, retry_after))
+    for name, results in paths.items():
+        if results != expected:
+            print(f"  {name} differs from check_request")
+            return False
+
+    request_lines = [f"{user} {now!r}".encode() for user, now in zip(users, times)]
+    replies = answer_lines(create_tracker(config), request_lines)
+    served = []
+    for reply in replies.decode().splitlines():
+        parts = reply.split()
+        if parts[0] == "ERR":
+            print(f"  serve answered {reply!r}")
+            return False
+        served.append((parts[0] == "ALLOW", float(parts[1]), float(parts[2]) if len(parts) == 3 else None))
+    if served != reference:
+        print("  serve differs from check_request")
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path, trace_path = os.path.join(tmp, "scenario.json"), os.path.join(tmp, "scenario.trace")
+        requests = [{"user": user, "time": now} for user, now in zip(users, times)]
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": dump_config(config), "requests": requests}, f)
+        convert_scenario(json_path, trace_path)
+        lines_path = os.path.join(tmp, "requests.txt")
+        with open(lines_path, "wb") as f:
+            f.write(b"\n".join(request_lines) + b"\n")
+        with open(lines_path, "rb") as stdin:                   # serve < requests.txt: stdin is a regular file
+            result = subprocess.run(
+                [sys.executable, str(Path(__file__).parent / "rate_limiter.py"), "serve", "--config", json_path],
+                stdin=stdin, capture_output=True,
+            )
+        if result.returncode != 0 or result.stdout != replies:
+            print(f"  serve < file exited {result.returncode}, differs from answer_lines: {result.stderr[-200:]!r}")
+            return False
+        replayed = [(r["decision"] == "ALLOW", r["remaining"], r.get("retry_after")) for r in run_scenario(json_path)]
+        if replayed != reference:
+            print("  scenario replay differs from check_request")
+            return False
+        serial = io.StringIO()
+        write_scenario(json_path, serial)
+        for path, workers in ((trace_path, 1), (json_path, 2), (trace_path, 2)):
+            out = io.StringIO()
+            write_scenario(path, out, workers=workers)
+            if out.getvalue() != serial.getvalue():
+                print(f"  {os.path.basename(path)} with {workers} workers differs from the serial JSON replay")
+                return False
+    return True
+
+
+def check_deny_cache_is_exact() -> bool:
+    """The deny cache must return exactly what the tracker returns and leave every bucket in the same state."""
+    config, users, times = random_workload(seed=16, count=40000, user_count=200)
+    config.users["user-3"] = BucketConfig(capacity=0.5, refill_rate=0.2)     # a default cost of 1 never fits
+    rng = random.Random(16)
+    users = [f"user-{rng.randrange(4)}" if rng.random() < 0.7 else user for user in users]
+    times = [now / 20 for now in times]                                       # hot users hammer empty buckets
+    costs = [rng.choice((0.5, 1.0, 1.0, 2.0)) if user != "user-3" else 1.0 for user in users]
+    reloaded = QuotaConfig(default=BucketConfig(capacity=2, refill_rate=1.5), users={})
+
+    plain = create_tracker(config)
+    cache = create_deny_cache(create_tracker(config), max_entries=3)
+    for i, (user, now, cost) in enumerate(zip(users, times, costs)):
+        if i == len(users) // 2:
+            reload_config(plain, reloaded)
+            reload_config(cache.tracker, reloaded)
+        expected = check_request(plain, user, now, cost)
+        actual = check_request_deny_cached(cache, user, now, cost)
+        if actual != expected:
+            print(f"  Request {i + 1} ({user} at {now}, cost {cost}): cached {actual}, uncached {expected}")
+            return False
+    for user, bucket in plain.buckets.items():
+        cached = cache.tracker.buckets[user]
+        if (cached.tokens, cached.last_refill) != (bucket.tokens, bucket.last_refill):
+            print(f"  {user}: cached bucket {cached}, uncached {bucket}")
+            return False
+    if cache.hits < len(users) // 4:
+        print(f"  only {cache.hits} of {len(users)} requests were answered from the cache")
+        return False
+
+    try:
+        check_request_deny_cached(cache, "user-0", times[-1], 50.0)
+    except ValueError:
+        pass
+    else:
+        print("  A cost above capacity was accepted")
+        return False
+    return True
+
+
+def check_user_index_matches_inline_users() -> bool:
+    """A config whose overrides sit in a user index must behave exactly like the same overrides given inline."""
+    config, users, times = random_workload(seed=22, count=20000, user_count=3000)
+    config.tiers = {"gold": BucketConfig(capacity=10, refill_rate=2.5), "gcra": BucketConfig(3, 0.7, "gcra")}
+    rng = random.Random(22)
+    choices = (config.tiers["gold"], config.tiers["gcra"], BucketConfig(4, 1.5), BucketConfig(6, 0.5, "sliding_log"))
+    config.users = {f"user-{i}": rng.choice(choices) for i in range(0, 3000, 2)}
+    config.users["us\u00e9r-\u00fc"] = config.tiers["gold"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path, index_path = os.path.join(tmp, "config.json"), os.path.join(tmp, "users.index")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(dump_config(config), f)
+        summary = index_users(config_path, index_path)
+        if summary["users"] != len(config.users) or summary["configs"] != 4:
+            print(f"  index summary {summary}, expected {len(config.users)} users and 4 configs")
+            return False
+
+        section = {**dump_config(config), "users_index": "users.index"}
+        del section["users"]
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(section, f)
+        indexed = load_config_file(config_path)             # the relative path is taken from the config's directory
+        indexed.users.cache_size = 64
+
+        for user in [*config.users, "user-1", "user-2999", "user-3000", "", "us\u00e9r"]:
+            if indexed.users.get(user, indexed.default) != config.users.get(user, config.default):
+                print(f"  {user!r}: index gives {indexed.users.get(user)}, inline {config.users.get(user)}")
+                return False
+        if len(indexed.users.cache) > 64 or dict(indexed.users) != config.users:
+            print("  the index cache is unbounded or the index does not list the inline users")
+            return False
+        if indexed.users["us\u00e9r-\u00fc"] is not indexed.tiers["gold"]:
+            print("  index configs are not interned with the tiers")
+            return False
+
+        inline, lazy = create_tracker(config), create_tracker(indexed)
+        for i, (user, now) in enumerate(zip(users, times)):
+            expected, actual = check_request(inline, user, now), check_request(lazy, user, now)
+            if actual != expected:
+                print(f"  Request {i + 1} ({user} at {now}): indexed {actual}, inline {expected}")
+                return False
+
+        if load_config(dump_config(indexed)).users.path != indexed.users.path:
+            print("  dump_config lost the index path")
+            return False
+        for bad in ({**section, "users": {}}, {**section, "users_index": "missing.index"}):
+            try:
+                load_config(bad, Path(tmp))
+            except (ValueError, FileNotFoundError):
+                continue
+            print(f"  accepted a bad users_index config: {sorted(bad)}")
+            return False
+    return True
+
+
+def check_coarse_clock_error_is_bounded() -> bool:
+    """Under a coarse clock a hot user gains or loses at most resolution * refill_rate tokens against the wall clock."""
+    capacity, rate, resolution = 5.0, 50.0, 0.01
+    tracker = create_tracker(QuotaConfig(default=BucketConfig(capacity=capacity, refill_rate=rate), users={}))
+    rng = random.Random(23)
+    wall = 1000.003
+    clock = create_coarse_clock(resolution, source=lambda: wall)
+    admitted = 0
+    first_wall = wall
+    lowest = float("inf")                # min over admissions so far of (count before it - rate * its wall time)
+    slack = rate * resolution + 1e-9
+    for batch in range(3000):
+        wall += rng.random() * 0.002
+        replies = answer_lines(tracker, [b"hot"] * rng.randint(1, 20), clock=clock).split(b"\n")[:-1]
+        for reply in replies:
+            if reply.startswith(b"ALLOW"):
+                lowest = min(lowest, admitted - rate * wall)
+                admitted += 1
+                if admitted - rate * wall - lowest > capacity + slack:
+                    print(f"  batch {batch}: a window ending at {wall} admitted more than capacity + {slack} tokens")
+                    return False
+            elif float(reply.split()[2]) < resolution:
+                print(f"  batch {batch}: retry_after {reply} is shorter than the clock resolution")
+                return False
+        if admitted < capacity + rate * (wall - first_wall) - slack - 1:
+            print(f"  batch {batch}: only {admitted} admitted by {wall}, {wall - first_wall}s after the first request")
+            return False
+
+    last_tick = clock.now
+    wall -= 1.0
+    if tick(clock) != last_tick:
+        print("  the coarse clock went backwards with the wall clock")
+        return False
+    return True
+
+
+PROPERTY_CHECKS = [
+    ("Check: Batch Decisions Match Sequential", check_batch_matches_sequential),
+    ("Check: Idle Eviction Preserves Decisions", check_eviction_preserves_decisions),
+    ("Check: Streaming Stops At A Malformed Value", check_streaming_stops_at_malformed_value),
+    ("Check: Concurrent Tracker Never Over-Admits", check_concurrent_no_over_admission),
+    ("Check: Shared Table Enforces One Quota Across Processes", check_shared_one_quota_across_processes),
+    ("Check: Snapshot Restart Preserves Decisions", check_snapshot_restart_preserves_decisions),
+    ("Check: Checkpoint Cancel Waits For Finish", check_checkpoint_cancel_waits_for_finish),
+    ("Check: Config Reload Rebinds Buckets Lazily", check_reload_rebinds_buckets_lazily),
+    ("Check: Weighted Cost Is Atomic", check_weighted_cost_is_atomic),
+    ("Check: Hierarchical Quotas Charge All Levels Atomically", check_hierarchy_is_atomic),
+    ("Check: Concurrent Hierarchy Never Over-Admits", check_concurrent_hierarchy_no_over_admission),
+    ("Check: Async Acquire Is FIFO And Punctual", check_async_acquire_is_fifo_and_punctual),
+    ("Check: Storage Backends Match The In-Process Tracker", check_storage_backends_match_tracker),
+    ("Check: Leases Bound Over-Admission", check_leases_bound_over_admission),
+    ("Check: Sub-Unit Capacity Decides Alike On Every Path", check_sub_unit_capacity_on_every_path),
+    ("Check: Deny Cache Is Exact", check_deny_cache_is_exact),
+    ("Check: Alternative Algorithms Honour Their Limits", check_algorithms_honour_their_limits),
+    ("Check: Metrics Record Every Decision", check_metrics_record_every_decision),
+    ("Check: Trace Replay Matches JSON Scenarios", check_trace_replay_matches_json),
+    ("Check: Fast Output Matches json.dumps", check_fast_output_matches_json_dumps),
+    ("Check: Sharded Replay Matches Serial", check_sharded_replay_matches_serial),
+    ("Check: User Index Matches Inline Users", check_user_index_matches_inline_users),
+    ("Check: Coarse Clock Error Is Bounded", check_coarse_clock_error_is_bounded),
+]
+
+
 def main() -> None:
-    """Run all scenarios, print results, exit 0 if all pass, exit 1 if any fail."""
+    """Run all scenarios and property checks, print results, exit 0 if all pass, exit 1 if any fail."""
     all_passed = True
 
     for scenario in SCENARIOS:
@@ -146,9 +1339,16 @@ def main() -> None:
             print(f"{name} ... FAIL")
             all_passed = False
 
+    for name, check in PROPERTY_CHECKS:
+        if check():
+            print(f"{name} ... PASS")
+        else:
+            print(f"{name} ... FAIL")
+            all_passed = False
+
     print()
     if all_passed:
-        print(f"All {len(SCENARIOS)} scenarios passed.")
+        print(f"All {len(SCENARIOS)} scenarios and {len(PROPERTY_CHECKS)} property checks passed.")
     else:
         print("Some scenarios FAILED.")
         sys.exit(1)